@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Throughput of the PCM post-processing on long responses.
+
+Responses of increasing length, made of speech-like bursts separated by pauses and surrounded by silence, are fed to
+`pcm_helpers.PcmProcessor` in irregular chunks. Peak traced memory is reported too: it should not grow with the
+length of the response.
+
+    python benchmarks/bench_audio.py [--minutes 1 --minutes 10] [--iterations 5]
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+import harness  # noqa: F401
+
+import numpy
+
+SAMPLE_RATE = 16000
+
+
+def make_response(minutes: float, seed: int = 0) -> bytes:
+    """Two seconds of low noise around bursts of 2-6 s of tone, separated by 0.2-1.5 s pauses."""
+    rng = numpy.random.default_rng(seed)
+
+    def noise(seconds: float) -> numpy.ndarray:
+        return (rng.standard_normal(int(seconds * SAMPLE_RATE)) * 20).astype('<i2')
+
+    parts = [noise(2)]
+    remaining = minutes * 60
+    while remaining > 0:
+        seconds = min(remaining, rng.uniform(2, 6))
+        t = numpy.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        parts.append((numpy.sin(2 * numpy.pi * rng.uniform(150, 400) * t) * 3000).astype('<i2'))
+        parts.append(noise(rng.uniform(0.2, 1.5)))
+        remaining -= seconds
+    parts.append(noise(2))
+    return numpy.concatenate(parts).tobytes()
+
+
+def make_chunks(pcm: bytes, seed: int = 0) -> list:
+    """Chunks of 50-200 ms, the sizes the Assistant streams."""
+    rng = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < len(pcm):
+        size = rng.randrange(800, 3200) * 2
+        chunks.append(pcm[i:i + size])
+        i += size
+    return chunks
+
+
+def process(chunks: list) -> int:
+    import pcm_helpers
+    processor = pcm_helpers.new_pcm_processor()
+    size = 0
+    for chunk in chunks:
+        size += len(processor.process(chunk))
+    return size + len(processor.flush())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, action='append', help='response lengths, default: 1, 5, 15')
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%-9s %11s %11s %9s %11s %11s' % ('minutes', 'median [ms]', 'MiB/s', 'realtime', 'output [%]',
+                                            'peak [KiB]'))
+    for minutes in args.minutes or [1, 5, 15]:
+        pcm = make_response(minutes)
+        chunks = make_chunks(pcm)
+
+        timings = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            output_size = process(chunks)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            process(chunks)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        median = statistics.median(timings)
+        duration = len(pcm) / 2 / SAMPLE_RATE
+        print('%-9g %11.1f %11.1f %8.0fx %11.1f %11.1f' % (minutes, median * 1000, len(pcm) / median / 2 ** 20,
+                                                           duration / median, output_size * 100 / len(pcm),
+                                                           peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Selection among several Assistant endpoints, against local fakes answering with different latencies.
+
+Conversations are sent to `assistant.assist_async` in three phases:
+
+    steady     all endpoints healthy: most calls should go to the fastest one
+    outage     the fastest endpoint fails every call with UNAVAILABLE: its circuit opens, calls move to the others
+    recovery   the fastest endpoint is healthy again: a probe lets a call through, and calls come back to it
+
+For every phase and endpoint, the calls it got and the figures the skill holds about it are printed.
+
+    python benchmarks/bench_endpoints.py [--latency 0.05 --latency 0.2 --latency 0.4] [--requests 100]
+"""
+import argparse
+import json
+import statistics
+import time
+
+import harness
+from bench_load import run_async
+from fakes import AudioProfile, FakeEmbeddedAssistant, FaultProfile, start_fake_assistant
+
+# A short answer, so that the time to first byte dominates
+PROFILE = AudioProfile(audio_bytes=32000, chunk_size=1600, first_byte_delay=0.0, chunk_delay=0.0)
+
+PHASES = ('steady', 'outage', 'recovery')
+
+
+def _make_inputs(count: int) -> tuple:
+    event = harness.load_envelope('search')
+    query = event['request']['intent']['slots']['search']['value']
+    return [harness.make_handler_input(json.loads(json.dumps(event))) for _ in range(count)], query
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, action='append',
+                        help='seconds each endpoint waits before answering, default: 0.05, 0.2, 0.4')
+    parser.add_argument('--requests', type=int, default=100, help='conversations per phase')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--probe-interval', type=float, default=0.5, help='seconds between probes of open circuits')
+    args = parser.parse_args()
+
+    import data
+    import endpoint_helpers
+
+    data.ENDPOINT_PROBE_INTERVAL = args.probe_interval
+    latencies = args.latency or [0.05, 0.2, 0.4]
+    backends = harness.FakeBackends(PROFILE)
+    fakes = [start_fake_assistant(FakeEmbeddedAssistant(PROFILE, FaultProfile(latency=latency)))
+             for latency in latencies]
+    endpoint_helpers.configure(endpoint for _, _, endpoint in fakes)
+    fastest = fakes[latencies.index(min(latencies))][1]
+    try:
+        print('%-9s %-16s %11s %6s %7s %10s %-10s %9s' % ('phase', 'endpoint', 'latency [s]', 'calls', 'failed',
+                                                          'ttfb [ms]', 'state', 'p50 [ms]'))
+        for phase in PHASES:
+            if phase == 'outage':
+                fastest.faults.unavailable_rate = 1.0
+            elif phase == 'recovery':
+                fastest.faults.unavailable_rate = 0.0
+                # Time for the probe to find the endpoint reachable
+                time.sleep(args.probe_interval * 2)
+            before = [(servicer.calls, servicer.failures) for _, servicer, _ in fakes]
+            inputs, query = _make_inputs(args.requests)
+            p50 = statistics.median(run_async(inputs, query, args.concurrency))
+            for (_, servicer, host), latency, (calls, failures), endpoint in zip(
+                    fakes, latencies, before, endpoint_helpers.get_endpoints()):
+                figures = endpoint.to_dict()
+                print('%-9s %-16s %11g %6d %7d %10s %-10s %9.1f' % (
+                    phase, host, latency, servicer.calls - calls, servicer.failures - failures,
+                    figures['ttfb_ms'], figures['state'], p50))
+    finally:
+        for server, _, _ in fakes:
+            server.stop(None)
+        backends.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local cost of each audio format the Assistant can be asked for.
+
+    linear16     LINEAR16, post-processed and encoded in-process
+    mp3          MP3 meeting Alexa's constraints, passed through
+    transcoded   MP3 at another bit rate, transcoded by the LAME binary (skipped when it is not installed)
+
+The fake Assistant runs in a child process, so that CPU time only counts the skill's own work.
+
+    python benchmarks/bench_formats.py [--iterations 20]
+"""
+import argparse
+import os
+import statistics
+import time
+
+import harness
+from fakes import AudioProfile
+
+FORMATS = {
+    'linear16': ('LINEAR16', {}),
+    'mp3': ('MP3', {'mp3_bit_rate': 48, 'mp3_sample_rate': 16000}),
+    'transcoded': ('MP3', {'mp3_bit_rate': 32, 'mp3_sample_rate': 24000}),
+}
+
+DURATIONS = {
+    'short': 5,
+    'long': 60,
+}
+
+
+def run(audio_out_encoding: str, profile: AudioProfile, iterations: int) -> dict:
+    import app
+    import audio_helpers
+
+    os.environ['AUDIO_OUT_ENCODING'] = audio_out_encoding
+    backends = harness.FakeBackends(profile, out_of_process=True)
+    try:
+        event = harness.load_envelope('search')
+        # Registers the device and opens the channel
+        app.lambda_handler(event, None)
+
+        wall, cpu = [], []
+        for _ in range(iterations):
+            audio_helpers._mp3_passthrough_usable = True
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            app.lambda_handler(event, None)
+            wall.append((time.perf_counter() - wall_start) * 1000)
+            cpu.append((time.process_time() - cpu_start) * 1000)
+        mp3_size = max(len(obj['Body']) for obj in backends.s3.objects.values())
+    finally:
+        backends.close()
+
+    return {
+        'median_ms': statistics.median(wall),
+        'cpu_ms': statistics.median(cpu),
+        'mp3_kib': mp3_size / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    import audio_helpers
+    has_lame = os.path.exists(audio_helpers._lame_path())
+
+    print('%-8s %-11s %11s %9s %9s' % ('scenario', 'format', 'median [ms]', 'cpu [ms]', 'mp3 [KiB]'))
+    for scenario, seconds in DURATIONS.items():
+        for name, (audio_out_encoding, mp3_settings) in FORMATS.items():
+            if name == 'transcoded' and not has_lame:
+                print('%-8s %-11s %11s' % (scenario, name, 'no LAME'))
+                continue
+            profile = AudioProfile(audio_bytes=32000 * seconds, chunk_size=1600, **mp3_settings)
+            result = run(audio_out_encoding, profile, args.iterations)
+            print('%-8s %-11s %11.1f %9.1f %9.1f' % (scenario, name, result['median_ms'], result['cpu_ms'],
+                                                     result['mp3_kib']))
+
+
+if __name__ == '__main__':
+    main()
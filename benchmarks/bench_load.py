@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Throughput of many concurrent conversations against a local fake Assistant.
+
+Three ways of serving the same requests are compared:
+
+    blocking  one thread per conversation running the former blocking path: a synchronous gRPC call, with encoding
+              and uploading done inline as the audio arrives
+    threads   one thread per conversation calling the synchronous `assistant.assist` wrapper
+    async     all conversations as coroutines of `assistant.assist_async` on the shared event loop
+
+    python benchmarks/bench_load.py [--requests 200] [--concurrency 10 --concurrency 100] [--json results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import harness
+from fakes import AudioProfile
+
+import grpc
+from google.assistant.embedded.v1alpha2 import embedded_assistant_pb2_grpc
+
+MODES = ('blocking', 'threads', 'async')
+
+# A short answer, streamed at roughly the pace of the real API
+PROFILE = AudioProfile(audio_bytes=32000 * 5, chunk_size=1600, first_byte_delay=0.3, chunk_delay=0.002)
+
+
+def _make_inputs(count: int) -> tuple:
+    event = harness.load_envelope('search')
+    query = event['request']['intent']['slots']['search']['value']
+    inputs = []
+    for i in range(count):
+        event['context']['System']['device']['deviceId'] = 'amzn1.ask.device.load%d' % i
+        inputs.append(harness.make_handler_input(json.loads(json.dumps(event))))
+    return inputs, query
+
+
+def _assist_blocking(channel: grpc.Channel, handler_input, text_query: str) -> None:
+    import assistant
+    import audio_helpers
+    import aws_helpers
+    import data
+    import skill_helpers
+    import storage_helpers
+
+    s3 = aws_helpers.get_client('s3')
+    bucket = os.environ['S3_BUCKET']
+    key = skill_helpers.get_audio_key(handler_input)
+    stub = embedded_assistant_pb2_grpc.EmbeddedAssistantStub(channel)
+    encoder = audio_helpers.new_mp3_encoder()
+    writer = storage_helpers.S3AudioWriter(s3, bucket, key)
+    for resp in stub.Assist(assistant._iter_assist_requests(handler_input, text_query), data.ALEXA_RESPONSE_TIMEOUT):
+        if resp.audio_out.audio_data:
+            writer.write(encoder.encode(audio_helpers.align_buf(resp.audio_out.audio_data,
+                                                                data.DEFAULT_AUDIO_SAMPLE_WIDTH)))
+    writer.write(encoder.flush())
+    writer.close()
+    s3.generate_presigned_url(ClientMethod='get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=10)
+
+
+def _timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_threads(fn, inputs: list, query: str, concurrency: int) -> list:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda handler_input: _timed(fn, handler_input, query), inputs))
+
+
+def run_async(inputs: list, query: str, concurrency: int) -> list:
+    import assistant
+    import async_helpers
+
+    async def run_all() -> list:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(handler_input) -> float:
+            async with semaphore:
+                start = time.perf_counter()
+                await assistant.assist_async(handler_input, query)
+                return (time.perf_counter() - start) * 1000
+
+        return await asyncio.gather(*(one(handler_input) for handler_input in inputs))
+
+    return async_helpers.run(run_all())
+
+
+def run_mode(mode: str, backends: harness.FakeBackends, requests: int, concurrency: int) -> dict:
+    import assistant
+
+    inputs, query = _make_inputs(requests)
+    start = time.perf_counter()
+    if mode == 'blocking':
+        channel = grpc.insecure_channel(backends.endpoint)
+        try:
+            latencies = run_threads(lambda handler_input, text_query: _assist_blocking(channel, handler_input,
+                                                                                       text_query),
+                                    inputs, query, concurrency)
+        finally:
+            channel.close()
+    elif mode == 'threads':
+        latencies = run_threads(assistant.assist, inputs, query, concurrency)
+    else:
+        latencies = run_async(inputs, query, concurrency)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests_per_s': round(requests / elapsed, 1),
+        'median_ms': round(statistics.median(latencies), 1),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, action='append', help='in-flight conversations, default: 10, 100')
+    parser.add_argument('--mode', action='append', choices=MODES, help='default: all')
+    parser.add_argument('--s3-latency', type=float, default=0.02, help='seconds added to every S3 call')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    levels = args.concurrency or [10, 100]
+    backends = harness.FakeBackends(PROFILE, s3_latency=args.s3_latency, max_workers=max(levels) + 8,
+                                   out_of_process=True)
+    try:
+        results = {}
+        print('%-9s %11s %9s %11s %11s' % ('mode', 'concurrency', 'req/s', 'median [ms]', 'p95 [ms]'))
+        for concurrency in levels:
+            for mode in args.mode or MODES:
+                result = run_mode(mode, backends, args.requests, concurrency)
+                results.setdefault(mode, {})[str(concurrency)] = result
+                print('%-9s %11d %9.1f %11.1f %11.1f' % (mode, concurrency, result['requests_per_s'],
+                                                         result['median_ms'], result['p95_ms']))
+    finally:
+        backends.close()
+
+    if args.json:
+        with open(os.path.join(harness.ORIGINAL_CWD, args.json), 'w') as fp:
+            json.dump(results, fp, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
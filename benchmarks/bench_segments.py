@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Single-shot against segmented MP3 encoding of whole responses.
+
+Responses of increasing length, made of speech-like bursts and pauses (see `bench_audio.py`), are encoded at once,
+as they are when the Assistant sends its audio faster than it can be encoded:
+
+    single      one encoder run, on one core
+    segmented   `audio_helpers.SegmentedEncoder`, as if the function had the given number of vCPUs
+
+Segmented encoding only pays off with at least as many cores as workers: compare the wall time with the CPU time,
+and with `nproc`. The added column is the audio the cuts add, in milliseconds, from the encoder delay and padding of
+every segment. The LAME binary is benchmarked as well when it is installed.
+
+    python benchmarks/bench_segments.py [--seconds 10 --seconds 60] [--workers 2 --workers 4] [--iterations 5]
+"""
+import argparse
+import os
+import statistics
+import time
+
+import harness  # noqa: F401
+
+from bench_audio import make_response
+
+
+def _frames_ms(mp3: bytes) -> float:
+    import mp3_helpers
+    validator = mp3_helpers.Mp3StreamValidator()
+    validator.feed(mp3)
+    validator.close()
+    return validator.frames * 576 / 16
+
+
+def run(new_encoder, pcm: bytes, workers: int, iterations: int) -> dict:
+    import audio_helpers
+
+    audio_helpers.get_encoding_workers = lambda: workers
+    audio_helpers._executor = None
+    wall, cpu = [], []
+    for _ in range(iterations):
+        if workers:
+            encoder = audio_helpers.SegmentedEncoder(new_encoder, 16000, 2)
+        else:
+            encoder = new_encoder(16000, 2)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        mp3 = encoder.encode(pcm) + encoder.flush()
+        wall.append((time.perf_counter() - wall_start) * 1000)
+        cpu.append((time.process_time() - cpu_start) * 1000)
+    return {'median_ms': statistics.median(wall), 'cpu_ms': statistics.median(cpu), 'audio_ms': _frames_ms(mp3)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, action='append', help='response lengths, default: 10, 30, 60, 180')
+    parser.add_argument('--workers', type=int, action='append', help='vCPUs to segment for, default: 2, 4, 6')
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    import audio_helpers
+    encoders = {'lameenc': audio_helpers.LameEncoder}
+    if os.path.exists(audio_helpers._lame_path()):
+        encoders['binary'] = audio_helpers.LameProcessEncoder
+
+    print('%d vCPUs available' % audio_helpers.get_encoding_workers())
+    print('%-8s %-8s %-12s %11s %9s %10s' % ('encoder', 'seconds', 'mode', 'median [ms]', 'cpu [ms]', 'added [ms]'))
+    for name, new_encoder in encoders.items():
+        for seconds in args.seconds or [10, 30, 60, 180]:
+            pcm = make_response(seconds / 60)
+            single = run(new_encoder, pcm, 0, args.iterations)
+            print('%-8s %-8g %-12s %11.1f %9.1f %10s' % (name, seconds, 'single', single['median_ms'],
+                                                          single['cpu_ms'], '-'))
+            for workers in args.workers or [2, 4, 6]:
+                result = run(new_encoder, pcm, workers, args.iterations)
+                print('%-8s %-8g %-12s %11.1f %9.1f %10.0f' % (
+                    name, seconds, 'segmented/%d' % workers, result['median_ms'], result['cpu_ms'],
+                    result['audio_ms'] - single['audio_ms']))
+
+
+if __name__ == '__main__':
+    main()
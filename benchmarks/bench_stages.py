@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Offline per-stage benchmark of the assist path.
+
+Every stage of a request is run against local fakes and timed separately, then run once more under tracemalloc to
+measure its allocations. Results are compared with `baseline.json`, and the script exits with status 1 when a stage
+got slower than the baseline by more than the tolerance.
+
+    python benchmarks/bench_stages.py [--iterations 20] [--update-baseline] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import harness
+from fakes import AudioProfile
+from google.assistant.embedded.v1alpha2 import embedded_assistant_pb2_grpc
+
+BASELINE_FILE = os.path.join(harness.BENCH_ROOT, 'baseline.json')
+
+SCENARIOS = {
+    # A short factual answer: 5 seconds of audio in regular chunks
+    'short': AudioProfile(audio_bytes=32000 * 5, chunk_size=1600),
+    # A news briefing: 60 seconds of audio in irregular, partly odd-sized chunks
+    'long': AudioProfile(audio_bytes=32000 * 60, chunk_size=1600, jitter=0.3),
+}
+
+
+def measure(fn, iterations: int) -> dict:
+    """Time `iterations` runs of `fn`, then trace the allocations of one more."""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'peak_kib': round(peak / 1024, 1),
+        'retained_kib': round(current / 1024, 1),
+    }
+
+
+def run_scenario(profile: AudioProfile, iterations: int) -> dict:
+    import app
+    import assistant
+    import async_helpers
+    import audio_helpers
+    import aws_helpers
+    import channel_helpers
+    import data
+    import pcm_helpers
+    import skill_helpers
+    import storage_helpers
+
+    backends = harness.FakeBackends(profile)
+    try:
+        event = harness.load_envelope('search')
+        query = event['request']['intent']['slots']['search']['value']
+        bucket = os.environ['S3_BUCKET']
+        results = {}
+
+        def preflight():
+            handler_input = harness.make_handler_input(event)
+            app.preflight_check(lambda h: None)(handler_input)
+
+        # The first preflight registers the device, the benchmark measures the common case where it is known
+        preflight()
+        results['preflight'] = measure(preflight, iterations)
+
+        handler_input = harness.make_handler_input(event)
+        credentials = skill_helpers.get_credentials(handler_input)
+        chunks = []
+
+        async def receive():
+            stub = embedded_assistant_pb2_grpc.EmbeddedAssistantStub(
+                channel_helpers.get_channel(credentials, data.GOOGLE_ASSISTANT_API['api_endpoint']))
+            async for resp in stub.Assist(assistant._iter_assist_requests(handler_input, query),
+                                          data.ALEXA_RESPONSE_TIMEOUT):
+                if resp.audio_out.audio_data:
+                    chunks.append(resp.audio_out.audio_data)
+
+        def grpc_receive():
+            del chunks[:]
+            async_helpers.run(receive())
+
+        results['grpc_receive'] = measure(grpc_receive, iterations)
+        aligned = []
+
+        def align():
+            del aligned[:]
+            for chunk in chunks:
+                aligned.append(audio_helpers.align_buf(chunk, data.DEFAULT_AUDIO_SAMPLE_WIDTH))
+
+        results['align_buf'] = measure(align, iterations)
+
+        def postprocess():
+            processor = pcm_helpers.new_pcm_processor()
+            for chunk in aligned:
+                processor.process(chunk)
+            processor.flush()
+
+        results['postprocess'] = measure(postprocess, iterations)
+        mp3 = []
+
+        def encode():
+            del mp3[:]
+            encoder = audio_helpers.new_mp3_encoder()
+            for chunk in aligned:
+                mp3.append(encoder.encode(chunk))
+            mp3.append(encoder.flush())
+
+        results['encode'] = measure(encode, iterations)
+
+        def upload():
+            writer = storage_helpers.S3AudioWriter(aws_helpers.get_client('s3'), bucket, 'bench')
+            for frames in mp3:
+                writer.write(frames)
+            writer.close()
+
+        results['upload'] = measure(upload, iterations)
+
+        def presign():
+            aws_helpers.get_client('s3').generate_presigned_url(
+                ClientMethod='get_object', Params={'Bucket': bucket, 'Key': 'bench'}, ExpiresIn=10)
+
+        results['presign'] = measure(presign, iterations)
+
+        def end_to_end():
+            app.lambda_handler(event, None)
+
+        results['end_to_end'] = measure(end_to_end, iterations)
+        return results
+    finally:
+        backends.close()
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_ms: float) -> list:
+    regressions = []
+    for scenario, stages in results.items():
+        for stage, result in stages.items():
+            reference = baseline.get(scenario, {}).get(stage)
+            if reference is None:
+                continue
+            slower = result['median_ms'] - reference['median_ms']
+            if slower > min_ms and result['median_ms'] > reference['median_ms'] * (1 + tolerance):
+                regressions.append('%s/%s: %.3f ms -> %.3f ms' % (scenario, stage, reference['median_ms'],
+                                                                  result['median_ms']))
+    return regressions
+
+
+def print_report(results: dict, baseline: dict) -> None:
+    print('%-8s %-14s %11s %11s %11s %11s' % ('scenario', 'stage', 'median [ms]', 'p95 [ms]', 'peak [KiB]',
+                                              'baseline'))
+    for scenario, stages in results.items():
+        for stage, result in stages.items():
+            reference = baseline.get(scenario, {}).get(stage, {}).get('median_ms')
+            print('%-8s %-14s %11.3f %11.3f %11.1f %11s' % (scenario, stage, result['median_ms'], result['p95_ms'],
+                                                            result['peak_kib'],
+                                                            '-' if reference is None else '%.3f' % reference))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='default: all')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true', help='overwrite the baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown per stage')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='ignore slowdowns smaller than this')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenario or sorted(SCENARIOS):
+        results[name] = run_scenario(SCENARIOS[name], args.iterations)
+
+    args.baseline = os.path.join(harness.ORIGINAL_CWD, args.baseline)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+
+    print_report(results, baseline)
+
+    if args.json:
+        with open(os.path.join(harness.ORIGINAL_CWD, args.json), 'w') as fp:
+            json.dump(results, fp, indent=4, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump(results, fp, indent=4, sort_keys=True)
+            fp.write('\n')
+        return
+
+    regressions = compare(results, baseline, args.tolerance, args.min_ms)
+    if regressions:
+        print('\nRegressions against %s:' % args.baseline)
+        for regression in regressions:
+            print('  ' + regression)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
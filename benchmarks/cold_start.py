@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cold-start timing report.
+
+Imports the skill in a fresh interpreter with `-X importtime` and reports how much of the import time goes to each
+top-level package, optionally followed by a warm-up event so that lazily loaded modules are measured too.
+
+    python benchmarks/cold_start.py [--warmup] [--top 20]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+LAMBDA_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'py')
+
+_SCRIPT = '''
+import time
+start = time.perf_counter()
+import app
+print('import app: %.1f ms' % ((time.perf_counter() - start) * 1000))
+if {warmup}:
+    start = time.perf_counter()
+    app.lambda_handler({{'warmup': True}}, None)
+    print('warm-up event: %.1f ms' % ((time.perf_counter() - start) * 1000))
+'''
+
+
+def parse_importtime(stderr: str) -> list:
+    """Return (self_us, cumulative_us, depth, module) for every `-X importtime` line."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--warmup', action='store_true', help='also measure a warm-up event after the import')
+    parser.add_argument('--top', type=int, default=20, help='number of packages to report')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('S3_BUCKET', 'cold-start-bucket')
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('LAMBDA_TASK_ROOT', LAMBDA_ROOT)
+
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _SCRIPT.format(warmup=args.warmup)],
+                          cwd=LAMBDA_ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        sys.exit(proc.returncode)
+
+    self_time = defaultdict(int)
+    for self_us, _, _, name in parse_importtime(proc.stderr):
+        self_time[name.split('.')[0]] += self_us
+
+    print(proc.stdout.strip())
+    print()
+    print('%-40s %10s' % ('package', 'self [ms]'))
+    for name, us in sorted(self_time.items(), key=lambda item: -item[1])[:args.top]:
+        print('%-40s %10.1f' % (name, us / 1000))
+    print('%-40s %10.1f' % ('total', sum(self_time.values()) / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local stand-ins for the Google Assistant gRPC API, S3 and DynamoDB."""
+import datetime
+import math
+import multiprocessing
+import random
+import threading
+import time
+from concurrent import futures
+
+import boto3
+import botocore.exceptions
+import grpc
+from google.assistant.embedded.v1alpha2 import embedded_assistant_pb2, embedded_assistant_pb2_grpc
+
+
+class AudioProfile(object):
+    """Shape of the audio streamed back by the fake Assistant.
+
+    `audio_bytes` of PCM are sent in chunks of `chunk_size` bytes; with `jitter` set, chunk sizes vary randomly by up
+    to that fraction and may be odd, like the ones the real API sends. `first_byte_delay` and `chunk_delay` are in
+    seconds. When MP3 is requested, the same duration of audio is encoded at `mp3_bit_rate` kbps and
+    `mp3_sample_rate` Hz, and sent in as many chunks.
+    """
+
+    def __init__(self,
+                 audio_bytes: int = 32000 * 5,
+                 chunk_size: int = 1600,
+                 jitter: float = 0.0,
+                 first_byte_delay: float = 0.0,
+                 chunk_delay: float = 0.0,
+                 text: str = 'This is a fake Assistant response.',
+                 follow_on: bool = False,
+                 seed: int = 0,
+                 mp3_bit_rate: int = 48,
+                 mp3_sample_rate: int = 16000) -> None:
+        self.audio_bytes = audio_bytes
+        self.chunk_size = chunk_size
+        self.jitter = jitter
+        self.first_byte_delay = first_byte_delay
+        self.chunk_delay = chunk_delay
+        self.text = text
+        self.follow_on = follow_on
+        self.seed = seed
+        self.mp3_bit_rate = mp3_bit_rate
+        self.mp3_sample_rate = mp3_sample_rate
+        self._mp3 = None
+
+    def chunks(self) -> list:
+        rng = random.Random(self.seed)
+        sizes = []
+        remaining = self.audio_bytes
+        while remaining > 0:
+            size = self.chunk_size
+            if self.jitter:
+                size = max(1, int(size * (1 + rng.uniform(-self.jitter, self.jitter))))
+            size = min(size, remaining)
+            sizes.append(size)
+            remaining -= size
+        return sizes
+
+    def mp3_chunks(self) -> list:
+        if self._mp3 is None:
+            import lameenc
+            encoder = lameenc.Encoder()
+            encoder.set_in_sample_rate(self.mp3_sample_rate)
+            encoder.set_channels(1)
+            encoder.set_bit_rate(self.mp3_bit_rate)
+            pcm_bytes = self.audio_bytes * self.mp3_sample_rate // 16000 // 2 * 2
+            self._mp3 = bytes(encoder.encode(_tone(pcm_bytes))) + bytes(encoder.flush())
+        count = len(self.chunks())
+        size = -(-len(self._mp3) // count)
+        return [self._mp3[i:i + size] for i in range(0, len(self._mp3), size)]
+
+
+class FaultProfile(object):
+    """Latency and failures injected by the fake Assistant.
+
+    Every call waits `latency` seconds, plus up to `latency_jitter` more at random, before its first byte. Calls fail
+    with UNAVAILABLE with probability `unavailable_rate`, and all of them do during bursts of `burst_length` seconds
+    starting every `burst_every` seconds, counted from the start of the fake.
+    """
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 latency_jitter: float = 0.0,
+                 unavailable_rate: float = 0.0,
+                 burst_every: float = 0.0,
+                 burst_length: float = 0.0,
+                 seed: int = 0) -> None:
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.unavailable_rate = unavailable_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.seed = seed
+
+    def in_burst(self, elapsed: float) -> bool:
+        return bool(self.burst_every) and elapsed % self.burst_every < self.burst_length
+
+
+def _tone(size: int, period: int = 40) -> bytes:
+    """Some audible 16-bit PCM, so that encoders do real work."""
+    samples = bytearray()
+    for i in range(period):
+        value = int(8000 * math.sin(2 * math.pi * i / period))
+        samples += value.to_bytes(2, 'little', signed=True)
+    return (bytes(samples) * (size // len(samples) + 1))[:size]
+
+
+class FakeEmbeddedAssistant(embedded_assistant_pb2_grpc.EmbeddedAssistantServicer):
+    def __init__(self, profile: AudioProfile = None, faults: FaultProfile = None) -> None:
+        self.profile = profile or AudioProfile()
+        self.faults = faults or FaultProfile()
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.faults.seed)
+        self._start = time.monotonic()
+
+    def Assist(self, request_iterator, context):
+        profile = self.profile
+        faults = self.faults
+        with self._lock:
+            self.calls += 1
+            delay = faults.latency + self._rng.uniform(0, faults.latency_jitter)
+            fail = faults.in_burst(time.monotonic() - self._start) or self._rng.random() < faults.unavailable_rate
+            if fail:
+                self.failures += 1
+        config = next(request_iterator).config
+
+        if fail:
+            context.abort(grpc.StatusCode.UNAVAILABLE, 'Injected fault')
+        time.sleep(profile.first_byte_delay + delay)
+        if config.audio_out_config.encoding == embedded_assistant_pb2.AudioOutConfig.MP3:
+            chunks = profile.mp3_chunks()
+        else:
+            audio = _tone(max(profile.chunks() or [0]))
+            chunks = [audio[:size] for size in profile.chunks()]
+        for chunk in chunks:
+            if not context.is_active():
+                return
+            yield embedded_assistant_pb2.AssistResponse(
+                audio_out=embedded_assistant_pb2.AudioOut(audio_data=chunk))
+            if profile.chunk_delay:
+                time.sleep(profile.chunk_delay)
+
+        mode = (embedded_assistant_pb2.DialogStateOut.DIALOG_FOLLOW_ON if profile.follow_on
+                else embedded_assistant_pb2.DialogStateOut.CLOSE_MICROPHONE)
+        state = (config.text_query or 'state').encode('utf-8') * 8
+        yield embedded_assistant_pb2.AssistResponse(
+            dialog_state_out=embedded_assistant_pb2.DialogStateOut(
+                supplemental_display_text=profile.text,
+                conversation_state=state,
+                microphone_mode=mode))
+
+
+def start_fake_assistant(servicer: FakeEmbeddedAssistant = None, max_workers: int = 16) -> tuple:
+    """Serve `servicer` on a random local port, returning the server, the servicer and the endpoint."""
+    servicer = servicer or FakeEmbeddedAssistant()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    embedded_assistant_pb2_grpc.add_EmbeddedAssistantServicer_to_server(servicer, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    return server, servicer, '127.0.0.1:%d' % port
+
+
+def _serve_forever(profile: AudioProfile, faults: FaultProfile, max_workers: int, conn) -> None:
+    server, _, endpoint = start_fake_assistant(FakeEmbeddedAssistant(profile, faults), max_workers)
+    conn.send(endpoint)
+    server.wait_for_termination()
+
+
+def spawn_fake_assistant(profile: AudioProfile = None, max_workers: int = 16, faults: FaultProfile = None) -> tuple:
+    """Serve a fake Assistant from a child process, so that it does not compete with the skill for the GIL.
+
+    Returns the process, to be terminated by the caller, and the endpoint.
+    """
+    context = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=_serve_forever, args=(profile, faults, max_workers, child_conn), daemon=True)
+    process.start()
+    return process, parent_conn.recv()
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _client_error(code: str, operation: str) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError({'Error': {'Code': code}}, operation)
+
+
+class FakeS3(object):
+    """In-memory subset of the boto3 S3 client used by the skill.
+
+    Presigned URLs are generated by a real client with dummy credentials, which does not need the network. Calls fail
+    with probability `error_rate`.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.objects = {}
+        self.calls = 0
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._signer = boto3.client('s3', region_name='us-east-1', aws_access_key_id='fake',
+                                    aws_secret_access_key='fake')
+
+    def _call(self) -> None:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise _client_error('InternalError', 'S3')
+
+    def put_object(self, Body: bytes, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call()
+        with self._lock:
+            self.objects[(Bucket, Key)] = {'Body': bytes(Body), 'LastModified': _now()}
+        return {'ETag': '"%d"' % len(Body)}
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, **kwargs) -> None:
+        with open(Filename, 'rb') as fp:
+            self.put_object(Body=fp.read(), Bucket=Bucket, Key=Key)
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call()
+        upload_id = 'upload-%d' % len(self._uploads)
+        self._uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Body: bytes, Bucket: str, Key: str, UploadId: str, PartNumber: int, **kwargs) -> dict:
+        self._call()
+        self._uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': '"%d-%d"' % (PartNumber, len(Body))}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict,
+                                  **kwargs) -> dict:
+        self._call()
+        parts = self._uploads.pop(UploadId)
+        body = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+        with self._lock:
+            self.objects[(Bucket, Key)] = {'Body': body, 'LastModified': _now()}
+        return {}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self._call()
+        self._uploads.pop(UploadId, None)
+        return {}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call()
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise _client_error('404', 'HeadObject')
+        return {'ContentLength': len(obj['Body']), 'LastModified': obj['LastModified']}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call()
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod: str, Params: dict, ExpiresIn: int = 3600, **kwargs) -> str:
+        return self._signer.generate_presigned_url(ClientMethod=ClientMethod, Params=Params, ExpiresIn=ExpiresIn)
+
+
+class _FakeTable(object):
+    def __init__(self, db: 'FakeDynamoDb', name: str) -> None:
+        self._db = db
+        self._name = name
+
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        self._db._call()
+        item = self._db.items.get((self._name, tuple(Key.items())))
+        return {'Item': item} if item is not None else {}
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        self._db._call()
+        key = tuple((k, v) for k, v in Item.items() if k == 'id')
+        self._db.items[(self._name, key)] = Item
+        return {}
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        self._db._call()
+        self._db.items.pop((self._name, tuple(Key.items())), None)
+        return {}
+
+
+class _FakeDynamoDbClient(object):
+    class exceptions(object):
+        class ResourceNotFoundException(Exception):
+            pass
+
+        class ResourceInUseException(Exception):
+            pass
+
+    def __init__(self, db: 'FakeDynamoDb') -> None:
+        self._db = db
+
+    def describe_table(self, TableName: str) -> dict:
+        self._db._call(faulty=False)
+        if TableName not in self._db.tables:
+            raise self.exceptions.ResourceNotFoundException(TableName)
+        return {'Table': {'TableName': TableName, 'TableStatus': 'ACTIVE'}}
+
+    def create_table(self, TableName: str, **kwargs) -> dict:
+        self._db._call(faulty=False)
+        if TableName in self._db.tables:
+            raise self.exceptions.ResourceInUseException(TableName)
+        self._db.tables.add(TableName)
+        return {}
+
+    def get_waiter(self, name: str):
+        class _Waiter(object):
+            @staticmethod
+            def wait(**kwargs) -> None:
+                pass
+        return _Waiter()
+
+
+class FakeDynamoDb(object):
+    """In-memory subset of the boto3 DynamoDB resource used by the ASK persistence adapter. Item calls fail with
+    probability `error_rate`."""
+
+    def __init__(self, latency: float = 0.0, tables: tuple = (), error_rate: float = 0.0) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tables = set(tables)
+        self.items = {}
+        self.calls = 0
+        self.meta = type('meta', (object,), {'client': _FakeDynamoDbClient(self)})()
+
+    def _call(self, faulty: bool = True) -> None:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if faulty and self.error_rate and random.random() < self.error_rate:
+            raise _client_error('InternalServerError', 'DynamoDB')
+
+    def Table(self, name: str) -> _FakeTable:
+        return _FakeTable(self, name)
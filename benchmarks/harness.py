@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Wiring of the skill to the local fakes, shared by the benchmarks.
+
+Importing this module puts the Lambda sources on `sys.path`, moves into their directory (translations are looked up
+relative to it) and sets the environment the skill expects.
+"""
+import json
+import os
+import random
+import sys
+import threading
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_ROOT = os.path.normpath(os.path.join(BENCH_ROOT, '..', 'lambda', 'py'))
+ENVELOPES_DIR = os.path.join(BENCH_ROOT, 'envelopes')
+
+# Relative paths given on the command line are relative to this, not to LAMBDA_ROOT
+ORIGINAL_CWD = os.getcwd()
+
+sys.path.insert(0, LAMBDA_ROOT)
+os.chdir(LAMBDA_ROOT)
+os.environ.setdefault('S3_BUCKET', 'bench-bucket')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('LAMBDA_TASK_ROOT', LAMBDA_ROOT)
+
+import grpc  # noqa: E402
+from ask_sdk_core.attributes_manager import AttributesManager  # noqa: E402
+from ask_sdk_core.handler_input import HandlerInput  # noqa: E402
+from ask_sdk_core.serialize import DefaultSerializer  # noqa: E402
+from ask_sdk_model import RequestEnvelope  # noqa: E402
+
+import fakes  # noqa: E402
+
+_serializer = DefaultSerializer()
+
+
+def load_envelope(name: str) -> dict:
+    with open(os.path.join(ENVELOPES_DIR, name + '.json')) as fp:
+        return json.load(fp)
+
+
+def make_handler_input(event: dict) -> HandlerInput:
+    """Build the HandlerInput the skill would see for `event`.
+
+    The request context, and with it the time budget, is built on first use rather than by `app.init_context`, so that
+    inputs can be prepared ahead of a run.
+    """
+    import app
+    envelope = _serializer.deserialize(payload=json.dumps(event), obj_type=RequestEnvelope)
+    handler_input = HandlerInput(
+        request_envelope=envelope,
+        attributes_manager=AttributesManager(request_envelope=envelope,
+                                             persistence_adapter=app._persistence_adapter))
+    return handler_input
+
+
+class FakeBackends(object):
+    """Points the skill at a local fake Assistant, an in-memory S3 and an in-memory DynamoDB.
+
+    Device registration and progressive responses, which would reach Google and Amazon, are only counted.
+    """
+
+    def __init__(self,
+                 profile: 'fakes.AudioProfile' = None,
+                 s3_latency: float = 0.0,
+                 dynamodb_latency: float = 0.0,
+                 registration_latency: float = 0.0,
+                 max_workers: int = 16,
+                 out_of_process: bool = False,
+                 faults: 'fakes.FaultProfile' = None,
+                 s3_error_rate: float = 0.0,
+                 dynamodb_error_rate: float = 0.0,
+                 registration_error_rate: float = 0.0) -> None:
+        import aws_helpers
+        import channel_helpers
+        import data
+        import device_helpers
+        import endpoint_helpers
+        import skill_helpers
+        import storage_helpers
+
+        self.server = self.assistant = self.process = None
+        if out_of_process:
+            # The servicer, and so its call count, lives in the child process
+            self.process, self.endpoint = fakes.spawn_fake_assistant(profile, max_workers=max_workers, faults=faults)
+        else:
+            self.server, self.assistant, self.endpoint = fakes.start_fake_assistant(
+                fakes.FakeEmbeddedAssistant(profile, faults), max_workers=max_workers)
+        self.s3 = fakes.FakeS3(latency=s3_latency, error_rate=s3_error_rate)
+        self.dynamodb = fakes.FakeDynamoDb(latency=dynamodb_latency, tables=(data.DYNAMODB_TABLE,),
+                                           error_rate=dynamodb_error_rate)
+        self.registration_latency = registration_latency
+        self.registration_error_rate = registration_error_rate
+        self.registrations = 0
+        self.progressive_responses = 0
+        self._lock = threading.Lock()
+
+        aws_helpers._clients['s3'] = self.s3
+        aws_helpers._resources['dynamodb'] = self.dynamodb
+        # Built again on first use, on top of the fake S3 or as a fresh local origin
+        storage_helpers._storage = None
+        data.GOOGLE_ASSISTANT_API['api_endpoint'] = self.endpoint
+        endpoint_helpers.configure([self.endpoint])
+        channel_helpers._create_channel = lambda credentials, api_endpoint: grpc.aio.insecure_channel(api_endpoint)
+        device_helpers.register_device_async = self._register_device
+        device_helpers._verified.clear()
+        skill_helpers.send_progressive_response = self._send_progressive_response
+
+    async def _register_device(self, project_id, credentials, device_model_id, device_id, *args, **kwargs) -> None:
+        import asyncio
+        from device_helpers import RegistrationError
+        with self._lock:
+            self.registrations += 1
+        if self.registration_latency:
+            await asyncio.sleep(self.registration_latency)
+        if self.registration_error_rate and random.random() < self.registration_error_rate:
+            raise RegistrationError(503, '{"error": {"message": "Injected fault", "status": "UNAVAILABLE"}}',
+                                    device_model_id)
+
+    def _send_progressive_response(self, handler_input: HandlerInput, speech: str) -> None:
+        with self._lock:
+            self.progressive_responses += 1
+
+    def close(self) -> None:
+        import channel_helpers
+        channel_helpers.close_all()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+        else:
+            self.server.stop(None)
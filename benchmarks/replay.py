@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Replay of Alexa traffic through `app.lambda_handler`, against the local fakes.
+
+Sessions come from a corpus of request envelopes, one JSON envelope per line, grouped by session ID in file order. Or
+they are synthesized: a launch, a few searches and the end of the session, for users spread over the given locales.
+Users switch between their Echo devices from one session to the next. Each user's first request registers the
+device, as it finds no registration in the (fake) persistent storage.
+
+The requests of a session are sent in order, each carrying the session attributes returned for the previous one.
+Up to `--concurrency` sessions run at a time, and requests start at no more than `--rate` per second. Latency and
+faults can be injected into every fake.
+
+    python benchmarks/replay.py [--sessions 100 --users 20 --turns 3] [--concurrency 10] [--rate 20]
+    python benchmarks/replay.py --unavailable-rate 0.05 --burst-every 10 --burst-length 1
+    python benchmarks/replay.py --sessions 50 --record corpus.jsonl
+    python benchmarks/replay.py --corpus corpus.jsonl --json results.json
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import random
+import resource
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import harness
+from fakes import AudioProfile, FaultProfile
+
+QUERIES = ('why the sky is blue', 'who is the queen', 'what time is it', 'how tall is the eiffel tower',
+           'tell me a joke', 'what is the weather like')
+
+# A short answer, streamed at roughly the pace of the real API
+PROFILE = AudioProfile(audio_bytes=32000 * 5, chunk_size=1600, first_byte_delay=0.3, chunk_delay=0.002)
+
+# Metrics of the invocations, summed over the replay
+COUNTED_METRICS = ('retries', 'hedges', 'deadline_exceeded')
+
+
+def _envelope(name: str, session_id: str, user_id: str, device_id: str, locale: str, new: bool) -> dict:
+    event = harness.load_envelope(name)
+    for user in (event['session']['user'], event['context']['System']['user']):
+        user['userId'] = user_id
+    event['session']['sessionId'] = session_id
+    event['session']['new'] = new
+    event['context']['System']['device']['deviceId'] = device_id
+    event['request']['locale'] = locale
+    event['request']['timestamp'] = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return event
+
+
+def synthesize(sessions: int, users: int, locales: list, turns: int, devices: int, seed: int = 0) -> list:
+    """Sessions of a launch, `turns` searches and the session end, as lists of envelopes."""
+    rng = random.Random(seed)
+    user_locales = [rng.choice(locales) for _ in range(users)]
+    corpus = []
+    for i in range(sessions):
+        user = rng.randrange(users)
+        user_id = 'amzn1.ask.account.REPLAY%04d' % user
+        device_id = 'amzn1.ask.device.REPLAY%04d-%d' % (user, rng.randrange(devices))
+        session_id = 'amzn1.echo-api.session.replay-%06d' % i
+        locale = user_locales[user]
+
+        session = [_envelope('launch', session_id, user_id, device_id, locale, new=True)]
+        for _ in range(turns):
+            event = _envelope('search', session_id, user_id, device_id, locale, new=False)
+            event['request']['intent']['slots']['search']['value'] = rng.choice(QUERIES)
+            session.append(event)
+        session.append(_envelope('session_ended', session_id, user_id, device_id, locale, new=False))
+        for j, event in enumerate(session):
+            event['request']['requestId'] = 'amzn1.echo-api.request.replay-%06d-%d' % (i, j)
+        corpus.append(session)
+    return corpus
+
+
+def load_corpus(path: str) -> list:
+    sessions = OrderedDict()
+    with open(path) as fp:
+        for i, line in enumerate(fp):
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            session_id = event.get('session', {}).get('sessionId') or 'line-%d' % i
+            sessions.setdefault(session_id, []).append(event)
+    return list(sessions.values())
+
+
+def save_corpus(corpus: list, path: str) -> None:
+    with open(path, 'w') as fp:
+        for session in corpus:
+            for event in session:
+                fp.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+
+class _Pacer(object):
+    """Spaces request starts `1 / rate` seconds apart, across all threads."""
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next, now)
+            self._next = at + self._interval
+        time.sleep(at - now)
+
+
+class _LambdaContext(object):
+    """The part of the Lambda context the skill reads: the time left before the function is stopped."""
+
+    def __init__(self, timeout: float) -> None:
+        self._deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class _Results(object):
+    def __init__(self) -> None:
+        self.latencies = {}
+        self.outcomes = {}
+        self.metrics = dict.fromkeys(COUNTED_METRICS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, request_type: str, latency: float, outcome: str) -> None:
+        with self._lock:
+            self.latencies.setdefault(request_type, []).append(latency)
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def record_metrics(self, values: dict) -> None:
+        with self._lock:
+            for name in COUNTED_METRICS:
+                self.metrics[name] += values.get(name, 0)
+
+
+def _classify(response: dict, locale: str) -> str:
+    """Tell the canned answers of the skill from the Assistant's, by their text."""
+    import context_helpers
+    import data
+
+    speech = response.get('response', {}).get('outputSpeech', {}).get('ssml', '')
+    gettext = context_helpers.get_translations(locale).gettext
+    for outcome, message in (('error', data.ERROR_GENERIC), ('timeout', data.ERROR_TIMEOUT),
+                             ('registration_error', data.ERROR_REGISTRATION)):
+        if gettext(message) in speech:
+            return outcome
+    return 'ok'
+
+
+def _run_session(session: list, pacer: _Pacer, results: _Results, lambda_timeout: float) -> None:
+    import app
+
+    attributes = None
+    for event in session:
+        event = copy.deepcopy(event)
+        if attributes is not None and 'session' in event:
+            event['session']['attributes'] = attributes
+        request = event['request']
+        pacer.wait()
+
+        start = time.perf_counter()
+        try:
+            response = app.lambda_handler(event, _LambdaContext(lambda_timeout) if lambda_timeout else None)
+            outcome = _classify(response, request.get('locale', 'en-US'))
+        except Exception:
+            response = {}
+            outcome = 'exception'
+        results.record(request['type'], (time.perf_counter() - start) * 1000, outcome)
+        attributes = response.get('sessionAttributes', attributes)
+
+
+def _percentile(latencies: list, q: float) -> float:
+    return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+
+def _summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(_percentile(latencies, 0.50), 1),
+        'p95_ms': round(_percentile(latencies, 0.95), 1),
+        'p99_ms': round(_percentile(latencies, 0.99), 1),
+    }
+
+
+def replay(corpus: list, backends: harness.FakeBackends, concurrency: int, rate: float,
+           lambda_timeout: float) -> dict:
+    import metrics_helpers
+
+    results = _Results()
+    # Invocation metrics are what the skill would send to CloudWatch: collect them instead
+    metrics_helpers._ENABLED = True
+    metrics_helpers.Metrics.emit = lambda metrics: results.record_metrics(metrics._values)
+
+    pacer = _Pacer(rate)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(_run_session, session, pacer, results, lambda_timeout)
+                       for session in corpus]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    requests = sum(len(latencies) for latencies in results.latencies.values())
+    summary = {
+        'elapsed_s': round(elapsed, 2),
+        'requests_per_s': round(requests / elapsed, 1),
+        'all': _summarize([latency for latencies in results.latencies.values() for latency in latencies]),
+        'by_type': {request_type: _summarize(latencies) for request_type, latencies in results.latencies.items()},
+        'outcomes': results.outcomes,
+        'registrations': backends.registrations,
+        'progressive_responses': backends.progressive_responses,
+        # Kilobytes on Linux
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    summary.update(results.metrics)
+    return summary
+
+
+def _print_summary(summary: dict) -> None:
+    print('%-24s %9s %9s %9s %9s' % ('request', 'count', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]'))
+    rows = sorted(summary['by_type'].items()) + [('all', summary['all'])]
+    for request_type, row in rows:
+        print('%-24s %9d %9.1f %9.1f %9.1f' % (request_type, row['requests'], row['p50_ms'], row['p95_ms'],
+                                               row['p99_ms']))
+    print()
+    print('%.1f requests/s over %.2f s, peak RSS %.1f MiB' % (summary['requests_per_s'], summary['elapsed_s'],
+                                                            summary['peak_rss_mib']))
+    print('outcomes: %s' % ', '.join('%s %d' % item for item in sorted(summary['outcomes'].items())))
+    print('retries %d, hedges %d, deadline exceeded %d, registrations %d, progressive responses %d' % (
+        summary['retries'], summary['hedges'], summary['deadline_exceeded'], summary['registrations'],
+        summary['progressive_responses']))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    corpus = parser.add_argument_group('corpus')
+    corpus.add_argument('--corpus', help='envelopes to replay, one JSON object per line')
+    corpus.add_argument('--sessions', type=int, default=100, help='sessions to synthesize without a corpus')
+    corpus.add_argument('--users', type=int, default=20)
+    corpus.add_argument('--devices', type=int, default=2, help='Echo devices per user')
+    corpus.add_argument('--turns', type=int, default=3, help='searches per session')
+    corpus.add_argument('--locales', default='en-US,en-GB,it-IT,fr-FR,es-ES')
+    corpus.add_argument('--seed', type=int, default=0)
+    corpus.add_argument('--record', help='write the synthesized corpus to this file, and exit')
+
+    load = parser.add_argument_group('load')
+    load.add_argument('--concurrency', type=int, default=10, help='sessions in flight')
+    load.add_argument('--rate', type=float, default=0.0, help='request starts per second, default: unbounded')
+    load.add_argument('--lambda-timeout', type=float, help='seconds, passed to the skill as the Lambda context')
+
+    faults = parser.add_argument_group('faults')
+    faults.add_argument('--assistant-latency', type=float, default=0.0, help='seconds added to every Assist call')
+    faults.add_argument('--assistant-latency-jitter', type=float, default=0.0)
+    faults.add_argument('--unavailable-rate', type=float, default=0.0, help='share of Assist calls failing')
+    faults.add_argument('--burst-every', type=float, default=0.0, help='seconds between UNAVAILABLE bursts')
+    faults.add_argument('--burst-length', type=float, default=0.0, help='seconds each burst lasts')
+    faults.add_argument('--s3-latency', type=float, default=0.02)
+    faults.add_argument('--s3-error-rate', type=float, default=0.0)
+    faults.add_argument('--dynamodb-latency', type=float, default=0.005)
+    faults.add_argument('--dynamodb-error-rate', type=float, default=0.0)
+    faults.add_argument('--registration-latency', type=float, default=0.2)
+    faults.add_argument('--registration-error-rate', type=float, default=0.0)
+
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(os.path.join(harness.ORIGINAL_CWD, args.corpus))
+    else:
+        corpus = synthesize(args.sessions, args.users, args.locales.split(','), args.turns, args.devices, args.seed)
+    if args.record:
+        save_corpus(corpus, os.path.join(harness.ORIGINAL_CWD, args.record))
+        return
+
+    faults = FaultProfile(latency=args.assistant_latency, latency_jitter=args.assistant_latency_jitter,
+                          unavailable_rate=args.unavailable_rate, burst_every=args.burst_every,
+                          burst_length=args.burst_length, seed=args.seed)
+    backends = harness.FakeBackends(PROFILE, s3_latency=args.s3_latency, dynamodb_latency=args.dynamodb_latency,
+                                   registration_latency=args.registration_latency,
+                                   max_workers=args.concurrency + 8, out_of_process=True, faults=faults,
+                                   s3_error_rate=args.s3_error_rate, dynamodb_error_rate=args.dynamodb_error_rate,
+                                   registration_error_rate=args.registration_error_rate)
+    try:
+        summary = replay(corpus, backends, args.concurrency, args.rate, args.lambda_timeout)
+    finally:
+        backends.close()
+
+    _print_summary(summary)
+    if args.json:
+        with open(os.path.join(harness.ORIGINAL_CWD, args.json), 'w') as fp:
+            json.dump(summary, fp, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
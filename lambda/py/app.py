@@ -14,60 +14,125 @@
 # limitations under the License.
 
 """Unofficial Google Assistant skill for the Amazon Echo."""
-import gettext
+import concurrent.futures
 import logging
+import threading
+import time
 from functools import wraps
 from typing import Callable
 
 from ask_sdk_core.handler_input import HandlerInput
-from ask_sdk.standard import StandardSkillBuilder
+from ask_sdk_core.skill_builder import CustomSkillBuilder
 from ask_sdk_core.utils import is_intent_name, is_request_type
 from ask_sdk_model import Response
+from ask_sdk_model.services import ApiClient, ApiClientRequest, ApiClientResponse
 
 import assistant
+import async_helpers
+import audio_helpers
+import aws_helpers
+import context_helpers
+import conversation_helpers
+import device_helpers
+import metrics_helpers
+import pcm_helpers
+import persistence_helpers
+import profiling_helpers
 import skill_helpers
+import storage_helpers
 import data
-from device_helpers import register_device, RegistrationError
+from device_helpers import RegistrationError
 
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
-_sb = StandardSkillBuilder(table_name=data.DYNAMODB_TABLE, auto_create_table=True)
+
+def _create_persistence_adapter():
+    # boto3 is only imported the first time the attributes cache cannot answer,
+    # and the table is looked up at most once per container
+    from ask_sdk_dynamodb.adapter import DynamoDbAdapter
+
+    dynamodb = aws_helpers.get_resource('dynamodb')
+    persistence_helpers.create_table_if_not_exists(dynamodb, data.DYNAMODB_TABLE)
+    return DynamoDbAdapter(table_name=data.DYNAMODB_TABLE, create_table=False, dynamodb_resource=dynamodb)
+
+
+_persistence_adapter = persistence_helpers.CachingPersistenceAdapter(_create_persistence_adapter)
+
+
+class _LazyApiClient(ApiClient):
+    """Client of the Alexa APIs, such as progressive responses. The ASK one imports requests, which is slow: it is
+    only built by the first call."""
+
+    def __init__(self) -> None:
+        self._client = None
+        self._lock = threading.Lock()
+
+    def invoke(self, request: ApiClientRequest) -> ApiClientResponse:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from ask_sdk_core.api_client import DefaultApiClient
+                    self._client = DefaultApiClient()
+        return self._client.invoke(request)
+
+
+_sb = CustomSkillBuilder(persistence_adapter=_persistence_adapter, api_client=_LazyApiClient())
+
+
+def _registration_failed(handler_input: HandlerInput, e: RegistrationError) -> Response:
+    _logger.error('Error in device registration: %s', e)
+    handler_input.response_builder.speak(context_helpers.get_context(handler_input).gettext(data.ERROR_REGISTRATION))
+    return handler_input.response_builder.response
 
 
 def preflight_check(f: Callable) -> Callable:
     @wraps(f)
     def decorated_function(handler_input: HandlerInput) -> Response:
         _logger.info('Pre-flight check')
+        metrics = metrics_helpers.current()
+        start = time.perf_counter()
+
+        context = context_helpers.get_context(handler_input)
 
         # Obtain credentials
-        credentials = skill_helpers.get_credentials(handler_input)
+        credentials = context.credentials
 
         # Obtain the deviceId
-        device_id = skill_helpers.get_device_id(handler_input)
+        device_id = context.device_id
         last_device_id = skill_helpers.get_persistent_attribute(handler_input, 'device_id')
 
         project_id = data.GOOGLE_ASSISTANT_API['project_id']
         model_id = data.GOOGLE_ASSISTANT_API['model_id']
 
-        # Re-register if "device_id" is different from the last "device_id":
+        # Re-register if "device_id" is different from the last "device_id". The Assist call does not wait for it, and
+        # only fails with the registration error if the registration really fails.
         if device_id != last_device_id:
             _logger.info('Trying to register device...')
+            context.registration = device_helpers.start_registration(project_id, credentials, model_id, device_id)
+
+        metrics.set_elapsed('preflight', start)
+        try:
+            # Raises the registration error when the handler waited for the registration
+            response = f(handler_input)
+        except RegistrationError as e:
+            return _registration_failed(handler_input, e)
+
+        if context.registration is not None:
+            # Only the wait for the registration may time out: the handler's own timeouts are not caught here
             try:
-                register_device(project_id, credentials, model_id, device_id)
+                # Already over when the handler called the Assistant
+                context.registration.result(max(0, context.deadline.remaining()))
             except RegistrationError as e:
-                _logger.error('Error in device registration: %s', e)
-                _: Callable = handler_input.attributes_manager.request_attributes["_"]
-                handler_input.response_builder.speak(_(data.ERROR_REGISTRATION))
-                return handler_input.response_builder.response
-
-            _logger.info('Device was registered successfully')
+                return _registration_failed(handler_input, e)
+            except concurrent.futures.TimeoutError:
+                _logger.warning('Device registration still running, it will be checked again')
+                return response
 
             skill_helpers.set_persistent_attribute(handler_input, 'device_id', device_id, save=True)
             _logger.info('New device_id was saved into persistent storage')
-
-        return f(handler_input)
+        return response
 
     return decorated_function
 
@@ -77,7 +142,7 @@ def preflight_check(f: Callable) -> Callable:
 def launch_request_handler(handler_input: HandlerInput) -> Response:
     """Handler for Skill Launch."""
     _logger.info('LaunchRequest')
-    _: Callable = handler_input.attributes_manager.request_attributes["_"]
+    _: Callable = skill_helpers.get_translator(handler_input)
 
     return assistant.assist(handler_input, _(data.HELLO))
 
@@ -96,6 +161,25 @@ def search_intent_handler(handler_input: HandlerInput) -> Response:
 def session_ended_request_handler(handler_input: HandlerInput) -> Response:
     """Handler for Session End."""
     _logger.info('Session ended with reason: %s', handler_input.request_envelope.request.reason)
+    conversation_helpers.discard_conversation_state(handler_input)
+    return handler_input.response_builder.response
+
+
+@_sb.request_handler(can_handle_func=lambda i: i.request_envelope.request.object_type.startswith(
+    ('AudioPlayer.', 'PlaybackController.', 'System.ExceptionEncountered')))
+def audio_player_event_handler(handler_input: HandlerInput) -> Response:
+    """Handler for the playback events of streamed answers, which take no speech."""
+    _logger.info('%s', handler_input.request_envelope.request.object_type)
+    return handler_input.response_builder.response
+
+
+@_sb.request_handler(can_handle_func=lambda i: i.request_envelope.context.audio_player is not None and (
+        is_intent_name('AMAZON.PauseIntent')(i) or is_intent_name('AMAZON.StopIntent')(i) or
+        is_intent_name('AMAZON.CancelIntent')(i)))
+def stop_playback_handler(handler_input: HandlerInput) -> Response:
+    """Handler for stopping a streamed answer; streams are not resumable."""
+    from ask_sdk_model.interfaces.audioplayer import StopDirective
+    handler_input.response_builder.add_directive(StopDirective())
     return handler_input.response_builder.response
 
 
@@ -103,7 +187,7 @@ def session_ended_request_handler(handler_input: HandlerInput) -> Response:
 def unhandled_intent_handler(handler_input: HandlerInput) -> Response:
     """Handler for all other unhandled requests."""
     _logger.debug(handler_input.request_envelope.request)
-    _: Callable = handler_input.attributes_manager.request_attributes["_"]
+    _: Callable = skill_helpers.get_translator(handler_input)
     handler_input.response_builder.speak(_(data.FALLBACK))
     return handler_input.response_builder.response
 
@@ -114,38 +198,64 @@ def all_exception_handler(handler_input: HandlerInput, exception: Exception) ->
     respond with custom message.
     """
     _logger.error(exception, exc_info=True)
-    _: Callable = handler_input.attributes_manager.request_attributes["_"]
+    _: Callable = skill_helpers.get_translator(handler_input)
     handler_input.response_builder.speak(_(data.ERROR_GENERIC))
     return handler_input.response_builder.response
 
 
 @_sb.global_request_interceptor()
-def process(handler_input: HandlerInput) -> None:
-    """Process the locale in request and load localized strings for response.
-    This interceptors processes the locale in request, and loads the locale
-    specific localization strings for the function `_`, that is used during
-    responses.
+def init_context(handler_input: HandlerInput) -> None:
+    """Read what the handlers need from the request once, and start its time budget, before anything else runs."""
+    context_helpers.init_context(handler_input)
+
+
+def is_warmup_event(event: dict) -> bool:
+    """Scheduled CloudWatch events and explicit `{"warmup": true}` pings are not skill requests."""
+    return isinstance(event, dict) and (event.get('warmup') is True or event.get('source') == 'aws.events')
+
+
+def warm_up() -> None:
+    """Load everything the first real request would otherwise load lazily.
+
+    gRPC channels are bound to the user's access token, so only the gRPC runtime and its TLS roots are prepared here;
+    the channel itself is opened by the first request.
     """
-    locale = getattr(handler_input.request_envelope.request, 'locale', None)
-    _logger.info("Locale is {}".format(locale))
-    if locale:
-        if locale.startswith("fr"):
-            locale_file_name = "fr-FR"
-        elif locale.startswith("it"):
-            locale_file_name = "it-IT"
-        elif locale.startswith("es"):
-            locale_file_name = "es-ES"
-        else:
-            locale_file_name = locale
-
-        _logger.info("Loading locale file: {}".format(locale_file_name))
-        i18n = gettext.translation('data', localedir='locales', languages=[locale_file_name], fallback=True)
-        handler_input.attributes_manager.request_attributes["_"] = i18n.gettext
-    else:
-        handler_input.attributes_manager.request_attributes["_"] = gettext.gettext
+    _logger.info('Warming up')
+    import grpc
+    from google.assistant.embedded.v1alpha2 import embedded_assistant_pb2_grpc  # noqa: F401
+    import aiohttp  # noqa: F401
+    from ask_sdk_core.api_client import DefaultApiClient  # noqa: F401
+    from google.oauth2.credentials import Credentials  # noqa: F401
+
+    grpc.ssl_channel_credentials()
+    async_helpers.get_loop()
+    storage_helpers.get_storage()
+    audio_helpers.new_mp3_encoder()
+    pcm_helpers.new_pcm_processor()
+    for locale in ('fr-FR', 'it-IT', 'es-ES'):
+        context_helpers.get_translations(locale)
+
+    # A failed table lookup is retried by the first request, it must not fail the ping
+    try:
+        _persistence_adapter.adapter
+    except Exception as e:
+        _logger.warning('Could not initialize persistence adapter: %s', e)
 
 
 _logger.info('Loading Alexa Assistant...')
 
+_skill_handler = _sb.lambda_handler()
+
+
+def create_skill():
+    """Skill instance for hosts other than AWS Lambda, see `server.py`."""
+    return _sb.create()
+
+
 # Handler name that is used on AWS lambda
-lambda_handler = _sb.lambda_handler()
+def lambda_handler(event: dict, context: object) -> dict:
+    if is_warmup_event(event):
+        warm_up()
+        return {'warmup': 'ok'}
+    with metrics_helpers.invocation(), profiling_helpers.session(getattr(context, 'aws_request_id', 'local')):
+        return _skill_handler(event, context)
@@ -12,75 +12,67 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import functools
 import logging
 import os
-import wave
+import time
+from typing import Optional
 from xml.sax.saxutils import escape
 
 from ask_sdk_core.handler_input import HandlerInput
-from ask_sdk_model import Response, Request
-
-import boto3
-
-import grpc
+from ask_sdk_model import Response
 from ask_sdk_model.ui import SimpleCard
-from google.assistant.embedded.v1alpha2 import embedded_assistant_pb2_grpc, embedded_assistant_pb2
-from google.assistant.embedded.v1alpha2.embedded_assistant_pb2 import AssistRequest
-from google.auth.transport.grpc import secure_authorized_channel
-
-from tenacity import retry, stop_after_attempt, retry_if_exception
 
+import async_helpers
 import audio_helpers
+import audio_pipeline
+import context_helpers
+import conversation_helpers
+import deadline_helpers
+import metrics_helpers
+import pcm_helpers
+import profiling_helpers
+import response_cache
+import response_mode_helpers
 import skill_helpers
+import storage_helpers
 import data
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
+# grpc, the Assistant protobufs and boto3 are slow to import: they are loaded on first use rather than at cold start,
+# so that requests which never reach the Assistant do not pay for them.
 
-_END_OF_UTTERANCE = embedded_assistant_pb2.AssistResponse.END_OF_UTTERANCE
-_DIALOG_FOLLOW_ON = embedded_assistant_pb2.DialogStateOut.DIALOG_FOLLOW_ON
-_CLOSE_MICROPHONE = embedded_assistant_pb2.DialogStateOut.CLOSE_MICROPHONE
-
-# Get the service client.
-_s3 = boto3.client('s3')
-
-
-def _is_grpc_error_unavailable(e) -> bool:
-    is_grpc_error = isinstance(e, grpc.RpcError)
-    if is_grpc_error and (e.code() == grpc.StatusCode.UNAVAILABLE):
-        _logger.error('gRPC unavailable error: %s', e)
-        return True
-    return False
+_response_cache = response_cache.ResponseCache()
 
 
 # This generator yields AssistResponse proto messages
 # received from the gRPC Google Assistant API.
-def _iter_assist_requests(handler_input: HandlerInput, text_query: str) -> AssistRequest:
+def _iter_assist_requests(handler_input: HandlerInput, text_query: str, conversation_state: bytes = None,
+                          audio_out_encoding: str = 'LINEAR16') -> 'AssistRequest':
     """Yields: AssistRequest messages to send to the API."""
+    from google.assistant.embedded.v1alpha2 import embedded_assistant_pb2
 
     model_id = data.GOOGLE_ASSISTANT_API['model_id']
-    device_id = skill_helpers.get_device_id(handler_input)
-
-    locale = getattr(handler_input.request_envelope.request, 'locale', 'en-US')
+    context = context_helpers.get_context(handler_input)
 
-    conversation_state = skill_helpers.get_session_attribute(handler_input, 'conversation_state')  # type: list
     is_new_conversation = conversation_state is None
-    blob = bytes(conversation_state) if not is_new_conversation else None
 
     config = embedded_assistant_pb2.AssistConfig(
         audio_out_config=embedded_assistant_pb2.AudioOutConfig(
-            encoding='LINEAR16',
+            encoding=audio_out_encoding,
             sample_rate_hertz=data.DEFAULT_AUDIO_SAMPLE_RATE,
             volume_percentage=100,
         ),
         dialog_state_in=embedded_assistant_pb2.DialogStateIn(
-            language_code=locale,
-            conversation_state=blob,
+            language_code=context.locale,
+            conversation_state=conversation_state,
             is_new_conversation=is_new_conversation,
         ),
         device_config=embedded_assistant_pb2.DeviceConfig(
-            device_id=device_id,
+            device_id=context.device_id,
             device_model_id=model_id,
         ),
         text_query=text_query
@@ -90,79 +82,455 @@ def _iter_assist_requests(handler_input: HandlerInput, text_query: str) -> Assis
     yield req
 
 
-@retry(reraise=True, stop=stop_after_attempt(3), retry=retry_if_exception(_is_grpc_error_unavailable))
-def assist(handler_input: HandlerInput, text_query: str) -> Response:
+class _Turn(object):
+    """What a conversation turn produced, besides the audio."""
+    __slots__ = ('text_response', 'mic_open', 'conversation_state', 'spoken')
+
+    def __init__(self) -> None:
+        self.text_response = None
+        self.mic_open = False
+        self.conversation_state = None
+        # Whether Alexa reads `text_response` in place of the audio, which was then neither encoded nor stored
+        self.spoken = False
+
+
+class _AssistAttempt(object):
+    """One Assist call, encoding and storing its audio as it is received.
+
+    Responses are read with `read()` rather than iterated, so that the first one can be awaited on its own. Unless
+    the response mode is audio, the audio is held back until it is known whether Alexa reads the display text
+    instead, and only encoded and stored when it does not.
+
+    How fast `endpoint` answered, or how it failed, is reported to it. `on_unavailable` is called when the call fails
+    with UNAVAILABLE.
+    """
+
+    def __init__(self, assistant, requests, storage: storage_helpers.AudioStorage, key: str, cache_ttl: float,
+                 audio_out_encoding: str, timeout: float, streaming: bool = False,
+                 response_mode: str = response_mode_helpers.AUDIO, endpoint: 'endpoint_helpers.Endpoint' = None,
+                 on_unavailable=None) -> None:
+        self._is_pcm = audio_out_encoding == 'LINEAR16'
+        self._storage = storage
+        self._key = key
+        self._cache_ttl = cache_ttl
+        self._audio_out_encoding = audio_out_encoding
+        self._streaming = streaming
+        self._response_mode = response_mode
+        self.writer = None
+        self._pipeline = None
+        self._held = []
+        if response_mode == response_mode_helpers.AUDIO:
+            self._open_pipeline()
+        self._endpoint = endpoint
+        self._on_unavailable = on_unavailable
+        self._start = time.perf_counter()
+        self._call = assistant.Assist(requests, timeout)
+        self._first = None
+        self._answered = False
+
+    def _open_pipeline(self) -> None:
+        self.writer = self._storage.open_writer(self._key, ttl=self._cache_ttl)
+        self._pipeline = audio_pipeline.AudioPipeline(
+            audio_helpers.new_mp3_encoder(audio_out_encoding=self._audio_out_encoding, streaming=self._streaming),
+            self.writer, processor=pcm_helpers.new_pcm_processor() if self._is_pcm else None)
+
+    async def _read(self) -> 'AssistResponse':
+        import grpc
+
+        try:
+            resp = await self._call.read()
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.UNAVAILABLE and self._on_unavailable is not None:
+                self._on_unavailable()
+            if self._endpoint is not None:
+                self._endpoint.record_error(e.code())
+            raise
+        if not self._answered:
+            self._answered = True
+            if self._endpoint is not None:
+                self._endpoint.record_success(time.perf_counter() - self._start)
+        return resp
+
+    async def first_response(self) -> 'AssistResponse':
+        self._first = await self._read()
+        return self._first
+
+    async def run(self, metrics: metrics_helpers.Metrics, grpc_start: float, answered: asyncio.Event) -> _Turn:
+        import grpc
+        from google.assistant.embedded.v1alpha2 import embedded_assistant_pb2
+
+        dialog_follow_on = embedded_assistant_pb2.DialogStateOut.DIALOG_FOLLOW_ON
+        close_microphone = embedded_assistant_pb2.DialogStateOut.CLOSE_MICROPHONE
+
+        turn = _Turn()
+        audio_bytes = 0
+        resp = self._first if self._first is not None else await self._read()
+        metrics.set_elapsed('grpc_first_byte', grpc_start)
+        if self.writer is not None:
+            self.writer.start()
+        answered.set()
+        while resp is not grpc.aio.EOF:
+            if len(resp.audio_out.audio_data) > 0:
+                _logger.info('Playing assistant response.')
+                buf = resp.audio_out.audio_data
+                if self._is_pcm:
+                    buf = audio_helpers.align_buf(buf, data.DEFAULT_AUDIO_SAMPLE_WIDTH)
+                metrics.add('audio_bytes', len(buf), 'Bytes')
+                audio_bytes += len(buf)
+                if self._pipeline is not None:
+                    await self._pipeline.feed(buf)
+                else:
+                    self._held.append(buf)
+            if resp.dialog_state_out.conversation_state:
+                _logger.debug('Updating conversation state.')
+                turn.conversation_state = resp.dialog_state_out.conversation_state
+            if resp.dialog_state_out.microphone_mode == dialog_follow_on:
+                turn.mic_open = True
+                _logger.info('Expecting follow-on query from user.')
+            elif resp.dialog_state_out.microphone_mode == close_microphone:
+                turn.mic_open = False
+            if resp.dialog_state_out.supplemental_display_text:
+                turn.text_response = resp.dialog_state_out.supplemental_display_text
+                _logger.info('Supplemental display text: %s', turn.text_response)
+            resp = await self._read()
+
+        metrics.set_elapsed('grpc_last_byte', grpc_start)
+        _logger.info('Finished playing assistant response.')
+
+        if self._pipeline is None:
+            # The length of MP3 audio is not known without parsing it
+            audio_seconds = (audio_bytes / (data.DEFAULT_AUDIO_SAMPLE_RATE * data.DEFAULT_AUDIO_SAMPLE_WIDTH)
+                             if self._is_pcm else None)
+            held, self._held = self._held, []
+            if response_mode_helpers.is_speakable(turn.text_response, self._response_mode, audio_seconds):
+                turn.spoken = True
+                metrics.set_property('response', 'text')
+                return turn
+            self._open_pipeline()
+            self.writer.start()
+            for buf in held:
+                await self._pipeline.feed(buf)
+
+        # TODO: info on audio file, error if response is empty
+        metrics.set_property('response', 'audio')
+        await self._pipeline.close()
+        metrics.set('mp3_bytes', self.writer.size, 'Bytes')
+        return turn
+
+    async def cancel(self) -> None:
+        """Stop receiving and drop the audio stored so far."""
+        self._call.cancel()
+        if not self._answered and self._endpoint is not None:
+            self._endpoint.record_abandoned(time.perf_counter() - self._start)
+        if self._pipeline is not None:
+            await self._pipeline.cancel()
+
+
+async def _cancel_all(attempts: list) -> None:
+    # The caller may itself be cancelled, the audio must be dropped anyway
+    await asyncio.shield(asyncio.gather(*(attempt.cancel() for attempt in attempts), return_exceptions=True))
+
+
+async def _run_attempt(new_attempt, deadline: deadline_helpers.Deadline, metrics: metrics_helpers.Metrics,
+                       grpc_start: float, answered: asyncio.Event) -> _Turn:
+    """Run an Assist call; with hedging on, a second one is started when the first is slow to answer, and the first
+    of the two to answer is kept."""
+    attempts = [new_attempt(deadline.remaining())]
+    # First responses still awaited, by attempt
+    pending = {}
+    try:
+        hedge_delay = deadline_helpers.get_hedge_delay()
+        if hedge_delay is not None:
+            pending[asyncio.ensure_future(attempts[0].first_response())] = attempts[0]
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+            if not done:
+                _logger.info('No response after %.3f s, hedging the Assist call', hedge_delay)
+                metrics.add('hedges', 1)
+                attempts.append(new_attempt(deadline.remaining()))
+                pending[asyncio.ensure_future(attempts[1].first_response())] = attempts[1]
+            winner = error = None
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    attempt = pending.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    elif winner is None:
+                        winner = attempt
+            if winner is None:
+                raise error
+            attempts.remove(winner)
+            await _cancel_all(attempts)
+            attempts = [winner]
+        # The Assist call and the encoding of its audio
+        with profiling_helpers.phase('assist'):
+            return await attempts[0].run(metrics, grpc_start, answered)
+    except BaseException:
+        # Encoding or storing failed, or the caller gave up: there is no point in receiving the rest of the response
+        await _cancel_all(attempts)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def _converse(new_attempt, deadline: deadline_helpers.Deadline, metrics: metrics_helpers.Metrics,
+                    answered: asyncio.Event) -> _Turn:
+    """Run the Assist call, retried on UNAVAILABLE as long as the budget allows. `answered` is set as soon as the
+    Assistant starts answering."""
+    import grpc
+
+    grpc_start = time.perf_counter()
+    attempt = 1
+    while True:
+        if deadline.expired():
+            # E.g. spent waiting for the device registration: a call started now could only be cancelled
+            raise deadline_helpers.DeadlineExceeded('No time left to call the Assistant')
+        try:
+            return await asyncio.wait_for(_run_attempt(new_attempt, deadline, metrics, grpc_start, answered),
+                                          deadline.remaining())
+        except asyncio.TimeoutError:
+            raise deadline_helpers.DeadlineExceeded('No response within the budget')
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+                raise deadline_helpers.DeadlineExceeded(e.details()) from e
+            if e.code() != grpc.StatusCode.UNAVAILABLE:
+                raise
+            _logger.error('gRPC unavailable error: %s', e)
+            if attempt >= data.GRPC_MAX_ATTEMPTS:
+                raise
+            backoff = deadline_helpers.get_backoff(attempt)
+            if deadline.remaining() - backoff < data.GRPC_MIN_ATTEMPT_TIME:
+                raise deadline_helpers.DeadlineExceeded('No time left to retry') from e
+        attempt += 1
+        metrics.add('retries', 1)
+        await asyncio.sleep(backoff)
+
+
+async def _wait_registration(registration: Optional[asyncio.Future], deadline: deadline_helpers.Deadline) -> None:
+    """Wait for the registration of the device started alongside the Assist call, if any. Raises RegistrationError
+    when it failed."""
+    if registration is None:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(registration), deadline.remaining())
+    except asyncio.TimeoutError:
+        raise deadline_helpers.DeadlineExceeded('Device registration did not complete within the budget')
+
+
+async def _converse_registered(new_attempt, registration: Optional[asyncio.Future], deadline: deadline_helpers.Deadline,
+                               metrics: metrics_helpers.Metrics, answered: asyncio.Event) -> _Turn:
+    """`_converse`, started speculatively while the device is being registered. The Assistant may refuse a device it
+    does not know yet: a call failing before the registration completed is run again once the device is registered."""
+    import grpc
+
+    if registration is None or registration.done():
+        await _wait_registration(registration, deadline)
+        return await _converse(new_attempt, deadline, metrics, answered)
+    try:
+        turn = await _converse(new_attempt, deadline, metrics, answered)
+    except grpc.RpcError as e:
+        # A failed registration explains the failure better than the Assistant does
+        await _wait_registration(registration, deadline)
+        if e.code() == grpc.StatusCode.UNAVAILABLE:
+            raise
+        _logger.info('Assist call failed while the device was being registered, trying again: %s', e)
+        metrics.add('retries', 1)
+        return await _converse(new_attempt, deadline, metrics, answered)
+    await _wait_registration(registration, deadline)
+    return turn
+
+
+async def assist_async(handler_input: HandlerInput, text_query: str) -> Response:
+    """Hold a conversation turn with the Assistant; must be run on the shared event loop."""
     _logger.info('Input to be processed is: %s', text_query)
 
-    # Get constants
-    api_endpoint = data.GOOGLE_ASSISTANT_API['api_endpoint']
-    deadline_sec = data.DEFAULT_GRPC_DEADLINE
-
-    # Create an authorized gRPC channel.
-    credentials = skill_helpers.get_credentials(handler_input)
-    http_request = Request()
-    grpc_channel = secure_authorized_channel(credentials, http_request, api_endpoint)
-    _logger.info('Connecting to %s', api_endpoint)
-
-    # Create Assistant stub
-    assistant = embedded_assistant_pb2_grpc.EmbeddedAssistantStub(grpc_channel)
-
-    # Initial state
-    text_response = None
-    mic_open = False
-
-    # Open the response PCM file in which we are going to stream Assistant's response
-    fp = open(data.RESPONSE_PCM_FILE, 'wb')
-
-    # Init WAVE file parser
-    wavep = wave.open(fp, 'wb')
-    wavep.setsampwidth(data.DEFAULT_AUDIO_SAMPLE_WIDTH)
-    wavep.setnchannels(1)
-    wavep.setframerate(data.DEFAULT_AUDIO_SAMPLE_RATE)
-
-    # The magic happens
-    for resp in assistant.Assist(_iter_assist_requests(handler_input, text_query), deadline_sec):
-        if len(resp.audio_out.audio_data) > 0:
-            _logger.info('Playing assistant response.')
-            buf = resp.audio_out.audio_data
-            buf = audio_helpers.align_buf(buf, data.DEFAULT_AUDIO_SAMPLE_WIDTH)
-            wavep.writeframes(buf)
-        if resp.dialog_state_out.conversation_state:
-            conversation_state = resp.dialog_state_out.conversation_state
-            conversation_state = list(conversation_state) if conversation_state is not None else None
-            _logger.debug('Updating conversation state.')
-            skill_helpers.set_session_attribute(handler_input, 'conversation_state', conversation_state)
-        if resp.dialog_state_out.microphone_mode == _DIALOG_FOLLOW_ON:
-            mic_open = True
-            _logger.info('Expecting follow-on query from user.')
-        elif resp.dialog_state_out.microphone_mode == _CLOSE_MICROPHONE:
-            mic_open = False
-        if resp.dialog_state_out.supplemental_display_text:
-            text_response = resp.dialog_state_out.supplemental_display_text
-            _logger.info('Supplemental display text: %s', text_response)
-
-    _logger.info('Finished playing assistant response.')
-
-    # TODO: info on audio file, error if response is empty
-    wavep.close()
-    fp.close()
-
-    # Encode Assistant's response in an MP3 we can stream to Alexa
-    audio_helpers.encode_from_pcm_to_mp3(data.RESPONSE_PCM_FILE, data.RESPONSE_MP3_FILE)
-
-    # S3 bucket
-    bucket = os.environ['S3_BUCKET']
-    key = skill_helpers.get_device_id(handler_input)
-
-    # Upload the response MP3 to the bucket
-    _s3.upload_file(data.RESPONSE_MP3_FILE, Bucket=bucket, Key=key)
+    context = context_helpers.get_context(handler_input)
+    deadline = context.deadline
+    registration = asyncio.wrap_future(context.registration) if context.registration is not None else None
+
+    # Creating the storage backend may build an AWS client
+    storage = await async_helpers.run_blocking(storage_helpers.get_storage)
+    response_mode = await async_helpers.run_blocking(response_mode_helpers.get_response_mode, handler_input)
+    # Spoken answers are only known at the end of the turn, too late to start playing anything
+    streaming = response_mode == response_mode_helpers.AUDIO and _is_streaming(handler_input, storage)
+
+    # Repeatable queries are stored under a content-addressed key and may not need the Assistant at all
+    cache_ttl = response_cache.get_ttl(handler_input, text_query)
+    if cache_ttl is not None:
+        key = response_cache.get_key(handler_input, text_query, response_mode)
+        # Looking up may evict, and so delete, stale objects
+        cached = await async_helpers.run_blocking(_response_cache.get, key)
+        # The audio may be gone while the index still lists it: dropped by the local origin, or deleted from S3 by
+        # another container's eviction
+        if cached is not None and (cached.spoken or await async_helpers.run_blocking(storage.has, key)):
+            # The caller's conversation state is left as it is: the cached answer comes from another conversation
+            _logger.info('Serving cached response %s', key)
+            try:
+                await _wait_registration(registration, deadline)
+            except deadline_helpers.DeadlineExceeded as e:
+                _logger.warning('Giving up on the Assistant: %s', e)
+                return _build_timeout_response(handler_input)
+            if streaming:
+                return _build_play_response(handler_input, storage, key)
+            if cached.spoken:
+                return _build_text_response(handler_input, cached.text_response, cached.mic_open)
+            return _build_response(handler_input, storage, key, cached.text_response, cached.mic_open)
+    else:
+        key = context.audio_key
+
+    from google.assistant.embedded.v1alpha2 import embedded_assistant_pb2_grpc
+    import channel_helpers
+    import endpoint_helpers
+
+    credentials = context.credentials
+    metrics = metrics_helpers.current()
+
+    # Server-side states come from the persistent attributes
+    conversation_state_in = await async_helpers.run_blocking(conversation_helpers.get_conversation_state,
+                                                             handler_input)
+
+    # Encode and store Assistant's response while it is still being received. MP3 is taken as is when possible, at
+    # the price of the PCM post-processing.
+    audio_out_encoding = audio_helpers.get_audio_out_encoding()
+    metrics.set_property('audio_out_encoding', audio_out_encoding)
+
+    def new_attempt(timeout: float) -> _AssistAttempt:
+        # The fastest healthy endpoint, chosen again for every attempt
+        endpoint = endpoint_helpers.choose()
+        metrics.set_property('api_endpoint', endpoint.host)
+        # Get an authorized gRPC channel, reused across warm invocations and retries unless it failed
+        assistant = embedded_assistant_pb2_grpc.EmbeddedAssistantStub(
+            channel_helpers.get_channel(credentials, endpoint.host))
+        requests = _iter_assist_requests(handler_input, text_query, conversation_state_in, audio_out_encoding)
+        # A channel that went stale while the container was frozen must not be handed out again
+        on_unavailable = functools.partial(channel_helpers.invalidate_channel, credentials, endpoint.host)
+        return _AssistAttempt(assistant, requests, storage, key, cache_ttl, audio_out_encoding, timeout, streaming,
+                              response_mode, endpoint, on_unavailable)
+
+    answered = asyncio.Event()
+    feedback = asyncio.ensure_future(_send_progressive_response(handler_input, answered))
+    try:
+        if streaming:
+            return await _stream(handler_input, new_attempt, registration, deadline, metrics, answered, storage, key,
+                                 cache_ttl)
+
+        # The magic happens
+        try:
+            turn = await _converse_registered(new_attempt, registration, deadline, metrics, answered)
+        except deadline_helpers.DeadlineExceeded as e:
+            _logger.warning('Giving up on the Assistant: %s', e)
+            metrics.add('deadline_exceeded', 1)
+            return _build_timeout_response(handler_input)
+    finally:
+        feedback.cancel()
+
+    # Only a complete response moves the conversation forward
+    if turn.conversation_state is not None:
+        await async_helpers.run_blocking(conversation_helpers.set_conversation_state, handler_input,
+                                         turn.conversation_state)
+
+    if cache_ttl is not None:
+        await async_helpers.run_blocking(
+            _response_cache.put, response_cache.CachedResponse(key, cache_ttl, turn.text_response, turn.mic_open,
+                                                               turn.spoken))
+
+    if turn.spoken:
+        return _build_text_response(handler_input, turn.text_response, turn.mic_open)
+    return _build_response(handler_input, storage, key, turn.text_response, turn.mic_open)
+
+
+async def _stream(handler_input: HandlerInput, new_attempt, registration: Optional[asyncio.Future],
+                  deadline: deadline_helpers.Deadline, metrics: metrics_helpers.Metrics, answered: asyncio.Event,
+                  storage: storage_helpers.AudioStorage, key: str, cache_ttl: float) -> Response:
+    """Start playing the answer as soon as the Assistant starts giving it, while the rest is received in the
+    background."""
+    conversation = asyncio.ensure_future(
+        _converse_registered(new_attempt, registration, deadline_helpers.Deadline(data.AUDIO_STREAM_TIMEOUT), metrics,
+                             answered))
+    started = asyncio.ensure_future(answered.wait())
+    try:
+        await asyncio.wait((conversation, started), timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        started.cancel()
+    if not answered.is_set():
+        conversation.cancel()
+        if conversation.done() and not conversation.cancelled() and conversation.exception() is not None:
+            raise conversation.exception()
+        _logger.warning('Giving up on the Assistant: no answer to stream within the budget')
+        metrics.add('deadline_exceeded', 1)
+        return _build_timeout_response(handler_input)
+    try:
+        await _wait_registration(registration, deadline)
+    except BaseException as e:
+        conversation.cancel()
+        if not isinstance(e, deadline_helpers.DeadlineExceeded):
+            raise
+        _logger.warning('Giving up on the Assistant: %s', e)
+        metrics.add('deadline_exceeded', 1)
+        return _build_timeout_response(handler_input)
+
+    # Playback ends the session: the conversation state has nowhere to go, only the cache needs the outcome
+    _streams.add(conversation)
+    conversation.add_done_callback(functools.partial(_on_stream_done, key, cache_ttl))
+    return _build_play_response(handler_input, storage, key)
+
+
+# Conversations still streaming after their request was answered; the event loop only keeps weak references to tasks
+_streams = set()
+
+
+def _on_stream_done(key: str, cache_ttl: float, conversation: asyncio.Future) -> None:
+    _streams.discard(conversation)
+    if conversation.cancelled():
+        return
+    if conversation.exception() is not None:
+        _logger.error('Streamed answer failed: %s', conversation.exception())
+        return
+    _logger.info('Streamed answer complete')
+    if cache_ttl is not None:
+        turn = conversation.result()
+        asyncio.ensure_future(async_helpers.run_blocking(
+            _response_cache.put, response_cache.CachedResponse(key, cache_ttl, turn.text_response, turn.mic_open)))
+
+
+async def _send_progressive_response(handler_input: HandlerInput, answered: asyncio.Event) -> None:
+    """Tell the user to wait when the Assistant is slow to start answering."""
+    try:
+        await asyncio.wait_for(answered.wait(), data.PROGRESSIVE_RESPONSE_DELAY)
+        return
+    except asyncio.TimeoutError:
+        pass
+    if not handler_input.request_envelope.context.system.api_access_token:
+        return
+    _ = skill_helpers.get_translator(handler_input)
+    try:
+        await async_helpers.run_blocking(skill_helpers.send_progressive_response, handler_input,
+                                         _(data.PROGRESSIVE_RESPONSE))
+    except Exception as e:
+        _logger.warning('Could not send progressive response: %s', e)
+
+
+def _is_streaming(handler_input: HandlerInput, storage: storage_helpers.AudioStorage) -> bool:
+    """Whether the answer is streamed with AudioPlayer, which needs the local origin to follow the audio."""
+    if os.environ.get('AUDIO_PLAYBACK', 'ssml').lower() != 'stream':
+        return False
+    if not isinstance(storage, storage_helpers.LocalAudioOrigin):
+        _logger.warning('Streamed playback needs local audio storage, falling back to SSML')
+        return False
+    return skill_helpers.supports_audio_player(handler_input)
+
+
+def assist(handler_input: HandlerInput, text_query: str) -> Response:
+    """Blocking entry point for the request handlers, which run outside of the event loop."""
+    return async_helpers.run(assist_async(handler_input, text_query))
 
+
+def _build_response(handler_input: HandlerInput, storage: storage_helpers.AudioStorage, key: str, text_response: str,
+                    mic_open: bool) -> Response:
     # Generate a short-lived signed url to the MP3
-    params = {
-            'Bucket': bucket,
-            'Key': key
-    }
-    url = _s3.generate_presigned_url(ClientMethod='get_object', Params=params, ExpiresIn=10)
+    with metrics_helpers.span('presign'):
+        url = storage.get_url(key)
     url = escape(url)
 
     # Create Alexa response
@@ -173,3 +541,36 @@ def assist(handler_input: HandlerInput, text_query: str) -> Response:
     response_builder.set_should_end_session(not mic_open)
 
     return response_builder.response
+
+
+def _build_text_response(handler_input: HandlerInput, text_response: str, mic_open: bool) -> Response:
+    """Alexa reads the display text with its own voice, there is no audio to fetch."""
+    response_builder = handler_input.response_builder
+    response_builder.speak(response_mode_helpers.to_ssml(text_response))
+    response_builder.set_card(SimpleCard(title='Google Assistant', content=text_response))
+    response_builder.set_should_end_session(not mic_open)
+    return response_builder.response
+
+
+def _build_play_response(handler_input: HandlerInput, storage: storage_helpers.AudioStorage, key: str) -> Response:
+    from ask_sdk_model.interfaces.audioplayer import AudioItem, PlayBehavior, PlayDirective, Stream
+
+    with metrics_helpers.span('presign'):
+        url = storage.get_url(key)
+    stream = Stream(token=key, url=url, offset_in_milliseconds=0)
+
+    response_builder = handler_input.response_builder
+    response_builder.add_directive(PlayDirective(play_behavior=PlayBehavior.REPLACE_ALL,
+                                                 audio_item=AudioItem(stream=stream)))
+    response_builder.set_should_end_session(True)
+    return response_builder.response
+
+
+def _build_timeout_response(handler_input: HandlerInput) -> Response:
+    """Degraded response when the Assistant could not answer in time. The user is told to try again later, so the
+    session ends; the conversation state is not updated."""
+    _ = skill_helpers.get_translator(handler_input)
+    response_builder = handler_input.response_builder
+    response_builder.speak(_(data.ERROR_TIMEOUT))
+    response_builder.set_should_end_session(True)
+    return response_builder.response
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-process event loop shared by all in-flight conversations.
+
+The loop runs on a background thread, started on first use, so that blocking callers (the ASK SDK request handlers)
+can hand coroutines over to it with `run` and wait for their result. Coroutines inherit the caller's context
+variables, so metrics keep working across the hand-over.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import data
+import profiling_helpers
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                _logger.info('Starting event loop')
+                loop = asyncio.new_event_loop()
+                # Blocking work (boto3, MP3 encoding) runs here, bounded so that a burst of conversations queues up
+                # instead of spawning threads without limit
+                loop.set_default_executor(ThreadPoolExecutor(max_workers=data.ASYNC_BLOCKING_WORKERS,
+                                                             thread_name_prefix='blocking'))
+                threading.Thread(target=loop.run_forever, name='event-loop', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run(coro):
+    """Run `coro` on the shared loop and block until it is done. Must not be called from the loop itself."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the loop's executor, with the caller's context variables."""
+    context = contextvars.copy_context()
+    fn = profiling_helpers.wrap(fn)
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(context.run, fn, *args, **kwargs))
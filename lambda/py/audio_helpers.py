@@ -15,23 +15,26 @@
 import logging
 import os
 import subprocess
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 
+try:
+    import lameenc
+except ImportError:
+    lameenc = None
+
+import data
+import mp3_helpers
+import pcm_helpers
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
 
-def encode_from_pcm_to_mp3(input_path: str,
-                           output_path: str) -> None:
-    lame_path = os.environ['LAMBDA_TASK_ROOT'] + '/lame'
-
-    try:
-        lame_output = subprocess.check_output([lame_path, '-m', 'j', '-b', '48', input_path, output_path], shell=False)
-    except subprocess.CalledProcessError as e:
-        _logger.fatal('LAME error:\n' + e.output.decode('utf-8'))
-        raise e
-
-    _logger.debug('LAME output:' + lame_output.decode('utf-8'))
+def _lame_path() -> str:
+    return os.environ['LAMBDA_TASK_ROOT'] + '/lame'
 
 
 def align_buf(buf: bytes, sample_width: int):
@@ -40,3 +43,246 @@ def align_buf(buf: bytes, sample_width: int):
     if remainder != 0:
         buf += b'\0' * (sample_width - remainder)
     return buf
+
+
+class Mp3Encoder(ABC):
+    """Streaming PCM to MP3 encoder.
+
+    PCM chunks are passed to `encode` as they arrive and the MP3 frames produced so far are returned; `flush` must be
+    called once at the end to obtain the remaining frames. Chunks must be aligned to the sample width.
+    """
+
+    def __init__(self, sample_rate: int, sample_width: int) -> None:
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+
+    @abstractmethod
+    def encode(self, pcm: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def flush(self) -> bytes:
+        pass
+
+
+class LameEncoder(Mp3Encoder):
+    """In-process encoder backed by libmp3lame."""
+
+    def __init__(self, sample_rate: int, sample_width: int) -> None:
+        super(LameEncoder, self).__init__(sample_rate, sample_width)
+        self._encoder = lameenc.Encoder()
+        self._encoder.set_in_sample_rate(sample_rate)
+        self._encoder.set_channels(1)
+        self._encoder.set_bit_rate(data.MP3_BIT_RATE)
+        self._encoder.set_quality(data.MP3_QUALITY)
+
+    def encode(self, pcm: bytes) -> bytes:
+        return bytes(self._encoder.encode(pcm))
+
+    def flush(self) -> bytes:
+        return bytes(self._encoder.flush())
+
+
+class LameProcessEncoder(Mp3Encoder):
+    """Fallback encoder piping raw PCM through the LAME binary.
+
+    The binary can only be run once per stream, so PCM is buffered in memory and encoded on `flush`.
+    """
+
+    def __init__(self, sample_rate: int, sample_width: int) -> None:
+        super(LameProcessEncoder, self).__init__(sample_rate, sample_width)
+        self._pcm = bytearray()
+
+    def encode(self, pcm: bytes) -> bytes:
+        self._pcm += pcm
+        return b''
+
+    def flush(self) -> bytes:
+        # With raw input, the mono mode also tells LAME that the PCM has a single channel
+        args = [_lame_path(), '-r', '-s', '{:g}'.format(self.sample_rate / 1000),
+                '--bitwidth', str(self.sample_width * 8), '--signed', '--little-endian', '-m', 'm',
+                '-b', str(data.MP3_BIT_RATE), '-q', str(data.MP3_QUALITY), '--silent', '-', '-']
+        pcm, self._pcm = bytes(self._pcm), bytearray()
+
+        try:
+            return subprocess.run(args, input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+        except subprocess.CalledProcessError as e:
+            _logger.fatal('LAME error:\n' + e.stderr.decode('utf-8'))
+            raise e
+
+
+def get_encoding_workers() -> int:
+    """vCPUs available to the function, which on Lambda grow with its memory size."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def is_segmented_encoding_enabled() -> bool:
+    return os.environ.get('MP3_SEGMENTED_ENCODING', '').lower() == 'true'
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Threads encoding the segments of all the responses in flight, one per vCPU."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_encoding_workers(), thread_name_prefix='mp3-segment')
+        return _executor
+
+
+class SegmentedEncoder(Mp3Encoder):
+    """Encoder splitting long responses into segments encoded in parallel.
+
+    PCM is buffered until `flush`, then cut into one segment per vCPU at most, none shorter than
+    `data.MP3_SEGMENT_MIN_SECONDS`. Cuts are made in pauses where possible, see `pcm_helpers.find_cuts`: the encoder
+    delay and padding every segment starts and ends with then only lengthen a pause, by about 100 ms. Segments are
+    encoded on a pool of threads, which run in parallel as libmp3lame releases the GIL and the LAME binary runs in
+    a process of its own, and the resulting streams are joined in order.
+    """
+
+    def __init__(self, new_encoder: Callable[[int, int], Mp3Encoder], sample_rate: int, sample_width: int) -> None:
+        super(SegmentedEncoder, self).__init__(sample_rate, sample_width)
+        self._new_encoder = new_encoder
+        self._pcm = bytearray()
+
+    def encode(self, pcm: bytes) -> bytes:
+        self._pcm += pcm
+        return b''
+
+    def flush(self) -> bytes:
+        pcm, self._pcm = bytes(self._pcm), bytearray()
+        segments = self._split(pcm)
+        if len(segments) == 1:
+            return self._encode_segment(pcm)
+
+        _logger.debug('Encoding %d segments in parallel', len(segments))
+        executor = _get_executor()
+        futures = [executor.submit(self._encode_segment, segment) for segment in segments]
+        mp3 = [future.result() for future in futures]
+        return mp3[0] + b''.join(mp3_helpers.strip_info_frame(part) for part in mp3[1:])
+
+    def _split(self, pcm: bytes) -> list:
+        seconds = len(pcm) / (self.sample_rate * self.sample_width)
+        count = min(get_encoding_workers(), int(seconds // data.MP3_SEGMENT_MIN_SECONDS))
+        if count < 2:
+            return [pcm]
+        try:
+            cuts = pcm_helpers.find_cuts(pcm, count, self.sample_rate)
+        except ImportError:
+            _logger.warning('NumPy is not available, response audio is encoded in one segment')
+            return [pcm]
+        offsets = [0] + [cut * self.sample_width for cut in cuts] + [len(pcm)]
+        return [pcm[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def _encode_segment(self, pcm: bytes) -> bytes:
+        encoder = self._new_encoder(self.sample_rate, self.sample_width)
+        return encoder.encode(pcm) + encoder.flush()
+
+
+def transcode_mp3(mp3: bytes, sample_rate: int) -> bytes:
+    """Re-encode an MP3 stream at the bit rate Alexa expects, resampling it to `sample_rate`."""
+    args = [_lame_path(), '--mp3input', '--resample', '{:g}'.format(sample_rate / 1000), '-b', str(data.MP3_BIT_RATE),
+            '-q', str(data.MP3_QUALITY), '--silent', '-', '-']
+    try:
+        return subprocess.run(args, input=mp3, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        _logger.fatal('LAME error:\n' + e.stderr.decode('utf-8'))
+        raise e
+
+
+# Cleared by the first MP3 response that cannot be passed through, see `get_audio_out_encoding`
+_mp3_passthrough_usable = True
+
+
+def get_audio_out_encoding() -> str:
+    """Encoding to ask the Assistant for, chosen with the `AUDIO_OUT_ENCODING` environment variable.
+
+    `LINEAR16`, the default, is encoded locally. `MP3` is passed through when it meets Alexa's constraints, and
+    transcoded otherwise. `AUTO` asks for MP3 until a response needs transcoding, which costs more than encoding
+    LINEAR16, and for LINEAR16 from then on.
+    """
+    setting = os.environ.get('AUDIO_OUT_ENCODING', 'LINEAR16').upper()
+    if setting == 'AUTO':
+        return 'MP3' if _mp3_passthrough_usable else 'LINEAR16'
+    return 'MP3' if setting == 'MP3' else 'LINEAR16'
+
+
+def _disable_mp3_passthrough(reason: str) -> None:
+    global _mp3_passthrough_usable
+    if _mp3_passthrough_usable:
+        _logger.warning('MP3 from the Assistant cannot be passed through (%s)', reason)
+        _mp3_passthrough_usable = False
+
+
+class Mp3Passthrough(Mp3Encoder):
+    """Takes the MP3 returned by the Assistant in place of PCM.
+
+    As soon as the first frame header is known, a stream meeting Alexa's constraints is passed through as it
+    arrives; any other one is buffered and transcoded on `flush`.
+    """
+
+    def __init__(self, sample_rate: int, sample_width: int) -> None:
+        super(Mp3Passthrough, self).__init__(sample_rate, sample_width)
+        self._validator = mp3_helpers.Mp3StreamValidator()
+        self._mp3 = bytearray()
+        self.passthrough = None
+
+    def encode(self, mp3: bytes) -> bytes:
+        self._validator.feed(mp3)
+        if self.passthrough is None:
+            self._mp3 += mp3
+            if self._validator.first_header is None:
+                return b''
+            self.passthrough = self._validator.is_alexa_compliant()
+            if not self.passthrough:
+                _disable_mp3_passthrough('first frame: %r' % self._validator.first_header)
+                return b''
+            mp3, self._mp3 = bytes(self._mp3), bytearray()
+            return mp3
+
+        if not self.passthrough:
+            self._mp3 += mp3
+            return b''
+        # Frames already passed through cannot be taken back
+        if not self._validator.is_alexa_compliant():
+            _disable_mp3_passthrough('format changed to %r' % (self._validator.formats[-1],))
+            raise mp3_helpers.Mp3FormatError('MP3 stream changed format: %r' % self._validator.formats)
+        return mp3
+
+    def flush(self) -> bytes:
+        self._validator.close()
+        if self.passthrough:
+            return b''
+        _logger.info('Transcoding MP3 response')
+        mp3, self._mp3 = bytes(self._mp3), bytearray()
+        return transcode_mp3(mp3, self.sample_rate)
+
+
+def new_mp3_encoder(sample_rate: int = data.DEFAULT_AUDIO_SAMPLE_RATE,
+                    sample_width: int = data.DEFAULT_AUDIO_SAMPLE_WIDTH,
+                    audio_out_encoding: str = 'LINEAR16',
+                    streaming: bool = False) -> Mp3Encoder:
+    """Return the stage turning the Assistant's audio in `audio_out_encoding` into MP3 for Alexa.
+
+    LINEAR16 is encoded in-process when libmp3lame bindings are installed, by the LAME binary otherwise. The binary
+    needs the whole response anyway, so it is always handed segments when there are vCPUs to spare; libmp3lame
+    otherwise encodes chunks as they arrive, unless the `MP3_SEGMENTED_ENCODING` environment variable is `true`.
+    Audio `streaming` to the user while it is encoded is never segmented, as segments are only returned on `flush`.
+    """
+    if audio_out_encoding == 'MP3':
+        return Mp3Passthrough(sample_rate, sample_width)
+    if lameenc is not None:
+        new_encoder = LameEncoder
+    else:
+        _logger.warning('lameenc is not available, falling back to the LAME binary')
+        new_encoder = LameProcessEncoder
+    segmented = new_encoder is LameProcessEncoder or is_segmented_encoding_enabled()
+    if segmented and not streaming and get_encoding_workers() > 1:
+        return SegmentedEncoder(new_encoder, sample_rate, sample_width)
+    return new_encoder(sample_rate, sample_width)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Staged receive -> encode -> upload pipeline for the Assistant's response audio.
+
+The receiving stage is the caller, which pushes PCM chunks with `feed`. Encoding (preceded by the optional
+post-processing) and uploading run as their own tasks
+on the event loop, connected by bounded queues so that a slow stage holds back the ones before it instead of
+buffering without limit. Their blocking calls are handed to the loop's executor.
+"""
+import asyncio
+import logging
+
+import async_helpers
+import data
+import metrics_helpers
+from audio_helpers import Mp3Encoder
+from pcm_helpers import PcmProcessor
+from storage_helpers import AudioWriter
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_EOS = object()
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class AudioPipeline(object):
+    """Must be created, fed and closed from the same event loop."""
+
+    def __init__(self,
+                 encoder: Mp3Encoder,
+                 writer: AudioWriter,
+                 queue_size: int = data.AUDIO_PIPELINE_QUEUE_SIZE,
+                 processor: PcmProcessor = None) -> None:
+        self._processor = processor
+        self._encoder = encoder
+        self._writer = writer
+        self._pcm_queue = asyncio.Queue(maxsize=queue_size)
+        self._mp3_queue = asyncio.Queue(maxsize=queue_size)
+        # Resolves to the exception to raise once the pipeline failed or was cancelled
+        self._stopped = asyncio.get_running_loop().create_future()
+        self._tasks = [
+            asyncio.ensure_future(self._run_stage(self._encode)),
+            asyncio.ensure_future(self._run_stage(self._upload)),
+        ]
+
+    async def feed(self, pcm: bytes) -> None:
+        """Queue a PCM chunk, waiting while the encoder is behind."""
+        await self._put(self._pcm_queue, pcm)
+
+    async def close(self) -> None:
+        """Wait for the queued audio to be encoded and uploaded."""
+        await self._put(self._pcm_queue, _EOS)
+        await asyncio.wait(self._tasks)
+        self._check()
+
+    async def cancel(self) -> None:
+        """Stop all stages and discard any partial upload."""
+        if not self._stopped.done():
+            _logger.info('Cancelling audio pipeline')
+            self._stop(PipelineCancelled())
+        # Stages finish their current blocking call first, so the writer is never aborted while in use
+        await asyncio.wait(self._tasks)
+        try:
+            await async_helpers.run_blocking(self._writer.abort)
+        except Exception as e:
+            _logger.error('Could not abort upload: %s', e)
+
+    def _stop(self, error: Exception) -> None:
+        if not self._stopped.done():
+            self._stopped.set_result(error)
+
+    def _check(self) -> None:
+        if self._stopped.done():
+            raise self._stopped.result()
+
+    async def _put(self, q: asyncio.Queue, item: object) -> None:
+        self._check()
+        if not q.full():
+            q.put_nowait(item)
+            return
+        put = asyncio.ensure_future(q.put(item))
+        await asyncio.wait((put, self._stopped), return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+        self._check()
+
+    async def _get_all(self, q: asyncio.Queue) -> list:
+        """Wait for at least one item, then take everything queued so far.
+
+        Stages handle what piled up in a single executor call, which keeps hand-overs few when the loop is busy.
+        """
+        self._check()
+        if q.empty():
+            get = asyncio.ensure_future(q.get())
+            await asyncio.wait((get, self._stopped), return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+            self._check()
+            items = [get.result()]
+        else:
+            items = [q.get_nowait()]
+        while not q.empty():
+            items.append(q.get_nowait())
+        return items
+
+    async def _run_stage(self, stage) -> None:
+        try:
+            await stage()
+        except Exception as e:
+            if not self._stopped.done():
+                _logger.error('Audio pipeline stage failed: %s', e, exc_info=True)
+                self._stop(e)
+
+    def _process_chunks(self, chunks: list) -> list:
+        with metrics_helpers.span('postprocess'):
+            processed = [self._processor.process(pcm) for pcm in chunks if pcm is not _EOS]
+            if chunks[-1] is _EOS:
+                processed.append(self._processor.flush())
+            return processed
+
+    def _encode_chunks(self, chunks: list) -> bytes:
+        eos = chunks[-1] is _EOS
+        if self._processor is not None:
+            chunks = self._process_chunks(chunks)
+        with metrics_helpers.span('encode'):
+            mp3 = b''.join(self._encoder.encode(pcm) for pcm in chunks if pcm and pcm is not _EOS)
+            if eos:
+                mp3 += self._encoder.flush()
+            return mp3
+
+    def _upload_chunks(self, chunks: list) -> None:
+        with metrics_helpers.span('upload'):
+            for mp3 in chunks:
+                if mp3 is _EOS:
+                    self._writer.close()
+                else:
+                    self._writer.write(mp3)
+
+    async def _encode(self) -> None:
+        while True:
+            chunks = await self._get_all(self._pcm_queue)
+            mp3 = await async_helpers.run_blocking(self._encode_chunks, chunks)
+            if mp3:
+                await self._put(self._mp3_queue, mp3)
+            if chunks[-1] is _EOS:
+                await self._put(self._mp3_queue, _EOS)
+                return
+
+    async def _upload(self) -> None:
+        while True:
+            chunks = await self._get_all(self._mp3_queue)
+            await async_helpers.run_blocking(self._upload_chunks, chunks)
+            if chunks[-1] is _EOS:
+                return
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Lazily created, per-container AWS service clients.
+
+boto3 is only imported, and clients are only built, the first time they are needed. Clients are configured from
+`data.AWS_CLIENT_CONFIG`.
+"""
+import logging
+import threading
+
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_clients = {}
+_resources = {}
+# boto3 sessions are not thread-safe, creation is serialized
+_lock = threading.Lock()
+
+
+def get_client(service_name: str):
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                import boto3
+                from botocore.config import Config
+                _logger.info('Creating %s client', service_name)
+                config = Config(**data.AWS_CLIENT_CONFIG.get(service_name, {}))
+                client = _clients[service_name] = boto3.client(service_name, config=config)
+    return client
+
+
+def get_resource(service_name: str):
+    resource = _resources.get(service_name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(service_name)
+            if resource is None:
+                import boto3
+                _logger.info('Creating %s resource', service_name)
+                resource = _resources[service_name] = boto3.resource(service_name)
+    return resource
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Tuple
+
+
+class LRUCache(object):
+    """Thread-safe LRU mapping whose entries can expire.
+
+    Entries expire `ttl` seconds after they were stored or, when `sliding` is set, after they were last read.
+    `on_evict(key, value)` is called, outside the lock, for every entry dropped because of expiry, capacity or
+    `discard`, but not for values replaced by `set`: use `setdefault` to create entries that must not be lost.
+    """
+
+    def __init__(self,
+                 maxsize: int,
+                 ttl: float = None,
+                 sliding: bool = False,
+                 on_evict: Callable = None) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._sliding = sliding
+        self._on_evict = on_evict
+        self._data = OrderedDict()  # key -> [value, ttl, expires_at]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: object = None) -> object:
+        evicted = []
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._is_expired(entry):
+                evicted.append((key, self._data.pop(key)[0]))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                value = default
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+                if self._sliding and entry[1] is not None:
+                    entry[2] = time.monotonic() + entry[1]
+                value = entry[0]
+        self._notify(evicted)
+        return value
+
+    def peek(self, key: Hashable, default: object = None) -> object:
+        """Like `get`, but without updating recency or hit counters."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or self._is_expired(entry):
+                return default
+            return entry[0]
+
+    def set(self, key: Hashable, value: object, ttl: float = None) -> None:
+        ttl = self._ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        evicted = []
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = [value, ttl, expires_at]
+            while len(self._data) > self._maxsize:
+                evicted.append(self._popitem())
+        self._notify(evicted)
+
+    def setdefault(self, key: Hashable, value: object, ttl: float = None) -> object:
+        """Return the live value of `key`, storing `value` first if there is none. Callers racing to create the same
+        entry all get the one stored first, and can release their own."""
+        ttl = self._ttl if ttl is None else ttl
+        evicted = []
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._is_expired(entry):
+                evicted.append((key, self._data.pop(key)[0]))
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+                if self._sliding and entry[1] is not None:
+                    entry[2] = time.monotonic() + entry[1]
+                value = entry[0]
+            else:
+                self._data[key] = [value, ttl, time.monotonic() + ttl if ttl is not None else None]
+                while len(self._data) > self._maxsize:
+                    evicted.append(self._popitem())
+        self._notify(evicted)
+        return value
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is not None:
+            self._notify([(key, entry[0])])
+
+    def expire(self) -> None:
+        """Drop every expired entry."""
+        with self._lock:
+            keys = [k for k, entry in self._data.items() if self._is_expired(entry)]
+            evicted = [(k, self._data.pop(k)[0]) for k in keys]
+        self._notify(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            evicted = [(k, entry[0]) for k, entry in self._data.items()]
+            self._data.clear()
+        self._notify(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._data)}
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and not self._is_expired(entry)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _popitem(self) -> Tuple[Hashable, object]:
+        key, entry = self._data.popitem(last=False)
+        return key, entry[0]
+
+    @staticmethod
+    def _is_expired(entry: list) -> bool:
+        return entry[2] is not None and entry[2] <= time.monotonic()
+
+    def _notify(self, evicted: List[Tuple[Hashable, object]]) -> None:
+        if not evicted:
+            return
+        with self._lock:
+            self.evictions += len(evicted)
+        if self._on_evict is not None:
+            for key, value in evicted:
+                self._on_evict(key, value)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-container pool of authorized gRPC channels to the Assistant API.
+
+Channels survive across warm invocations so that only the first request of a container pays TLS and HTTP/2 setup.
+They are `grpc.aio` channels, bound to the shared event loop: `get_channel` must be called from it.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+import grpc
+from google.oauth2.credentials import Credentials
+
+import cache_helpers
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_BROKEN_STATES = (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN)
+
+
+class _ChannelEntry(object):
+    __slots__ = ('channel', 'credentials', 'loop')
+
+    def __init__(self, channel: grpc.aio.Channel, credentials: Credentials) -> None:
+        self.channel = channel
+        self.credentials = credentials
+        self.loop = asyncio.get_running_loop()
+
+    @property
+    def state(self) -> grpc.ChannelConnectivity:
+        return self.channel.get_state()
+
+    def is_usable(self) -> bool:
+        return self.state not in _BROKEN_STATES and not self.credentials.expired
+
+    def close(self) -> None:
+        # Entries may be evicted from any thread, while the channel can only be closed from its loop. Calls of other
+        # conversations may still be running on it.
+        asyncio.run_coroutine_threadsafe(self.channel.close(grace=data.GRPC_CHANNEL_CLOSE_GRACE), self.loop)
+
+
+def _close_channel(key: tuple, entry: _ChannelEntry) -> None:
+    _logger.info('Closing gRPC channel to %s', key[0])
+    entry.close()
+
+
+_channels = cache_helpers.LRUCache(maxsize=data.GRPC_CHANNEL_CACHE_SIZE,
+                                   ttl=data.GRPC_CHANNEL_IDLE_TIMEOUT,
+                                   sliding=True,
+                                   on_evict=_close_channel)
+
+
+def _create_channel(credentials: Optional[Credentials], api_endpoint: str) -> grpc.aio.Channel:
+    channel_credentials = grpc.ssl_channel_credentials()
+    if credentials is not None:
+        channel_credentials = grpc.composite_channel_credentials(
+            channel_credentials, grpc.access_token_call_credentials(credentials.token))
+    return grpc.aio.secure_channel(api_endpoint, channel_credentials, options=data.GRPC_CHANNEL_OPTIONS)
+
+
+def _channel_key(credentials: Credentials, api_endpoint: str) -> tuple:
+    return api_endpoint, credentials.token
+
+
+def get_channel(credentials: Credentials, api_endpoint: str) -> grpc.aio.Channel:
+    """Return an authorized channel to `api_endpoint`, reusing a cached one when it is still healthy."""
+    _channels.expire()
+
+    key = _channel_key(credentials, api_endpoint)
+    entry = _channels.get(key)  # type: _ChannelEntry
+    if entry is not None and not entry.is_usable():
+        _logger.info('Cached gRPC channel is no longer usable (state: %s)', entry.state)
+        _channels.discard(key)
+        entry = None
+
+    if entry is None:
+        _logger.info('Connecting to %s', api_endpoint)
+        created = _ChannelEntry(_create_channel(credentials, api_endpoint), credentials)
+        entry = _channels.setdefault(key, created)
+        if entry is not created:
+            # Another caller cached a channel first: ours would never be closed
+            created.close()
+    else:
+        _logger.debug('Reusing gRPC channel to %s', api_endpoint)
+
+    return entry.channel
+
+
+def invalidate_channel(credentials: Credentials, api_endpoint: str) -> None:
+    """Drop the cached channel, e.g. after the server reported it as unavailable."""
+    _channels.discard(_channel_key(credentials, api_endpoint))
+
+
+async def probe(api_endpoint: str, timeout: float) -> bool:
+    """Whether a connection to `api_endpoint` can be set up within `timeout` seconds. No call is made, so no
+    credentials are needed."""
+    channel = _create_channel(None, api_endpoint)
+    try:
+        await asyncio.wait_for(channel.channel_ready(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        await channel.close()
+
+
+def close_all() -> None:
+    _channels.clear()
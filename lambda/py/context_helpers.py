@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""What a skill request needs from its envelope, read once.
+
+The context is built by a global request interceptor, before any handler runs, and kept in the request attributes.
+Handlers and helpers read from it instead of walking the envelope and hashing the user ID again.
+"""
+import concurrent.futures
+import gettext
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Callable, Optional
+
+from ask_sdk_core.handler_input import HandlerInput
+
+import deadline_helpers
+import hash_helpers
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_REQUEST_ATTRIBUTE = 'context'
+# Session attribute carrying the Assistant's conversation state, see `conversation_helpers`
+CONVERSATION_STATE_ATTRIBUTE = 'conversation_state'
+
+DEFAULT_LOCALE = 'en-US'
+
+
+def _get_locale_file_name(locale: str) -> str:
+    if locale.startswith("fr"):
+        return "fr_FR"
+    elif locale.startswith("it"):
+        return "it_IT"
+    elif locale.startswith("es"):
+        return "es_ES"
+    return locale.replace("-", "_")
+
+
+@lru_cache(maxsize=None)
+def _load_translations(locale_file_name: str) -> gettext.NullTranslations:
+    """Compiled catalogs are read from disk once per container and locale"""
+    _logger.info("Loading locale file: {}".format(locale_file_name))
+    return gettext.translation('messages', localedir='locales', languages=[locale_file_name], fallback=True)
+
+
+def get_translations(locale: str) -> gettext.NullTranslations:
+    return _load_translations(_get_locale_file_name(locale))
+
+
+def hash_user_id(user_id: str) -> str:
+    """Device ID registered with the Google Assistant on behalf of an Alexa user."""
+    return hash_helpers.ripemd160(user_id.encode('utf-8')).hex()
+
+
+class RequestContext(object):
+    __slots__ = ('user_id', 'device_id', 'audio_key', 'access_token', 'locale', 'gettext', 'session_id',
+                 'session_attributes', 'deadline', 'registration', '_credentials')
+
+    def __init__(self, handler_input: HandlerInput) -> None:
+        envelope = handler_input.request_envelope
+        system = envelope.context.system
+
+        self.user_id: str = system.user.user_id
+        self.device_id: str = hash_user_id(self.user_id)
+        # Keys are unique per Echo device rather than per user, so that concurrent requests from the devices of one
+        # account do not overwrite each other's audio, while the number of objects stays bounded
+        alexa_device_hash = hashlib.sha256(system.device.device_id.encode('utf-8')).hexdigest()
+        self.audio_key: str = self.device_id + '/' + alexa_device_hash[:16]
+        self.access_token: Optional[str] = system.user.access_token
+
+        locale = getattr(envelope.request, 'locale', None)
+        self.locale: str = locale or DEFAULT_LOCALE
+        self.gettext: Callable[[str], str] = get_translations(locale).gettext if locale else gettext.gettext
+
+        self.session_id: Optional[str] = None
+        # The attributes manager's own dictionary, so that changes made through either are seen by both
+        self.session_attributes: Optional[dict] = None
+        if envelope.session is not None:
+            self.session_id = envelope.session.session_id
+            self.session_attributes = handler_input.attributes_manager.session_attributes
+        self.deadline: deadline_helpers.Deadline = deadline_helpers.start_deadline(handler_input.context)
+        # Registration of the device with the Assistant, when it runs alongside the Assist call
+        self.registration: Optional[concurrent.futures.Future] = None
+        self._credentials = None
+
+    @property
+    def credentials(self) -> 'Credentials':
+        """Google credentials of the linked account, built on first use: not every request needs them."""
+        if self._credentials is None:
+            # TODO: a more meaningful exception should be thrown, so that we can return a LinkAccount card to the user
+            if not self.access_token:
+                _logger.info('User must link his Google Account')
+                raise Exception
+            # google-auth and its dependencies are slow to import
+            from google.oauth2.credentials import Credentials
+            self._credentials = Credentials(self.access_token)
+        return self._credentials
+
+    @property
+    def conversation_state(self) -> object:
+        """Conversation state of the session as it is stored in its attributes, still encoded."""
+        if self.session_attributes is None:
+            return None
+        return self.session_attributes.get(CONVERSATION_STATE_ATTRIBUTE)
+
+    def __repr__(self) -> str:
+        return 'RequestContext(device_id=%s, locale=%s, deadline=%r)' % (self.device_id, self.locale, self.deadline)
+
+
+def init_context(handler_input: HandlerInput) -> RequestContext:
+    context = RequestContext(handler_input)
+    _logger.info('Locale is {}'.format(context.locale))
+    handler_input.attributes_manager.request_attributes[_REQUEST_ATTRIBUTE] = context
+    return context
+
+
+def get_context(handler_input: HandlerInput) -> RequestContext:
+    context = handler_input.attributes_manager.request_attributes.get(_REQUEST_ATTRIBUTE)
+    return context if context is not None else init_context(handler_input)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Storage of the Assistant's opaque conversation state between the turns of a session.
+
+The state travels in the `conversation_state` session attribute, as a versioned string:
+
+    1.<base64>    the raw state
+    1z.<base64>   the zlib-compressed state, used when smaller
+    1s            the state is kept server-side, in its own item of the DynamoDB table, under the session ID
+
+Server-side storage is opt-in with the `CONVERSATION_STATE_SERVER_SIDE` environment variable, and only used for
+states whose encoding exceeds `data.CONVERSATION_STATE_INLINE_LIMIT`. Sessions started before the encoding was
+versioned carry a list of byte values, which is still understood.
+
+Server-side states are read and written directly, with consistent reads, rather than through the persistent
+attributes: those are cached per container, and the next turn of a session may be handled by another one.
+"""
+import base64
+import binascii
+import logging
+import os
+import time
+import zlib
+from typing import Optional
+
+from ask_sdk_core.handler_input import HandlerInput
+
+import aws_helpers
+import context_helpers
+import data
+import skill_helpers
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_ITEM_PREFIX = 'conversation_state#'
+
+_RAW = '1.'
+_ZLIB = '1z.'
+_STORED = '1s'
+
+
+def is_server_side_enabled() -> bool:
+    return os.environ.get('CONVERSATION_STATE_SERVER_SIDE', '').lower() == 'true'
+
+
+def encode_state(state: bytes) -> str:
+    compressed = zlib.compress(state, 9)
+    if len(compressed) < len(state):
+        return _ZLIB + base64.b64encode(compressed).decode('ascii')
+    return _RAW + base64.b64encode(state).decode('ascii')
+
+
+def decode_state(value: object) -> Optional[bytes]:
+    """Decode an inline state, returning None for a state that cannot be read: the conversation then starts over."""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return bytes(value)
+    try:
+        if value.startswith(_ZLIB):
+            return zlib.decompress(base64.b64decode(value[len(_ZLIB):]))
+        if value.startswith(_RAW):
+            return base64.b64decode(value[len(_RAW):])
+    except (binascii.Error, zlib.error) as e:
+        _logger.warning('Corrupted conversation state: %s', e)
+        return None
+    _logger.warning('Unknown conversation state encoding: %.8s', value)
+    return None
+
+
+def _get_item_key(handler_input: HandlerInput) -> dict:
+    return {'id': _ITEM_PREFIX + context_helpers.get_context(handler_input).session_id}
+
+
+def _get_table():
+    return aws_helpers.get_resource('dynamodb').Table(data.DYNAMODB_TABLE)
+
+
+def get_conversation_state(handler_input: HandlerInput) -> Optional[bytes]:
+    """State of the previous turn. May read from persistent storage, so it blocks."""
+    value = context_helpers.get_context(handler_input).conversation_state
+    if value == _STORED:
+        item = _get_table().get_item(Key=_get_item_key(handler_input), ConsistentRead=True).get('Item')
+        # DynamoDB deletes expired items late, if at all
+        if item is None or item['expires'] < time.time():
+            _logger.warning('Conversation state of session not found in persistent storage')
+            return None
+        value = item['state']
+    return decode_state(value)
+
+
+def set_conversation_state(handler_input: HandlerInput, state: bytes) -> None:
+    """Store the state for the next turn. May write to persistent storage, so it blocks."""
+    value = encode_state(state)
+    _logger.debug('Conversation state: %d bytes, encoded as %d characters', len(state), len(value))
+
+    if is_server_side_enabled() and len(value) > data.CONVERSATION_STATE_INLINE_LIMIT:
+        # Items of sessions that ended without notice expire, with a TTL on `expires` when enabled on the table
+        item = dict(_get_item_key(handler_input), state=value,
+                    expires=int(time.time()) + data.CONVERSATION_STATE_SERVER_SIDE_TTL)
+        _get_table().put_item(Item=item)
+        value = _STORED
+
+    skill_helpers.set_session_attribute(handler_input, context_helpers.CONVERSATION_STATE_ATTRIBUTE, value)
+
+
+def discard_conversation_state(handler_input: HandlerInput) -> None:
+    """Drop the server-side state of an ended session, if any."""
+    if context_helpers.get_context(handler_input).conversation_state != _STORED:
+        return
+    _get_table().delete_item(Key=_get_item_key(handler_input))
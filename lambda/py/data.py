@@ -16,6 +16,7 @@ from gettext import gettext as _
 
 
 SKILL_NAME = 'Alexa Assistant'
+METRICS_NAMESPACE = 'AlexaAssistant'
 
 ERROR_GENERIC = _('Something went wrong, try again later!!')
 ERROR_REGISTRATION = _('There was an error registering the Instance with the Google API. The first time that you run '
@@ -25,6 +26,8 @@ FIRST_RUN = _('REPEAT AFTER ME Welcome to the unofficial Google Assistant skill
               'complete the language and address settings.')
 LINK_ACCOUNT = _('You must link your Google account to use this skill. Please use the link in the Alexa app to '
                  'authorise your Google Account.')
+ERROR_TIMEOUT = _('The Google Assistant is taking too long to answer, try again later!!')
+PROGRESSIVE_RESPONSE = _('Working on it')
 FALLBACK = _('I\'m sorry, I don\'t understand that question!!')
 
 HELLO = _('Hello')
@@ -36,12 +39,128 @@ GOOGLE_ASSISTANT_API = {
 }
 
 DYNAMODB_TABLE = 'AlexaAssistantSkillSettings'
+PERSISTENCE_CACHE_SIZE = 256
+PERSISTENCE_CACHE_TTL = 60 * 5
 
-DEFAULT_GRPC_DEADLINE = 60 * 3 + 5
+# Seconds Alexa waits for the response of the skill, and the part of them kept to build and return it
+ALEXA_RESPONSE_TIMEOUT = 8
+DEADLINE_SAFETY_MARGIN = 1
+
+# Attempts of the Assist call on UNAVAILABLE, after an exponential, jittered backoff (seconds). No attempt is started
+# with less than GRPC_MIN_ATTEMPT_TIME seconds of budget left.
+GRPC_MAX_ATTEMPTS = 3
+GRPC_RETRY_BACKOFF = 0.1
+GRPC_RETRY_BACKOFF_MAX = 1
+GRPC_MIN_ATTEMPT_TIME = 2
+
+# Selection among the Assistant endpoints: weight of a new sample in the moving averages of time to first byte and
+# error rate, how much more errors weigh than latency, and share of calls sent to another endpoint than the fastest,
+# so that its figures stay current. After ENDPOINT_BREAKER_FAILURES UNAVAILABLE in a row an endpoint gets no calls,
+# until a probe, every ENDPOINT_PROBE_INTERVAL seconds, connects to it within ENDPOINT_PROBE_TIMEOUT seconds.
+ENDPOINT_EWMA_ALPHA = 0.2
+ENDPOINT_ERROR_PENALTY = 10
+ENDPOINT_EXPLORE_RATE = 0.05
+ENDPOINT_BREAKER_FAILURES = 3
+ENDPOINT_PROBE_INTERVAL = 5
+ENDPOINT_PROBE_TIMEOUT = 2
+
+# Devices known to be registered with the Assistant, per container, and seconds a registration may take
+DEVICE_REGISTRY_SIZE = 1024
+DEVICE_REGISTRATION_TIMEOUT = 5
+
+GRPC_CHANNEL_CACHE_SIZE = 8
+GRPC_CHANNEL_IDLE_TIMEOUT = 60 * 10
+# Seconds the calls in flight on a dropped channel have to complete, before they are cancelled
+GRPC_CHANNEL_CLOSE_GRACE = 60 * 3
+GRPC_CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', 30 * 1000),
+    ('grpc.keepalive_timeout_ms', 10 * 1000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+]
 
 DEFAULT_AUDIO_SAMPLE_RATE = 16000
 DEFAULT_AUDIO_SAMPLE_WIDTH = 2
 
-DEFAULT_AUDIO_VOLUME = 50
-RESPONSE_PCM_FILE = '/tmp/response.pcm'
-RESPONSE_MP3_FILE = '/tmp/response.mp3'
+# Post-processing of the response PCM
+AUDIO_SILENCE_THRESHOLD = -50  # dBFS
+AUDIO_SILENCE_PADDING_MS = 150
+AUDIO_MAX_PAUSE_MS = 1000
+AUDIO_GAIN_WINDOW_MS = 500
+# Quiet responses are amplified towards this peak level, up to the maximum gain. Loud ones are left untouched.
+AUDIO_TARGET_PEAK = -1  # dBFS
+AUDIO_MAX_GAIN = 4.0
+
+MP3_BIT_RATE = 48
+MP3_QUALITY = 3
+
+# Segmented encoding: responses are split in segments of at least this many seconds, then each cut is moved to the
+# quietest block of audio within the search distance of its position
+MP3_SEGMENT_MIN_SECONDS = 5
+MP3_SEGMENT_SEARCH_MS = 3000
+MP3_SEGMENT_BLOCK_MS = 20
+
+# MP3 accepted by the SSML <audio> tag: MPEG-2 at one of these bit rates (kbps) and sample rates
+ALEXA_MP3_BIT_RATES = (48,)
+ALEXA_MP3_SAMPLE_RATES = (16000, 22050, 24000)
+
+# Encoded conversation states longer than this are kept server-side, when enabled
+CONVERSATION_STATE_INLINE_LIMIT = 2048
+# Seconds a server-side conversation state is kept after the turn that stored it
+CONVERSATION_STATE_SERVER_SIDE_TTL = 60 * 60
+
+AUDIO_PIPELINE_QUEUE_SIZE = 32
+# Threads running the blocking calls (S3, encoding) of all the conversations in flight
+ASYNC_BLOCKING_WORKERS = 32
+S3_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+
+# Options of the AWS clients, by service. Keep-alive connections, at least one per blocking worker.
+AWS_CLIENT_CONFIG = {
+    's3': {
+        'max_pool_connections': ASYNC_BLOCKING_WORKERS,
+        'tcp_keepalive': True,
+        'connect_timeout': 2,
+        'read_timeout': 10,
+        'retries': {'mode': 'standard', 'max_attempts': 3},
+    },
+}
+
+# Profiled invocations: frames kept per traced allocation, and length of the summaries. At most this many profiles are
+# kept when written to files, and the event loop has that many seconds to start or stop its profiler.
+PROFILE_TRACEMALLOC_FRAMES = 1
+PROFILE_TOP_FUNCTIONS = 20
+PROFILE_TOP_ALLOCATIONS = 10
+PROFILE_MAX_FILES = 20
+PROFILE_LOOP_TIMEOUT = 1
+
+# Self-hosted server: connections accepted beyond its busy threads, which wait for one to be free. Any more are
+# answered 503 at once, as Alexa gives up on a request after 8 seconds anyway.
+SERVER_QUEUED_REQUESTS = 16
+
+# Seconds the URL handed to Alexa for the response audio is valid for
+AUDIO_URL_TTL = 10
+# Streamed playback: seconds a streamed answer may take in all, and may pause between two chunks
+AUDIO_STREAM_TIMEOUT = 60 * 3
+AUDIO_STREAM_READ_TIMEOUT = 10
+# Seconds without an answer from the Assistant before Alexa says it is working on it
+PROGRESSIVE_RESPONSE_DELAY = 1.5
+# Responses kept by the local audio origin, and for how long (seconds) when not cached for longer
+AUDIO_ORIGIN_CACHE_SIZE = 256
+AUDIO_ORIGIN_TTL = 60 * 5
+
+# Requests whose response may be cached, with the default time to live for each of them
+RESPONSE_CACHE_INTENTS = {
+    'LaunchRequest': 60 * 60 * 24,
+}
+# Time to live overrides for specific (normalized) queries, 0 disables caching
+RESPONSE_CACHE_QUERY_TTL = {}
+RESPONSE_CACHE_PREFIX = 'cache/'
+RESPONSE_CACHE_SIZE = 128
+
+# Display text read by Alexa in text and hybrid modes: at most this many characters (Alexa takes up to 8000 of SSML),
+# and only when the audio is not much longer than the text takes to read at this pace (characters per second)
+TEXT_RESPONSE_MAX_CHARS = 6000
+TEXT_RESPONSE_HYBRID_MAX_CHARS = 200
+TEXT_RESPONSE_CHARS_PER_SECOND = 12
+TEXT_RESPONSE_MAX_AUDIO_RATIO = 2
+TEXT_RESPONSE_AUDIO_SLACK = 3
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Time budget of a skill request.
+
+Alexa waits `data.ALEXA_RESPONSE_TIMEOUT` seconds for a response, and Lambda may stop the function even earlier. The
+budget starts with the request and is the shorter of the two, minus the time needed to return the response.
+
+Hedging of the Assist call is opt-in with the `GRPC_HEDGE_DELAY_MS` environment variable: a second, identical call is
+started when the first has not answered within that many milliseconds.
+"""
+import logging
+import os
+import random
+import time
+from typing import Optional
+
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    __slots__ = ('_expires_at',)
+
+    def __init__(self, budget: float) -> None:
+        self._expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def __repr__(self) -> str:
+        return 'Deadline(remaining=%.3f)' % self.remaining()
+
+
+def start_deadline(lambda_context: object) -> Deadline:
+    """Start the budget of a request, from the Lambda context when there is one."""
+    budget = data.ALEXA_RESPONSE_TIMEOUT
+    get_remaining_time = getattr(lambda_context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time is not None:
+        budget = min(budget, get_remaining_time() / 1000)
+    deadline = Deadline(max(0.0, budget - data.DEADLINE_SAFETY_MARGIN))
+    _logger.debug('Request budget: %s', deadline)
+    return deadline
+
+
+def get_backoff(attempt: int) -> float:
+    """Seconds to wait before retrying after `attempt` failed attempts, with full jitter."""
+    return random.uniform(0, min(data.GRPC_RETRY_BACKOFF_MAX, data.GRPC_RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+
+def get_hedge_delay() -> Optional[float]:
+    """Seconds without a response after which the Assist call is hedged, None when hedging is off."""
+    value = os.environ.get('GRPC_HEDGE_DELAY_MS')
+    return int(value) / 1000 if value else None
@@ -13,34 +13,47 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import concurrent.futures
 import json
+import logging
 
-from google.auth.transport.requests import AuthorizedSession
-from google.auth.transport import Response
-from google.oauth2.credentials import Credentials
+import async_helpers
+import cache_helpers
+import data
+import metrics_helpers
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
 
 
 _DEVICE_API_URL = 'https://embeddedassistant.googleapis.com/v1alpha2'
 
 _ERROR_MESSAGE_TEMPLATE = """Failed to register device {status} ({status_code}): {error_text}"""
 
+# Devices known to be registered in this container, and the registrations in flight. Both are only used on the event
+# loop, as is the HTTP session shared by all the registrations.
+_verified = cache_helpers.LRUCache(maxsize=data.DEVICE_REGISTRY_SIZE)
+_pending = {}
+_session = None
+
 
 class RegistrationError(Exception):
-    def __init__(self, response: Response, device_model_id: str) -> None:
+    def __init__(self, status_code: int, body: str, device_model_id: str) -> None:
         super(RegistrationError, self).__init__(
-              self._format_error(response, device_model_id))
+              self._format_error(status_code, body, device_model_id))
 
     @staticmethod
-    def _format_error(response: Response, device_model_id: str) -> str:
+    def _format_error(status_code: int, body: str, device_model_id: str) -> str:
         """Prints a pretty error message for registration failures."""
-        status_code = response.status_code
-        error_text = response.text
-        status = "ERROR"
+        error_text = body
+        status = "ERROR" if status_code else "UNREACHABLE"
 
         try:
-            error_text = response.json()['error']['message']
-            status = response.json()['error']['status']
-        except ValueError:
+            error = json.loads(body)['error']
+            error_text = error['message']
+            status = error['status']
+        except (ValueError, KeyError, TypeError):
             pass
 
         return _ERROR_MESSAGE_TEMPLATE.format(
@@ -50,11 +63,11 @@ class RegistrationError(Exception):
                     device_model_id=device_model_id)
 
 
-def register_device(project_id: str,
-                    credentials: Credentials,
-                    device_model_id: str,
-                    device_id: str,
-                    device_api_url: str = _DEVICE_API_URL) -> None:
+async def register_device_async(project_id: str,
+                                credentials: 'Credentials',
+                                device_model_id: str,
+                                device_id: str,
+                                device_api_url: str = _DEVICE_API_URL) -> None:
     """Register a new assistant device instance.
 
     Args:
@@ -68,20 +81,75 @@ def register_device(project_id: str,
     """
     base_url = '/'.join([device_api_url, 'projects', project_id, 'devices'])
     device_url = '/'.join([base_url, device_id])
-    session = AuthorizedSession(credentials)
-    r = session.get(device_url)
+    headers = {'Authorization': 'Bearer ' + credentials.token}
+    session = _get_session()
+    async with session.get(device_url, headers=headers) as r:
+        status, body = r.status, await r.text()
     # Check if the device already is registered and if not then we try to
     # register. If any HTTP connection fails raise a RegistrationError.
-    if r.status_code == 404:
-        print('Registering...', end='')
-        r = session.post(base_url, data=json.dumps({
+    if status == 404:
+        _logger.info('Registering device %s', device_id)
+        async with session.post(base_url, headers=headers, data=json.dumps({
             'id': device_id,
             'model_id': device_model_id,
             'client_type': 'SDK_SERVICE',
             'nickname': 'Alexa Assistant'
-        }))
-        if r.status_code != 200:
-            raise RegistrationError(r, device_model_id)
-        print('Done.\n')
-    elif r.status_code != 200:
-        raise RegistrationError(r, device_model_id)
+        })) as r:
+            status, body = r.status, await r.text()
+        if status != 200:
+            raise RegistrationError(status, body, device_model_id)
+    elif status != 200:
+        raise RegistrationError(status, body, device_model_id)
+
+
+def _get_session() -> 'aiohttp.ClientSession':
+    """HTTP session of the registrations, so that they share their connections to the Device API."""
+    global _session
+    if _session is None or _session.closed:
+        # aiohttp is slow to import and only needed the first time a device is seen
+        import aiohttp
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=data.DEVICE_REGISTRATION_TIMEOUT))
+    return _session
+
+
+async def ensure_registered_async(project_id: str,
+                                  credentials: 'Credentials',
+                                  device_model_id: str,
+                                  device_id: str) -> None:
+    """Register `device_id` unless it is known to be registered. Concurrent requests for the same device share one
+    registration, and a failed registration is tried again by the next request."""
+    if _verified.get(device_id):
+        return
+    task = _pending.get(device_id)
+    if task is None:
+        task = asyncio.ensure_future(_register(project_id, credentials, device_model_id, device_id))
+        _pending[device_id] = task
+    # One request giving up must not cancel the registration for the others
+    await asyncio.shield(task)
+
+
+async def _register(project_id: str, credentials: 'Credentials', device_model_id: str,
+                    device_id: str) -> None:
+    import aiohttp
+
+    try:
+        with metrics_helpers.span('register_device'):
+            try:
+                await register_device_async(project_id, credentials, device_model_id, device_id)
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                # A registration that timed out has failed: it must not be taken for the request running out of time
+                raise RegistrationError(0, 'Device API unreachable: %r' % e, device_model_id) from e
+        _verified.set(device_id, True)
+        _logger.info('Device was registered successfully')
+    finally:
+        del _pending[device_id]
+
+
+def start_registration(project_id: str,
+                       credentials: 'Credentials',
+                       device_model_id: str,
+                       device_id: str) -> concurrent.futures.Future:
+    """Start `ensure_registered_async` on the shared loop, without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(
+        ensure_registered_async(project_id, credentials, device_model_id, device_id), async_helpers.get_loop())
+
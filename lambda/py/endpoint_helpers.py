@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Client-side selection among several Assistant endpoints, such as regional hosts or proxies.
+
+The endpoints are listed, comma-separated, in the `ASSISTANT_API_ENDPOINTS` environment variable, and default to
+`data.GOOGLE_ASSISTANT_API['api_endpoint']`. Each of them is scored on the moving averages of its time to first byte
+and of its error rate, and every Assist call goes to the healthy endpoint with the lowest score. Endpoints not
+measured yet are tried first.
+
+An endpoint answering UNAVAILABLE `data.ENDPOINT_BREAKER_FAILURES` times in a row has its circuit opened: it gets no
+calls while a background probe tries to connect to it. Once it can, a single call is let through, and its outcome
+closes the circuit or opens it again.
+
+The figures live in the container and are only read and updated on the shared event loop.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Iterable, Optional
+
+import grpc
+
+import channel_helpers
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_CLOSED = 'closed'
+_OPEN = 'open'
+_HALF_OPEN = 'half-open'
+
+# Errors telling about the endpoint, rather than about the request
+_ENDPOINT_ERRORS = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED, grpc.StatusCode.INTERNAL,
+                    grpc.StatusCode.UNKNOWN, grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+_endpoints = None
+
+
+def _ewma(average: Optional[float], sample: float) -> float:
+    return sample if average is None else average + data.ENDPOINT_EWMA_ALPHA * (sample - average)
+
+
+class Endpoint(object):
+    """Health of one endpoint, fed by the Assist calls made to it."""
+    __slots__ = ('host', 'ttfb', 'error_rate', 'failures', 'state', 'opened_at', 'trial', '_prober')
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        # Seconds to the first response, None until measured
+        self.ttfb = None
+        self.error_rate = 0.0
+        # UNAVAILABLE in a row
+        self.failures = 0
+        self.state = _CLOSED
+        self.opened_at = 0.0
+        # Whether the single call let through a half-open circuit is in flight
+        self.trial = False
+        self._prober = None
+
+    def score(self) -> float:
+        return self.ttfb * (1 + data.ENDPOINT_ERROR_PENALTY * self.error_rate)
+
+    def record_success(self, ttfb: float) -> None:
+        """The call got its first response after `ttfb` seconds."""
+        self.ttfb = _ewma(self.ttfb, ttfb)
+        self.error_rate = _ewma(self.error_rate, 0.0)
+        self.failures = 0
+        self.trial = False
+        if self.state != _CLOSED:
+            _logger.info('Endpoint %s recovered, closing its circuit', self.host)
+            self.state = _CLOSED
+            # The errors of the outage are over, they must not keep the endpoint from getting calls back
+            self.error_rate = 0.0
+
+    def record_abandoned(self, elapsed: float) -> None:
+        """The call was cancelled after `elapsed` seconds without a response: the endpoint is at least that slow."""
+        if self.ttfb is None or elapsed > self.ttfb:
+            self.ttfb = _ewma(self.ttfb, elapsed)
+        self.trial = False
+
+    def record_error(self, code: grpc.StatusCode) -> None:
+        self.trial = False
+        if code not in _ENDPOINT_ERRORS:
+            return
+        self.error_rate = _ewma(self.error_rate, 1.0)
+        if code != grpc.StatusCode.UNAVAILABLE:
+            return
+        self.failures += 1
+        # With a single endpoint there is nowhere else to go
+        if len(get_endpoints()) > 1 and (self.state == _HALF_OPEN or self.failures >= data.ENDPOINT_BREAKER_FAILURES):
+            self._open()
+
+    def _open(self) -> None:
+        _logger.warning('Endpoint %s is unavailable, opening its circuit', self.host)
+        self.state = _OPEN
+        self.opened_at = time.monotonic()
+        if self._prober is None:
+            self._prober = asyncio.ensure_future(self._probe())
+
+    async def _probe(self) -> None:
+        try:
+            while self.state == _OPEN:
+                await asyncio.sleep(data.ENDPOINT_PROBE_INTERVAL)
+                if await channel_helpers.probe(self.host, data.ENDPOINT_PROBE_TIMEOUT):
+                    _logger.info('Endpoint %s is reachable again, letting one call through', self.host)
+                    self.state = _HALF_OPEN
+        finally:
+            self._prober = None
+
+    def to_dict(self) -> dict:
+        return {
+            'host': self.host,
+            'state': self.state,
+            'ttfb_ms': round(self.ttfb * 1000, 1) if self.ttfb is not None else None,
+            'error_rate': round(self.error_rate, 3),
+        }
+
+    def __repr__(self) -> str:
+        return 'Endpoint(%s, %s)' % (self.host, self.state)
+
+
+def configure(hosts: Iterable[str]) -> None:
+    """Select among `hosts` from now on, forgetting what was measured of the previous endpoints."""
+    global _endpoints
+    _endpoints = [Endpoint(host) for host in hosts]
+    _logger.info('Assistant endpoints: %s', ', '.join(endpoint.host for endpoint in _endpoints))
+
+
+def get_endpoints() -> list:
+    if _endpoints is None:
+        hosts = os.environ.get('ASSISTANT_API_ENDPOINTS') or data.GOOGLE_ASSISTANT_API['api_endpoint']
+        configure(host.strip() for host in hosts.split(',') if host.strip())
+    return _endpoints
+
+
+def choose() -> Endpoint:
+    """Endpoint of the next Assist call; the caller must report its outcome with the `record_*` methods."""
+    endpoints = get_endpoints()
+    if len(endpoints) == 1:
+        return endpoints[0]
+
+    for endpoint in endpoints:
+        if endpoint.state == _HALF_OPEN and not endpoint.trial:
+            endpoint.trial = True
+            return endpoint
+
+    closed = [endpoint for endpoint in endpoints if endpoint.state == _CLOSED]
+    if not closed:
+        # The endpoint whose circuit opened first is the likeliest to have recovered
+        return min(endpoints, key=lambda endpoint: endpoint.opened_at)
+    for endpoint in closed:
+        if endpoint.ttfb is None:
+            return endpoint
+    if random.random() < data.ENDPOINT_EXPLORE_RATE:
+        return random.choice(closed)
+    return min(closed, key=Endpoint.score)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compile the translation catalogs: every `<locale>/LC_MESSAGES/messages.po` next to this script into the
+`messages.mo` read by `context_helpers.get_translations`.
+
+The compiled catalogs are committed, so that the Lambda package needs no build step: run this after editing a `.po`
+file. Only what the skill's catalogs use is supported: no plural forms, no contexts; fuzzy entries are skipped.
+
+    python lambda/py/locales/compile.py
+"""
+import ast
+import glob
+import os
+import struct
+
+LOCALES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_po(path: str) -> dict:
+    """Translations of a `.po` file, by message ID. The header is kept under the empty ID."""
+    messages = {}
+    msgid = msgstr = section = None
+    fuzzy = False
+
+    def add() -> None:
+        if msgid is not None and msgstr and not fuzzy:
+            messages[msgid] = msgstr
+
+    with open(path, encoding='utf-8') as fp:
+        for number, line in enumerate(fp, 1):
+            line = line.strip()
+            if line.startswith('#,') and 'fuzzy' in line:
+                add()
+                msgid = msgstr = section = None
+                fuzzy = True
+            elif not line or line.startswith('#'):
+                continue
+            elif line.startswith(('msgctxt', 'msgid_plural', 'msgstr[')):
+                raise ValueError('%s:%d: plural forms and contexts are not supported' % (path, number))
+            elif line.startswith('msgid '):
+                if section == 'msgstr':
+                    add()
+                    fuzzy = False
+                msgid, msgstr, section = ast.literal_eval(line[6:]), '', 'msgid'
+            elif line.startswith('msgstr '):
+                msgstr, section = ast.literal_eval(line[7:]), 'msgstr'
+            elif line.startswith('"') and section == 'msgid':
+                msgid += ast.literal_eval(line)
+            elif line.startswith('"') and section == 'msgstr':
+                msgstr += ast.literal_eval(line)
+            else:
+                raise ValueError('%s:%d: cannot parse %r' % (path, number, line))
+    add()
+    return messages
+
+
+def to_mo(messages: dict) -> bytes:
+    """GNU `.mo` catalog of `messages`, with no hash table."""
+    ids = sorted(messages)
+    keys = [msgid.encode('utf-8') for msgid in ids]
+    values = [messages[msgid].encode('utf-8') for msgid in ids]
+
+    header_size = 7 * 4
+    keys_start = header_size + 2 * 8 * len(ids)
+    values_start = keys_start + sum(len(key) + 1 for key in keys)
+
+    offsets = []
+    position = keys_start
+    for key in keys:
+        offsets += [len(key), position]
+        position += len(key) + 1
+    for value in values:
+        offsets += [len(value), position]
+        position += len(value) + 1
+    assert position - values_start == sum(len(value) + 1 for value in values)
+
+    header = struct.pack('<7I', 0x950412de, 0, len(ids), header_size, header_size + 8 * len(ids), 0, 0)
+    tables = struct.pack('<%dI' % len(offsets), *offsets)
+    return header + tables + b''.join(key + b'\0' for key in keys) + b''.join(value + b'\0' for value in values)
+
+
+def catalogs() -> list:
+    return sorted(glob.glob(os.path.join(LOCALES_DIR, '*', 'LC_MESSAGES', '*.po')))
+
+
+def main() -> None:
+    for po in catalogs():
+        mo = po[:-len('.po')] + '.mo'
+        with open(mo, 'wb') as fp:
+            fp.write(to_mo(parse_po(po)))
+        print('%s -> %s' % (os.path.relpath(po, LOCALES_DIR), os.path.relpath(mo, LOCALES_DIR)))
+
+
+if __name__ == '__main__':
+    main()
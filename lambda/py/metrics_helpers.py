@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-invocation latency metrics, emitted as one CloudWatch Embedded Metric Format record.
+
+Metrics are collected only when the `METRICS_ENABLED` environment variable is set to `true`; otherwise every call
+below returns a shared no-op object.
+
+    with metrics_helpers.invocation():
+        with metrics_helpers.span('preflight'):
+            ...
+
+Work running on other threads must be handed the object returned by `current()` explicitly.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import data
+
+_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() == 'true'
+
+_current = contextvars.ContextVar('metrics', default=None)
+
+_cold_start = True
+
+
+class _Span(object):
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics: 'Metrics', name: str) -> None:
+        self._metrics = metrics
+        self._name = name
+        self._start = None
+
+    def __enter__(self) -> '_Span':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._metrics.add(self._name, (time.perf_counter() - self._start) * 1000, 'Milliseconds')
+
+
+class Metrics(object):
+    """Metrics of a single invocation. Values recorded more than once under the same name are summed."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self._values = {}
+        self._units = {}
+        self._properties = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def add(self, name: str, value: float, unit: str = 'Count') -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+            self._units[name] = unit
+
+    def set(self, name: str, value: float, unit: str = 'Count') -> None:
+        with self._lock:
+            self._values[name] = value
+            self._units[name] = unit
+
+    def set_elapsed(self, name: str, since: float) -> None:
+        """Record the milliseconds elapsed since the `time.perf_counter()` value `since`."""
+        self.set(name, (time.perf_counter() - since) * 1000, 'Milliseconds')
+
+    def set_property(self, name: str, value: object) -> None:
+        """Attach a value to the record without making it a metric."""
+        self._properties[name] = value
+
+    def to_emf(self) -> dict:
+        with self._lock:
+            values = dict(self._values)
+            units = dict(self._units)
+        values['total'] = (time.perf_counter() - self.start) * 1000
+        units['total'] = 'Milliseconds'
+
+        record = dict(self._properties)
+        record['FunctionName'] = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', data.SKILL_NAME)
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': data.METRICS_NAMESPACE,
+                'Dimensions': [['FunctionName']],
+                'Metrics': [{'Name': name, 'Unit': units[name]} for name in sorted(values)],
+            }],
+        }
+        record.update(values)
+        return record
+
+    def emit(self) -> None:
+        # Lambda ships stdout to CloudWatch Logs, where EMF records are turned into metrics
+        print(json.dumps(self.to_emf(), separators=(',', ':')), flush=True)
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+class _NullMetrics(object):
+    __slots__ = ()
+    start = 0.0
+
+    def span(self, name: str) -> _NullSpan:
+        return _NULL_SPAN
+
+    def add(self, name: str, value: float, unit: str = 'Count') -> None:
+        pass
+
+    def set(self, name: str, value: float, unit: str = 'Count') -> None:
+        pass
+
+    def set_elapsed(self, name: str, since: float) -> None:
+        pass
+
+    def set_property(self, name: str, value: object) -> None:
+        pass
+
+    def emit(self) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+NULL_METRICS = _NullMetrics()
+
+
+def current() -> Metrics:
+    """Metrics of the invocation being served, or a no-op stand-in."""
+    return _current.get() or NULL_METRICS
+
+
+def span(name: str) -> _Span:
+    return current().span(name)
+
+
+@contextmanager
+def invocation():
+    """Collect the metrics of one invocation and emit them when it ends, even if it fails."""
+    global _cold_start
+    if not _ENABLED:
+        yield NULL_METRICS
+        return
+
+    metrics = Metrics()
+    metrics.set('cold_start', 1 if _cold_start else 0)
+    _cold_start = False
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+        metrics.emit()
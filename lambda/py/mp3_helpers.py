@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Validation of MP3 streams against the constraints of Alexa's SSML `<audio>` tag.
+
+Only frame headers are parsed, so that a stream can be checked chunk by chunk as it is received.
+"""
+import logging
+
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+MPEG_1 = 3
+MPEG_2 = 2
+MPEG_2_5 = 0
+
+_LAYER_III = 1
+
+# Layer III bit rates in kbps, by bit rate index
+_BIT_RATES = {
+    MPEG_1: (None, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, None),
+    MPEG_2: (None, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, None),
+}
+_BIT_RATES[MPEG_2_5] = _BIT_RATES[MPEG_2]
+
+_SAMPLE_RATES = {
+    MPEG_1: (44100, 48000, 32000, None),
+    MPEG_2: (22050, 24000, 16000, None),
+    MPEG_2_5: (11025, 12000, 8000, None),
+}
+
+_ID3_HEADER_SIZE = 10
+_FRAME_HEADER_SIZE = 4
+
+
+class Mp3FormatError(Exception):
+    pass
+
+
+class Mp3FrameHeader(object):
+    __slots__ = ('version', 'bit_rate', 'sample_rate', 'padding', 'length')
+
+    def __init__(self, version: int, bit_rate: int, sample_rate: int, padding: int) -> None:
+        self.version = version
+        self.bit_rate = bit_rate
+        self.sample_rate = sample_rate
+        self.padding = padding
+        samples_per_frame = 1152 if version == MPEG_1 else 576
+        self.length = samples_per_frame // 8 * bit_rate * 1000 // sample_rate + padding
+
+    @property
+    def format(self) -> tuple:
+        return self.version, self.bit_rate, self.sample_rate
+
+    def __repr__(self) -> str:
+        return 'Mp3FrameHeader(version=%d, bit_rate=%d, sample_rate=%d)' % self.format
+
+
+def parse_frame_header(header: bytes) -> Mp3FrameHeader:
+    if len(header) < _FRAME_HEADER_SIZE or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        raise Mp3FormatError('Frame sync not found')
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    if version not in _SAMPLE_RATES or layer != _LAYER_III:
+        raise Mp3FormatError('Not an MPEG Layer III frame')
+    bit_rate = _BIT_RATES[version][header[2] >> 4]
+    sample_rate = _SAMPLE_RATES[version][(header[2] >> 2) & 0x03]
+    if bit_rate is None or sample_rate is None:
+        raise Mp3FormatError('Invalid bit rate or sample rate')
+    return Mp3FrameHeader(version, bit_rate, sample_rate, (header[2] >> 1) & 0x01)
+
+
+def _is_compliant_format(version: int, bit_rate: int, sample_rate: int) -> bool:
+    return version == MPEG_2 and bit_rate in data.ALEXA_MP3_BIT_RATES and sample_rate in data.ALEXA_MP3_SAMPLE_RATES
+
+
+def is_alexa_compliant(header: Mp3FrameHeader) -> bool:
+    return _is_compliant_format(*header.format)
+
+
+def strip_info_frame(mp3: bytes) -> bytes:
+    """Drop the Xing/Info tag LAME may write as the first frame, which describes a whole file and carries no audio.
+
+    Streams are joined without their tags, as these would tell players the length of one part only.
+    """
+    try:
+        header = parse_frame_header(mp3[:_FRAME_HEADER_SIZE])
+    except Mp3FormatError:
+        return mp3
+    # The tag follows the side information, which takes at most 32 bytes
+    tag_area = mp3[_FRAME_HEADER_SIZE:_FRAME_HEADER_SIZE + 40]
+    if b'Xing' in tag_area or b'Info' in tag_area:
+        return mp3[header.length:]
+    return mp3
+
+
+class Mp3StreamValidator(object):
+    """Walks the frames of an MP3 stream fed in arbitrary chunks, keeping at most one partial frame."""
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._skip = 0
+        self._started = False
+        self.first_header = None
+        self.frames = 0
+        # Distinct (version, bit rate, sample rate) of the frames seen, in order of appearance
+        self.formats = []
+
+    def feed(self, chunk: bytes) -> None:
+        self._buf += chunk
+        if not self._started:
+            # An ID3v2 tag may precede the first frame; its size is a 28 bit syncsafe integer
+            if len(self._buf) < _ID3_HEADER_SIZE:
+                return
+            if self._buf[:3] == b'ID3':
+                size = self._buf[6:10]
+                self._skip = ((size[0] << 21) | (size[1] << 14) | (size[2] << 7) | size[3]) + _ID3_HEADER_SIZE
+            self._started = True
+
+        offset = 0
+        while True:
+            if self._skip:
+                skipped = min(self._skip, len(self._buf) - offset)
+                offset += skipped
+                self._skip -= skipped
+                if self._skip:
+                    break
+            if len(self._buf) - offset < _FRAME_HEADER_SIZE:
+                break
+            header = parse_frame_header(self._buf[offset:offset + _FRAME_HEADER_SIZE])
+            if not self.frames:
+                self.first_header = header
+            if header.format not in self.formats:
+                self.formats.append(header.format)
+            self.frames += 1
+            self._skip = header.length
+        del self._buf[:offset]
+
+    def close(self) -> None:
+        if not self.frames:
+            raise Mp3FormatError('No MP3 frame found')
+        if self._skip:
+            _logger.debug('Last MP3 frame is truncated by %d bytes', self._skip)
+
+    def is_alexa_compliant(self) -> bool:
+        """Whether all the frames seen so far meet Alexa's constraints."""
+        return bool(self.frames) and all(_is_compliant_format(*f) for f in self.formats)
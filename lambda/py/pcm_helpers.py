@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming post-processing of the Assistant's 16-bit PCM, before it is encoded.
+
+Leading and trailing silence is trimmed down to a short padding, and quiet responses are amplified so that their
+peaks reach `data.AUDIO_TARGET_PEAK`: the gain is never below 1, responses are never made quieter. Chunks are
+processed as they arrive and at most a few hundred milliseconds of audio are held back, whatever the length of the
+response.
+"""
+import logging
+from typing import Optional
+
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_FULL_SCALE = 32767
+
+
+def _ms_to_samples(ms: int, sample_rate: int) -> int:
+    return sample_rate * ms // 1000
+
+
+class PcmProcessor(object):
+    """Same streaming interface as `audio_helpers.Mp3Encoder`: `process` every chunk, then `flush` once."""
+
+    def __init__(self, sample_rate: int, sample_width: int) -> None:
+        if sample_width != 2:
+            raise ValueError('Only 16-bit PCM is supported')
+        import numpy
+        self._np = numpy
+
+        self._threshold = int(_FULL_SCALE * 10 ** (data.AUDIO_SILENCE_THRESHOLD / 20))
+        self._padding = _ms_to_samples(data.AUDIO_SILENCE_PADDING_MS, sample_rate)
+        self._max_pause = _ms_to_samples(data.AUDIO_MAX_PAUSE_MS, sample_rate)
+        self._gain_window = _ms_to_samples(data.AUDIO_GAIN_WINDOW_MS, sample_rate)
+        self._target_peak = _FULL_SCALE * 10 ** (data.AUDIO_TARGET_PEAK / 20)
+
+        self._empty = numpy.empty(0, dtype='<i2')
+        # Silence before the first sound, only its tail is kept as padding
+        self._lead = self._empty
+        self._started = False
+        # Silence after the last sound: a pause if more sound follows, the trailing silence otherwise. Samples beyond
+        # `_max_pause` are only counted, and come back as digital silence.
+        self._pause = []
+        self._pause_len = 0
+        self._pause_overflow = 0
+        # Sound held back until the gain can be chosen
+        self._window = []
+        self._window_len = 0
+        self._gain = None
+
+    def process(self, pcm: bytes) -> bytes:
+        np = self._np
+        samples = np.frombuffer(pcm, dtype='<i2')
+        loud = np.flatnonzero((samples > self._threshold) | (samples < -self._threshold))
+
+        parts = []
+        if not self._started:
+            if loud.size == 0:
+                self._lead = self._tail(self._lead, samples, self._padding)
+                return b''
+            self._started = True
+            parts.append(self._tail(self._lead, samples[:loud[0]], self._padding))
+            self._lead = None
+            samples = samples[loud[0]:]
+            loud -= loud[0]
+
+        if loud.size == 0:
+            self._hold_pause(samples)
+            return b''
+
+        parts.extend(self._release_pause())
+        last = loud[-1] + 1
+        parts.append(samples[:last])
+        self._hold_pause(samples[last:])
+        return self._amplify(parts, final=False)
+
+    def flush(self) -> bytes:
+        if not self._started:
+            return b''
+        # Trailing silence: only the padding survives
+        trailing = []
+        remaining = self._padding
+        for part in self._pause:
+            trailing.append(part[:remaining])
+            remaining -= len(trailing[-1])
+        self._pause, self._pause_len, self._pause_overflow = [], 0, 0
+        return self._amplify(trailing, final=True)
+
+    def _tail(self, head: 'numpy.ndarray', samples: 'numpy.ndarray', size: int) -> 'numpy.ndarray':
+        if len(samples) >= size:
+            return samples[len(samples) - size:].copy()
+        return self._np.concatenate((head, samples))[-size:]
+
+    def _hold_pause(self, samples: 'numpy.ndarray') -> None:
+        room = max(0, self._max_pause - self._pause_len)
+        if room:
+            # Copied, so that the caller's chunk can be released
+            kept = samples[:room].copy()
+            self._pause.append(kept)
+            self._pause_len += len(kept)
+        self._pause_overflow += max(0, len(samples) - room)
+
+    def _release_pause(self) -> list:
+        parts = self._pause
+        if self._pause_overflow:
+            parts.append(self._np.zeros(self._pause_overflow, dtype='<i2'))
+        self._pause, self._pause_len, self._pause_overflow = [], 0, 0
+        return parts
+
+    @staticmethod
+    def _peak(samples: 'numpy.ndarray') -> int:
+        return max(int(samples.max()), -int(samples.min())) if len(samples) else 0
+
+    def _amplify(self, parts: list, final: bool) -> bytes:
+        np = self._np
+        if self._gain is None:
+            self._window.extend(parts)
+            self._window_len += sum(len(part) for part in parts)
+            if self._window_len < self._gain_window and not final:
+                return b''
+            # The gain is chosen on the first sound, so that quiet responses are not boosted chunk by chunk
+            block = np.concatenate(self._window) if self._window else self._empty
+            self._window, self._window_len = [], 0
+            peak = self._peak(block)
+            self._gain = max(1.0, min(data.AUDIO_MAX_GAIN, self._target_peak / peak)) if peak else 1.0
+            _logger.debug('Normalizing with a gain of %.2f', self._gain)
+            parts = [block]
+
+        out = []
+        for part in parts:
+            peak = self._peak(part)
+            # Later peaks may only lower the gain, down to 1 at most: amplified audio never clips
+            if self._gain > 1.0 and peak * self._gain > self._target_peak:
+                self._gain = max(1.0, self._target_peak / peak)
+            if self._gain == 1.0:
+                out.append(part.tobytes())
+            else:
+                scaled = np.multiply(part, self._gain, dtype=np.float32)
+                out.append(np.rint(scaled, out=scaled).astype('<i2').tobytes())
+        return b''.join(out)
+
+
+def find_cuts(pcm: bytes, segments: int, sample_rate: int = data.DEFAULT_AUDIO_SAMPLE_RATE) -> list:
+    """Sample offsets splitting 16-bit `pcm` into `segments` parts of about the same length.
+
+    Each cut is made in the middle of the quietest block within `data.MP3_SEGMENT_SEARCH_MS` of its ideal offset, so
+    that it falls in a pause of speech whenever there is one. Raises ImportError when NumPy is not installed.
+    """
+    import numpy
+
+    samples = numpy.frombuffer(pcm, dtype='<i2')
+    block = _ms_to_samples(data.MP3_SEGMENT_BLOCK_MS, sample_rate)
+    search = _ms_to_samples(data.MP3_SEGMENT_SEARCH_MS, sample_rate)
+
+    cuts = []
+    for i in range(1, segments):
+        ideal = len(samples) * i // segments
+        low = max(ideal - search, cuts[-1] + block if cuts else 0)
+        blocks = (min(ideal + search, len(samples)) - low) // block
+        if blocks <= 0:
+            cuts.append(ideal)
+            continue
+        window = samples[low:low + blocks * block].reshape(blocks, block).astype(numpy.float32)
+        energy = numpy.einsum('ij,ij->i', window, window)
+        cuts.append(low + int(numpy.argmin(energy)) * block + block // 2)
+    return cuts
+
+
+def new_pcm_processor(sample_rate: int = data.DEFAULT_AUDIO_SAMPLE_RATE,
+                      sample_width: int = data.DEFAULT_AUDIO_SAMPLE_WIDTH) -> Optional[PcmProcessor]:
+    """Return a post-processor, or None when NumPy is not installed and the audio is to be left untouched."""
+    try:
+        return PcmProcessor(sample_rate, sample_width)
+    except ImportError:
+        _logger.warning('NumPy is not available, response audio is not post-processed')
+        return None
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import copy
+import logging
+import threading
+from typing import Callable, Dict
+
+from ask_sdk_core.attributes_manager import AbstractPersistenceAdapter
+from ask_sdk_model import RequestEnvelope
+
+import cache_helpers
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+
+def user_id_partition_keygen(request_envelope: RequestEnvelope) -> str:
+    """Same partition key as the one used by the ASK DynamoDB adapter, without importing it (and boto3)."""
+    return request_envelope.context.system.user.user_id
+
+
+class CachingPersistenceAdapter(AbstractPersistenceAdapter):
+    """Write-through, per-container cache in front of another persistence adapter.
+
+    Attributes are served from memory until they expire or are evicted. Saves are forwarded to the wrapped adapter
+    only when the attributes differ from the ones it last returned or stored. The wrapped adapter is built by
+    `adapter_factory` the first time it is needed, so containers that never miss the cache never create it.
+    """
+
+    def __init__(self,
+                 adapter_factory: Callable[[], AbstractPersistenceAdapter],
+                 partition_keygen: Callable = user_id_partition_keygen,
+                 maxsize: int = data.PERSISTENCE_CACHE_SIZE,
+                 ttl: float = data.PERSISTENCE_CACHE_TTL) -> None:
+        self._adapter_factory = adapter_factory
+        self._adapter = None
+        self._partition_keygen = partition_keygen
+        self._cache = cache_helpers.LRUCache(maxsize=maxsize, ttl=ttl)
+        self._adapter_lock = threading.Lock()
+
+    def get_attributes(self, request_envelope: RequestEnvelope) -> Dict[str, object]:
+        key = self._partition_keygen(request_envelope)
+        attributes = self._cache.get(key)
+        if attributes is None:
+            attributes = self.adapter.get_attributes(request_envelope=request_envelope)
+            self._cache.set(key, copy.deepcopy(attributes))
+        else:
+            attributes = copy.deepcopy(attributes)
+        _logger.debug('Persistence cache stats: %s', self._cache.stats())
+        return attributes
+
+    def save_attributes(self, request_envelope: RequestEnvelope, attributes: Dict[str, object]) -> None:
+        key = self._partition_keygen(request_envelope)
+        if self._cache.peek(key) == attributes:
+            _logger.debug('Persistent attributes did not change, skipping save')
+            return
+        self.adapter.save_attributes(request_envelope=request_envelope, attributes=attributes)
+        self._cache.set(key, copy.deepcopy(attributes))
+
+    def delete_attributes(self, request_envelope: RequestEnvelope) -> None:
+        self.adapter.delete_attributes(request_envelope=request_envelope)
+        self._cache.discard(self._partition_keygen(request_envelope))
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    @property
+    def adapter(self) -> AbstractPersistenceAdapter:
+        if self._adapter is None:
+            with self._adapter_lock:
+                if self._adapter is None:
+                    self._adapter = self._adapter_factory()
+        return self._adapter
+
+
+def create_table_if_not_exists(dynamodb_resource, table_name: str, partition_key_name: str = 'id') -> None:
+    """Create the attributes table with the same schema the ASK DynamoDB adapter uses, unless it already exists."""
+    client = dynamodb_resource.meta.client
+    try:
+        client.describe_table(TableName=table_name)
+        return
+    except client.exceptions.ResourceNotFoundException:
+        pass
+
+    _logger.info('Creating DynamoDB table %s', table_name)
+    try:
+        client.create_table(
+            TableName=table_name,
+            KeySchema=[{'AttributeName': partition_key_name, 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': partition_key_name, 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5})
+    except client.exceptions.ResourceInUseException:
+        pass
+    client.get_waiter('table_exists').wait(TableName=table_name)
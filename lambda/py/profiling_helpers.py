@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Opt-in profiling of a sample of invocations, with cProfile and tracemalloc.
+
+The `PROFILE_SAMPLE_RATE` environment variable is the fraction of invocations profiled, 0 (the default) turns
+profiling off and leaves a single comparison per invocation. The summary of a profiled invocation (the functions
+taking the most time, the lines holding the most memory, and peak memory, in all and during the Assist call and the
+encoding of its audio) is logged as one JSON record, or written to the directory named by `PROFILE_OUTPUT` along
+with the raw cProfile statistics.
+
+Up to Python 3.11 cProfile only sees the thread it is enabled on, so every thread an invocation runs on gets its own
+profiler: the handler's, the event loop's, and the executor's for each `async_helpers.run_blocking` call. From 3.12
+cProfile runs on `sys.monitoring`, which allows a single profiler in the process and shows it every thread: one is
+enabled for the whole invocation. Either way the event loop is shared, so with concurrent invocations the profile also
+includes work of the other ones; one invocation at a time is profiled. When a profiler cannot be enabled, as when
+another profiling tool is active, only memory is sampled. Before Python 3.9 the peak of traced memory cannot be reset:
+each phase then reports the highest peak since the invocation started.
+
+    with profiling_helpers.session(request_id):
+        with profiling_helpers.phase('assist'):
+            ...
+"""
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional
+
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+_OUTPUT = os.environ.get('PROFILE_OUTPUT', 'log')
+
+_current = contextvars.ContextVar('profile', default=None)
+
+# A single profiler, seeing every thread, may be enabled in the process
+_PROCESS_WIDE = sys.version_info >= (3, 12)
+
+_IDLE_BUILTINS = ("'acquire'", "'poll'", "'select'", "'control'", "'sleep'")
+
+# Held by the invocation being profiled
+_lock = threading.Lock()
+
+
+def _site(filename: str, lineno: int, name: str = None) -> str:
+    # The last two path components are enough to tell the skill's modules from the libraries'
+    filename = '/'.join(filename.split(os.sep)[-2:])
+    return '%s:%d(%s)' % (filename, lineno, name) if name else '%s:%d' % (filename, lineno)
+
+
+def _is_idle(filename: str, lineno: int, name: str) -> bool:
+    return filename == '~' and any(wait in name for wait in _IDLE_BUILTINS)
+
+
+def _reset_traced_peak() -> None:
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+
+def _enable() -> Optional[cProfile.Profile]:
+    """A profiler enabled on the calling thread, or on the whole process from Python 3.12; None if none can be."""
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except Exception as e:
+        _logger.warning('Could not enable the profiler, sampling memory only: %s', e)
+        return None
+    return profile
+
+
+class _Session(object):
+    """Profilers and memory peaks of one invocation."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._profiles = []
+        self._profiles_lock = threading.Lock()
+        self._peaks = {}
+        self._peak = 0
+        self._started_tracing = False
+        # Up to Python 3.11 the event loop's own profiler, from 3.12 the process-wide one
+        self._shared_profile = None
+        self._start = None
+        # Streamed answers carry on in the background after the invocation, and its profile, ended
+        self.active = False
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(data.PROFILE_TRACEMALLOC_FRAMES)
+            self._started_tracing = True
+        _reset_traced_peak()
+
+        if _PROCESS_WIDE:
+            self._shared_profile = _enable()
+        else:
+            self._on_loop(self._enable_loop)
+        self.active = True
+
+    def _enable_loop(self) -> None:
+        self._shared_profile = _enable()
+
+    def _disable_shared(self) -> None:
+        if self._shared_profile is not None:
+            self._shared_profile.disable()
+            self.add(self._shared_profile)
+            self._shared_profile = None
+
+    def stop(self) -> dict:
+        self.active = False
+        if _PROCESS_WIDE:
+            self._disable_shared()
+        else:
+            self._on_loop(self._disable_shared)
+
+        snapshot = tracemalloc.take_snapshot()
+        self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+        if self._started_tracing:
+            tracemalloc.stop()
+        return self._summarize(snapshot)
+
+    @staticmethod
+    def _on_loop(fn) -> None:
+        """Call `fn` on the event loop's thread, and wait for it."""
+        import async_helpers
+
+        loop = async_helpers.get_loop()
+        done = threading.Event()
+
+        def call() -> None:
+            try:
+                fn()
+            finally:
+                done.set()
+
+        loop.call_soon_threadsafe(call)
+        done.wait(data.PROFILE_LOOP_TIMEOUT)
+
+    def add(self, profile: cProfile.Profile) -> None:
+        with self._profiles_lock:
+            self._profiles.append(profile)
+
+    def enable_thread(self) -> Optional[cProfile.Profile]:
+        """A profiler for the calling thread, None when the process-wide one already sees it or none can be enabled.
+        It is handed back with `disable_thread`."""
+        return None if _PROCESS_WIDE else _enable()
+
+    def disable_thread(self, profile: Optional[cProfile.Profile]) -> None:
+        if profile is not None:
+            profile.disable()
+            self.add(profile)
+
+    def run(self, fn, *args, **kwargs):
+        profile = self.enable_thread()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.disable_thread(profile)
+
+    def record_phase(self, name: str, peak: int) -> None:
+        self._peaks[name] = max(self._peaks.get(name, 0), peak)
+
+    def reset_peak(self) -> None:
+        """Start measuring a phase, without losing the peak of the invocation."""
+        self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+        _reset_traced_peak()
+
+    def stats(self) -> pstats.Stats:
+        with self._profiles_lock:
+            profiles = list(self._profiles)
+        return pstats.Stats(*profiles)
+
+    def _summarize(self, snapshot: tracemalloc.Snapshot) -> dict:
+        stats = self.stats()
+        # Threads waiting for work or for each other are not where the time goes
+        functions = sorted((item for item in stats.stats.items() if not _is_idle(*item[0])),
+                           key=lambda item: item[1][2], reverse=True)
+        allocations = snapshot.statistics('lineno')
+        return {
+            'profile': self.name,
+            'wall_ms': round((time.perf_counter() - self._start) * 1000, 1),
+            'peak_kib': self._peak // 1024,
+            'phase_peak_kib': {name: peak // 1024 for name, peak in self._peaks.items()},
+            # Kilobytes on Linux
+            'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'functions': [{
+                'site': _site(*key),
+                'calls': calls,
+                'own_ms': round(own * 1000, 2),
+                'cumulative_ms': round(cumulative * 1000, 2),
+            } for key, (_, calls, own, cumulative, _) in functions[:data.PROFILE_TOP_FUNCTIONS]],
+            'allocations': [{
+                'site': _site(stat.traceback[0].filename, stat.traceback[0].lineno),
+                'kib': stat.size // 1024,
+                'count': stat.count,
+            } for stat in allocations[:data.PROFILE_TOP_ALLOCATIONS]],
+        }
+
+    def write(self, summary: dict) -> None:
+        if _OUTPUT == 'log':
+            _logger.info(json.dumps(summary, separators=(',', ':')))
+            return
+
+        os.makedirs(_OUTPUT, exist_ok=True)
+        path = os.path.join(_OUTPUT, self.name)
+        with open(path + '.json', 'w') as fp:
+            json.dump(summary, fp, indent=1)
+        self.stats().dump_stats(path + '.prof')
+        _logger.info('Profile written to %s.json', path)
+
+        # /tmp is small and outlives invocations: only the latest profiles are kept
+        names = sorted(os.listdir(_OUTPUT), key=lambda n: os.path.getmtime(os.path.join(_OUTPUT, n)))
+        for old in names[:max(0, len(names) - 2 * data.PROFILE_MAX_FILES)]:
+            os.remove(os.path.join(_OUTPUT, old))
+
+
+@contextmanager
+def session(name: str = 'invocation'):
+    """Profile the invocation run inside, if it is part of the sample. Profiling never fails the invocation."""
+    if _SAMPLE_RATE <= 0 or random.random() >= _SAMPLE_RATE or not _lock.acquire(blocking=False):
+        yield
+        return
+
+    try:
+        profile = _Session('%d-%s' % (time.time() * 1000, name))
+        try:
+            profile.start()
+        except Exception as e:
+            _logger.warning('Could not start profiling: %s', e)
+            yield
+            return
+
+        token = _current.set(profile)
+        caller = profile.enable_thread()
+        try:
+            yield
+        finally:
+            profile.disable_thread(caller)
+            _current.reset(token)
+            try:
+                profile.write(profile.stop())
+            except Exception as e:
+                _logger.warning('Could not write profile: %s', e)
+    finally:
+        _lock.release()
+
+
+@contextmanager
+def phase(name: str):
+    """Record the peak of traced memory while the code inside runs, when the invocation is profiled."""
+    profile = _current.get()
+    if profile is None or not profile.active:
+        yield
+        return
+    profile.reset_peak()
+    try:
+        yield
+    finally:
+        if profile.active:
+            profile.record_phase(name, tracemalloc.get_traced_memory()[1])
+
+
+def wrap(fn):
+    """`fn`, profiled on whichever thread it runs, when the invocation is profiled."""
+    profile = _current.get()
+    if profile is None or not profile.active:
+        return fn
+    return functools.partial(profile.run, fn)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content-addressed cache of Assistant responses for repeatable queries.
+
+Responses to allow-listed requests are uploaded under a key derived from the query instead of the device, so that
+later identical queries can reuse the object without calling the Assistant again. The cache is disabled unless the
+`RESPONSE_CACHE_ENABLED` environment variable is set to `true`.
+"""
+import hashlib
+import logging
+import os
+import re
+from typing import Optional
+
+from ask_sdk_core.handler_input import HandlerInput
+
+import cache_helpers
+import context_helpers
+import data
+import response_mode_helpers
+import storage_helpers
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]', re.UNICODE)
+
+
+class CachedResponse(object):
+    """What is needed to answer again. Entries are shared by all the users of the container, so nothing of the
+    user who got the response first, such as the Assistant's conversation state, is kept."""
+    __slots__ = ('key', 'ttl', 'text_response', 'mic_open', 'spoken')
+
+    def __init__(self, key: str, ttl: float, text_response: str, mic_open: bool, spoken: bool = False) -> None:
+        self.key = key
+        self.ttl = ttl
+        self.text_response = text_response
+        self.mic_open = mic_open
+        # Read by Alexa from `text_response`, there is no object behind the key
+        self.spoken = spoken
+
+
+def is_enabled() -> bool:
+    return os.environ.get('RESPONSE_CACHE_ENABLED', '').lower() == 'true'
+
+
+def normalize_query(text_query: str) -> str:
+    return ' '.join(_PUNCTUATION_RE.sub('', text_query.lower()).split())
+
+
+def get_ttl(handler_input: HandlerInput, text_query: str) -> Optional[float]:
+    """Return how long the response to this request may be cached, or None if it must not be."""
+    if not is_enabled():
+        return None
+
+    request = handler_input.request_envelope.request
+    intent = getattr(request, 'intent', None)
+    name = intent.name if intent is not None else request.object_type
+    if name not in data.RESPONSE_CACHE_INTENTS:
+        return None
+
+    ttl = data.RESPONSE_CACHE_QUERY_TTL.get(normalize_query(text_query), data.RESPONSE_CACHE_INTENTS[name])
+    return ttl or None
+
+
+def get_key(handler_input: HandlerInput, text_query: str, response_mode: str = response_mode_helpers.AUDIO) -> str:
+    context = context_helpers.get_context(handler_input)
+    has_state = context.conversation_state is not None
+    parts = [normalize_query(text_query), context.locale, '1' if has_state else '0']
+    # Keys of audio responses are the same as before response modes existed
+    if response_mode != response_mode_helpers.AUDIO:
+        parts.append(response_mode)
+    material = '\0'.join(parts)
+    digest = hashlib.sha256(material.encode('utf-8')).hexdigest()
+    return data.RESPONSE_CACHE_PREFIX + digest + '.mp3'
+
+
+class ResponseCache(object):
+    """Per-container index of cached responses, backed by objects in the audio storage.
+
+    Expired or evicted entries also remove their object, unless another container uploaded it again since.
+    """
+
+    def __init__(self, maxsize: int = data.RESPONSE_CACHE_SIZE) -> None:
+        self._index = cache_helpers.LRUCache(maxsize=maxsize, on_evict=self._delete_object)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        self._index.expire()
+        response = self._index.get(key)
+        _logger.debug('Response cache stats: %s', self._index.stats())
+        return response
+
+    def put(self, response: CachedResponse) -> None:
+        self._index.set(response.key, response, ttl=response.ttl)
+
+    def _delete_object(self, key: str, response: CachedResponse) -> None:
+        if response.spoken:
+            return
+        try:
+            storage_helpers.get_storage().delete_stale(key, response.ttl)
+        except Exception as e:
+            _logger.warning('Could not evict cached response %s: %s', key, e)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""How the Assistant's answer is given to the user.
+
+    audio    the Assistant's own audio, encoded and stored (default)
+    text     Alexa reads the Assistant's display text with its own voice; nothing is encoded or stored
+    hybrid   Alexa reads short answers, the Assistant's audio plays the others
+
+The mode is chosen with the `RESPONSE_MODE` environment variable, and can be overridden per user with the
+`response_mode` persistent attribute. Whatever the mode, an answer is played as audio when its text is missing,
+looks truncated, or is much shorter than the audio, as when it only introduces the news or a song.
+"""
+import logging
+import os
+import re
+from typing import Optional
+from xml.sax.saxutils import escape
+
+from ask_sdk_core.handler_input import HandlerInput
+
+import data
+import skill_helpers
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+AUDIO = 'audio'
+TEXT = 'text'
+HYBRID = 'hybrid'
+
+_MODES = (AUDIO, TEXT, HYBRID)
+_PERSISTENT_ATTRIBUTE = 'response_mode'
+_TRUNCATION_MARKS = ('...', '…')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def get_response_mode(handler_input: HandlerInput) -> str:
+    """Mode of the user, or of the deployment. Reads the persistent attributes, so it may block."""
+    mode = skill_helpers.get_persistent_attribute(handler_input, _PERSISTENT_ATTRIBUTE)
+    if mode is None:
+        mode = os.environ.get('RESPONSE_MODE', AUDIO)
+    mode = str(mode).lower()
+    if mode not in _MODES:
+        _logger.warning('Unknown response mode "%s", using audio', mode)
+        return AUDIO
+    return mode
+
+
+def is_speakable(text: Optional[str], mode: str, audio_seconds: Optional[float]) -> bool:
+    """Whether `text` can be read by Alexa in place of `audio_seconds` of the Assistant's audio.
+
+    `audio_seconds` is None when the length of the audio is not known.
+    """
+    if mode == AUDIO or not text or not text.strip():
+        return False
+    text = text.strip()
+    if text.endswith(_TRUNCATION_MARKS):
+        _logger.info('Display text looks truncated, playing audio')
+        return False
+    limit = data.TEXT_RESPONSE_HYBRID_MAX_CHARS if mode == HYBRID else data.TEXT_RESPONSE_MAX_CHARS
+    if len(text) > limit:
+        _logger.info('Display text is too long for %s mode, playing audio', mode)
+        return False
+    if audio_seconds is not None:
+        expected = len(text) / data.TEXT_RESPONSE_CHARS_PER_SECOND
+        if audio_seconds > expected * data.TEXT_RESPONSE_MAX_AUDIO_RATIO + data.TEXT_RESPONSE_AUDIO_SLACK:
+            _logger.info('Audio is much longer than the display text (%.1f s), playing audio', audio_seconds)
+            return False
+    return True
+
+
+def to_ssml(text: str) -> str:
+    """Body of the `<speak>` element reading `text`, on one line."""
+    return escape(_WHITESPACE_RE.sub(' ', text).strip())
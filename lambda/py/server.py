@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Self-hosted HTTPS endpoint for the skill, as an alternative to AWS Lambda.
+
+The listening socket is shared by `--workers` forked processes, each serving requests from a pool of `--threads`
+threads, so a single box can use all of its cores. TLS is expected to be terminated by a reverse proxy in front of
+this server, as Alexa only talks to HTTPS endpoints.
+
+    python server.py --port 8080 --workers 4 --threads 16
+
+With `AUDIO_STORAGE=local`, the response audio is also served from here, under `/audio/`. It only lives in the
+memory of the process that produced it, so a single worker is allowed then. Adding `AUDIO_PLAYBACK=stream` has
+devices with the AudioPlayer interface play answers through it while they are still being received; the skill
+manifest must then declare the `AUDIO_PLAYER` interface.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Iterator
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+
+class SkillRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Seconds a connection may stay idle, so that kept-alive or stalled clients do not hold a pool thread forever
+    timeout = 30
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path == '/health':
+            self._send(200, b'ok', 'text/plain')
+        elif url.path.startswith('/audio/') and self.server.audio_origin is not None:
+            query = parse_qs(url.query)
+            mp3 = self.server.audio_origin.serve(unquote(url.path[len('/audio/'):]), query.get('expires', [None])[0],
+                                                 query.get('signature', [None])[0])
+            if mp3 is None:
+                self._send(404, b'', 'text/plain')
+            elif isinstance(mp3, bytes):
+                self._send(200, mp3, 'audio/mpeg', cache_control='private, max-age=%d' % data.AUDIO_URL_TTL)
+            else:
+                self._send_chunked(mp3, 'audio/mpeg')
+        else:
+            self._send(404, b'', 'text/plain')
+
+    def do_POST(self) -> None:
+        from ask_sdk_webservice_support.verifier import VerificationException
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        try:
+            response = self.server.dispatch(dict(self.headers.items()), body)
+        except VerificationException as e:
+            _logger.warning('Request verification failed: %s', e)
+            self._send(400, b'', 'text/plain')
+            return
+        except Exception as e:
+            _logger.error(e, exc_info=True)
+            self._send(500, b'', 'text/plain')
+            return
+        self._send(200, json.dumps(response).encode('utf-8'), 'application/json')
+
+    def _send(self, status: int, body: bytes, content_type: str, cache_control: str = 'no-store') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunked(self, chunks: Iterator[bytes], content_type: str) -> None:
+        """Send a body still being produced; a failure midway can only be signalled by dropping the connection."""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        except (IOError, TimeoutError) as e:
+            _logger.warning('Audio stream interrupted: %s', e)
+            self.close_connection = True
+
+    def log_message(self, format: str, *args) -> None:
+        _logger.debug('%s - %s', self.address_string(), format % args)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTP server handing each connection to a bounded pool of threads.
+
+    At most `queued` connections wait for a thread. Any more are answered 503 and closed as soon as they are
+    accepted, so that a burst is shed instead of piling up requests Alexa will have stopped waiting for.
+    """
+
+    _OVERLOADED = (b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\n'
+                   b'Connection: close\r\n\r\n')
+
+    def __init__(self, server_address: tuple, threads: int, verify: bool = True, bind_and_activate: bool = True,
+                 sock: socket.socket = None, queued: int = data.SERVER_QUEUED_REQUESTS) -> None:
+        if sock is not None:
+            # Share a socket bound by the parent process
+            super(PooledHTTPServer, self).__init__(server_address, SkillRequestHandler, bind_and_activate=False)
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        else:
+            super(PooledHTTPServer, self).__init__(server_address, SkillRequestHandler, bind_and_activate)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='skill')
+        self._slots = threading.BoundedSemaphore(threads + queued)
+
+        # The skill is only imported here, after forking: gRPC does not survive a fork once initialized
+        import app
+        from ask_sdk_webservice_support.webservice_handler import WebserviceSkillHandler
+        self._handler = WebserviceSkillHandler(app.create_skill(), verify_signature=verify, verify_timestamp=verify)
+
+        import storage_helpers
+        storage = storage_helpers.get_storage() if _is_local_audio_storage() else None
+        self.audio_origin = storage if isinstance(storage, storage_helpers.LocalAudioOrigin) else None
+
+    def dispatch(self, headers: dict, body: str) -> dict:
+        import metrics_helpers
+        import profiling_helpers
+        with metrics_helpers.invocation(), profiling_helpers.session():
+            return self._handler.verify_request_and_dispatch(headers, body)
+
+    def process_request(self, request: socket.socket, client_address: tuple) -> None:
+        if not self._slots.acquire(blocking=False):
+            self._reject(request, client_address)
+            return
+        try:
+            self._executor.submit(self._process_request_thread, request, client_address)
+        except RuntimeError:
+            # Shutting down
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _reject(self, request: socket.socket, client_address: tuple) -> None:
+        _logger.warning('All threads and queue slots are busy, rejecting %s', client_address[0])
+        try:
+            # This runs in the accepting thread: never wait on the client
+            request.setblocking(False)
+            request.send(self._OVERLOADED)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def _process_request_thread(self, request: socket.socket, client_address: tuple) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self) -> None:
+        super(PooledHTTPServer, self).server_close()
+        self._executor.shutdown(wait=True)
+
+
+def _is_local_audio_storage() -> bool:
+    return os.environ.get('AUDIO_STORAGE', '').lower() == 'local'
+
+
+def serve(host: str, port: int, workers: int, threads: int, verify: bool = True,
+          queued: int = data.SERVER_QUEUED_REQUESTS) -> None:
+    if workers > 1 and _is_local_audio_storage():
+        raise ValueError('Local audio storage is per-process, it needs a single worker')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(socketserver.TCPServer.request_queue_size * workers)
+    _logger.info('Listening on %s:%d with %d worker(s) of %d thread(s)', host, port, workers, threads)
+
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = []
+            break
+        children.append(pid)
+
+    server = PooledHTTPServer((host, port), threads, verify=verify, sock=sock, queued=queued)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, help='number of processes, default: one per core, or one with local '
+                                                    'audio storage')
+    parser.add_argument('--threads', type=int, default=16, help='request threads per process')
+    parser.add_argument('--queued', type=int, default=data.SERVER_QUEUED_REQUESTS,
+                        help='connections per process waiting for a thread, beyond which requests are answered 503')
+    parser.add_argument('--no-verify', dest='verify', action='store_false',
+                        help='skip Alexa signature and timestamp checks, for local testing only')
+    args = parser.parse_args()
+
+    workers = args.workers or (1 if _is_local_audio_storage() else os.cpu_count() or 1)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    serve(args.host, args.port, workers, args.threads, args.verify, args.queued)
+
+
+if __name__ == '__main__':
+    main()
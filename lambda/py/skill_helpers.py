@@ -12,38 +12,33 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import hashlib
 import logging
+from typing import Callable
 
 from ask_sdk_core.handler_input import HandlerInput
 
-from google.oauth2.credentials import Credentials
+import context_helpers
 
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
 
-def get_credentials(handler_input: HandlerInput) -> Credentials:
-    access_token = handler_input.request_envelope.context.system.user.access_token
+def get_credentials(handler_input: HandlerInput) -> 'Credentials':
+    return context_helpers.get_context(handler_input).credentials
 
-    # TODO: a more meaningful exception should be thrown, so that we can return a LinkAccount card to the user
-    if not access_token:
-        _logger.info('User must link his Google Account')
-        raise Exception
 
-        # handler_input.response_builder.set_card(LinkAccountCard()).speak(WARNING_LINK_ACCOUNT)
-        # return handler_input.response_builder.response
+def get_device_id(handler_input: HandlerInput) -> str:
+    return context_helpers.get_context(handler_input).device_id
 
-    # Return credentials
-    return Credentials(access_token)
 
+def get_audio_key(handler_input: HandlerInput) -> str:
+    """Storage key of the response audio, unique per Echo device."""
+    return context_helpers.get_context(handler_input).audio_key
 
-def get_device_id(handler_input: HandlerInput) -> str:
-    user_id = handler_input.request_envelope.context.system.user.user_id
-    h = hashlib.new('ripemd160')
-    h.update(user_id.encode('utf-8'))
-    return h.hexdigest()
+
+def get_translator(handler_input: HandlerInput) -> Callable[[str], str]:
+    return context_helpers.get_context(handler_input).gettext
 
 
 def get_persistent_attribute(handler_input: HandlerInput, key: str, default: object=None) -> object:
@@ -55,8 +50,11 @@ def set_persistent_attribute(handler_input: HandlerInput, key: str, value: objec
     _logger.debug('Writing into persistent attribute "%s"...', key)
 
     attr = handler_input.attributes_manager.persistent_attributes
-    attr[key] = value
-    handler_input.attributes_manager.persistent_attributes = attr
+    if key in attr and attr[key] == value:
+        _logger.debug('Persistent attribute "%s" did not change', key)
+    else:
+        attr[key] = value
+        handler_input.attributes_manager.persistent_attributes = attr
 
     if save:
         _logger.info('Saving persistent attributes...')
@@ -72,3 +70,18 @@ def set_session_attribute(handler_input: HandlerInput, key: str, value: object)
     attr = handler_input.attributes_manager.session_attributes
     attr[key] = value
     handler_input.attributes_manager.session_attributes = attr
+
+
+def supports_audio_player(handler_input: HandlerInput) -> bool:
+    device = handler_input.request_envelope.context.system.device
+    return device.supported_interfaces is not None and device.supported_interfaces.audio_player is not None
+
+
+def send_progressive_response(handler_input: HandlerInput, speech: str) -> None:
+    """Have Alexa speak while the response is still being prepared. Blocks on an HTTP call."""
+    from ask_sdk_model.services.directive import Header, SendDirectiveRequest, SpeakDirective
+
+    request_id = handler_input.request_envelope.request.request_id
+    directive_service = handler_input.service_client_factory.get_directive_service()
+    directive_service.enqueue(SendDirectiveRequest(header=Header(request_id=request_id),
+                                                   directive=SpeakDirective(speech=speech)))
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Storage of the response audio, and the URLs Alexa fetches it from.
+
+The backend is chosen with the `AUDIO_STORAGE` environment variable:
+
+    s3      (default) objects in the `S3_BUCKET` bucket, fetched through presigned URLs
+    local   an in-memory origin served by `server.py` itself under `/audio/`, for self-hosted deployments. URLs are
+            built on `AUDIO_ORIGIN_URL` and signed with `AUDIO_ORIGIN_SECRET`. Audio still being written is served
+            as it comes, which streamed playback relies on.
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional, Union
+from urllib.parse import quote
+
+import aws_helpers
+import cache_helpers
+import data
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+
+class AudioWriter(ABC):
+    """Receives the MP3 of one response as it is encoded: `write` every chunk, then `close` or `abort` once."""
+
+    size = 0
+
+    def start(self) -> None:
+        """Called once this writer is known to produce the audio to keep, before the first `write`."""
+        pass
+
+    @abstractmethod
+    def write(self, chunk: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+    @abstractmethod
+    def abort(self) -> None:
+        pass
+
+
+class S3AudioWriter(AudioWriter):
+    """Incremental upload of an audio object to S3.
+
+    Data is buffered until a full part is available, at which point a multipart upload is started and parts are sent
+    as soon as they fill up. Objects smaller than a part are sent with a single `put_object` on `close`.
+    """
+
+    def __init__(self,
+                 s3,
+                 bucket: str,
+                 key: str,
+                 content_type: str = 'audio/mpeg',
+                 part_size: int = data.S3_MULTIPART_PART_SIZE) -> None:
+        self._s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self._content_type = content_type
+        self._part_size = part_size
+        self._buf = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self._buf += chunk
+        self.size += len(chunk)
+        while len(self._buf) >= self._part_size:
+            if self._upload_id is None:
+                _logger.info('Starting multipart upload of %s', self.key)
+                upload = self._s3.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                          ContentType=self._content_type)
+                self._upload_id = upload['UploadId']
+            self._upload_part(bytes(self._buf[:self._part_size]))
+            del self._buf[:self._part_size]
+
+    def close(self) -> None:
+        if self._upload_id is None:
+            self._s3.put_object(Body=bytes(self._buf), Bucket=self.bucket, Key=self.key,
+                                ContentType=self._content_type)
+        else:
+            if self._buf:
+                self._upload_part(bytes(self._buf))
+            self._s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                               MultipartUpload={'Parts': self._parts})
+            _logger.info('Completed multipart upload of %s in %d parts', self.key, len(self._parts))
+        self._buf = bytearray()
+
+    def abort(self) -> None:
+        self._buf = bytearray()
+        if self._upload_id is not None:
+            _logger.info('Aborting multipart upload of %s', self.key)
+            self._s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+
+    def _upload_part(self, body: bytes) -> None:
+        part_number = len(self._parts) + 1
+        part = self._s3.upload_part(Body=body, Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                    PartNumber=part_number)
+        self._parts.append({'ETag': part['ETag'], 'PartNumber': part_number})
+
+
+class AudioStorage(ABC):
+    @abstractmethod
+    def open_writer(self, key: str, ttl: float = None) -> AudioWriter:
+        """Start storing `key`, which must be kept for at least `ttl` seconds when given."""
+        pass
+
+    @abstractmethod
+    def get_url(self, key: str) -> str:
+        """Short-lived URL Alexa can fetch `key` from."""
+        pass
+
+    @abstractmethod
+    def has(self, key: str) -> bool:
+        """Check that `key` can still be served. May block."""
+        pass
+
+    @abstractmethod
+    def delete_stale(self, key: str, max_age: float) -> None:
+        """Delete `key` unless it was stored again within the last `max_age` seconds."""
+        pass
+
+
+class S3AudioStorage(AudioStorage):
+    def __init__(self, bucket: str) -> None:
+        self.bucket = bucket
+        self._s3 = aws_helpers.get_client('s3')
+
+    def open_writer(self, key: str, ttl: float = None) -> AudioWriter:
+        return S3AudioWriter(self._s3, self.bucket, key)
+
+    def get_url(self, key: str) -> str:
+        # Signing is local computation, it does not block on I/O
+        return self._s3.generate_presigned_url(ClientMethod='get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                               ExpiresIn=data.AUDIO_URL_TTL)
+
+    def has(self, key: str) -> bool:
+        # The response cache index is per container: another one may have deleted an object this one still lists
+        from botocore.exceptions import ClientError
+        try:
+            self._s3.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def delete_stale(self, key: str, max_age: float) -> None:
+        head = self._s3.head_object(Bucket=self.bucket, Key=key)
+        age = datetime.datetime.now(datetime.timezone.utc) - head['LastModified']
+        if age.total_seconds() < max_age:
+            return
+        _logger.info('Deleting stale object %s', key)
+        self._s3.delete_object(Bucket=self.bucket, Key=key)
+
+
+class _StoredAudio(object):
+    __slots__ = ('mp3', 'stored_at')
+
+    def __init__(self, mp3: bytes) -> None:
+        self.mp3 = mp3
+        self.stored_at = time.time()
+
+
+class MemoryAudioWriter(AudioWriter):
+    """Keeps the audio in the origin, where it can be followed by readers while it is still being written."""
+
+    def __init__(self, origin: 'LocalAudioOrigin', key: str, ttl: float = None) -> None:
+        self._origin = origin
+        self._key = key
+        self._ttl = ttl
+        self._chunks = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._aborted = False
+        self.stored_at = time.time()
+        self.size = 0
+
+    def start(self) -> None:
+        # Replaces the previous audio under the key right away, so that a reader never gets it instead of this one
+        self._origin.put(self._key, self, self._ttl)
+
+    def write(self, chunk: bytes) -> None:
+        with self._cond:
+            self._chunks.append(chunk)
+            self.size += len(chunk)
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._origin.put(self._key, _StoredAudio(b''.join(self._chunks)), self._ttl)
+
+    def abort(self) -> None:
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+        self._origin.discard(self._key, self)
+
+    def follow(self, timeout: float = data.AUDIO_STREAM_READ_TIMEOUT) -> Iterator[bytes]:
+        """Yield the audio written so far, then every chunk as it is written, until the writer is closed."""
+        i = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: len(self._chunks) > i or self._closed or self._aborted, timeout):
+                    raise TimeoutError('No audio for %d seconds' % timeout)
+                if self._aborted:
+                    raise IOError('Audio stream aborted')
+                chunks = self._chunks[i:]
+                closed = self._closed
+            i += len(chunks)
+            yield from chunks
+            if closed and i == len(self._chunks):
+                return
+
+
+class LocalAudioOrigin(AudioStorage):
+    """Serves the response audio from a bounded in-memory LRU, behind URLs carrying an expiring HMAC signature.
+
+    Audio lives in the memory of one process, so the server must run a single worker process.
+    """
+
+    PATH_PREFIX = '/audio/'
+
+    def __init__(self,
+                 base_url: str,
+                 secret: bytes,
+                 maxsize: int = data.AUDIO_ORIGIN_CACHE_SIZE,
+                 ttl: float = data.AUDIO_ORIGIN_TTL) -> None:
+        self._base_url = base_url.rstrip('/')
+        self._secret = secret
+        self._audio = cache_helpers.LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def open_writer(self, key: str, ttl: float = None) -> AudioWriter:
+        return MemoryAudioWriter(self, key, ttl)
+
+    def put(self, key: str, audio: Union[_StoredAudio, MemoryAudioWriter], ttl: float = None) -> None:
+        self._audio.set(key, audio, ttl=ttl)
+
+    def discard(self, key: str, audio: Union[_StoredAudio, MemoryAudioWriter]) -> None:
+        """Remove `key` if it still holds `audio`."""
+        if self._audio.peek(key) is audio:
+            self._audio.discard(key)
+
+    def get(self, key: str) -> Optional[Union[_StoredAudio, MemoryAudioWriter]]:
+        self._audio.expire()
+        return self._audio.get(key)
+
+    def get_url(self, key: str) -> str:
+        expires = int(time.time()) + data.AUDIO_URL_TTL
+        return '%s%s%s?expires=%d&signature=%s' % (self._base_url, self.PATH_PREFIX, quote(key), expires,
+                                                   self._sign(key, expires))
+
+    def has(self, key: str) -> bool:
+        return self._audio.peek(key) is not None
+
+    def delete_stale(self, key: str, max_age: float) -> None:
+        stored = self._audio.peek(key)
+        if stored is not None and time.time() - stored.stored_at >= max_age:
+            self._audio.discard(key)
+
+    def _sign(self, key: str, expires: int) -> str:
+        mac = hmac.new(self._secret, ('%s\n%d' % (key, expires)).encode('utf-8'), hashlib.sha256)
+        return base64.urlsafe_b64encode(mac.digest()).rstrip(b'=').decode('ascii')
+
+    def serve(self, key: str, expires: str, signature: str) -> Union[None, bytes, Iterator[bytes]]:
+        """The audio for a request to a URL from `get_url`: the MP3 if complete, its chunks as they are written if
+        not, or None if the URL is not signed, expired or the audio is gone."""
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return None
+        if expires < time.time() or not hmac.compare_digest(self._sign(key, expires), signature or ''):
+            return None
+        audio = self.get(key)
+        if isinstance(audio, MemoryAudioWriter):
+            return audio.follow()
+        return audio.mp3 if audio is not None else None
+
+
+_storage = None
+_lock = threading.Lock()
+
+
+def get_storage() -> AudioStorage:
+    """Per-process storage backend, created on first use."""
+    global _storage
+    if _storage is None:
+        with _lock:
+            if _storage is None:
+                backend = os.environ.get('AUDIO_STORAGE', 's3').lower()
+                if backend == 'local':
+                    secret = os.environ.get('AUDIO_ORIGIN_SECRET')
+                    _storage = LocalAudioOrigin(os.environ['AUDIO_ORIGIN_URL'],
+                                                secret.encode('utf-8') if secret else secrets.token_bytes(32))
+                else:
+                    _storage = S3AudioStorage(os.environ['S3_BUCKET'])
+                _logger.info('Storing audio with %s', type(_storage).__name__)
+    return _storage
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The tests run against the benchmarks' local fakes: importing their harness puts the Lambda sources on `sys.path`
+and sets the environment the skill expects."""
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')))
+
+import harness  # noqa: E402
+
+
+def make_event(name: str = 'launch', user: str = 'USER', session_attributes: dict = None) -> dict:
+    """One of the benchmarks' envelopes, as sent by the given user."""
+    event = copy.deepcopy(harness.load_envelope(name))
+    user_id = 'amzn1.ask.account.' + user
+    event['session']['user']['userId'] = event['context']['System']['user']['userId'] = user_id
+    event['session']['sessionId'] = 'amzn1.echo-api.session.' + user
+    event['session']['attributes'] = dict(session_attributes or {})
+    return event
+
+
+@pytest.fixture
+def backends():
+    fake = harness.FakeBackends()
+    yield fake
+    fake.close()
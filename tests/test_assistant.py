@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import fakes
+import harness
+from conftest import make_event
+
+import assistant
+import data
+
+
+def test_timeout_ends_the_session(monkeypatch):
+    monkeypatch.setattr(data, 'ALEXA_RESPONSE_TIMEOUT', data.DEADLINE_SAFETY_MARGIN + 0.3)
+    backends = harness.FakeBackends(faults=fakes.FaultProfile(latency=2))
+    try:
+        handler_input = harness.make_handler_input(make_event('search'))
+        response = assistant.assist(handler_input, 'Hello')
+    finally:
+        backends.close()
+
+    assert 'taking too long' in response.output_speech.ssml
+    assert response.should_end_session is True
+    assert 'conversation_state' not in handler_input.attributes_manager.session_attributes
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import math
+import struct
+
+import pytest
+
+import audio_helpers
+import data
+import mp3_helpers
+
+pytest.importorskip('lameenc')
+
+SAMPLE_RATE = data.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = data.DEFAULT_AUDIO_SAMPLE_WIDTH
+_MONO = 3
+
+
+def _tone(seconds: float, silences: tuple = ()) -> bytes:
+    """A 440 Hz tone, silent within the given (start, end) seconds."""
+    samples = []
+    for i in range(int(seconds * SAMPLE_RATE)):
+        t = i / SAMPLE_RATE
+        silent = any(start <= t < end for start, end in silences)
+        samples.append(0 if silent else int(8000 * math.sin(2 * math.pi * 440 * t)))
+    return struct.pack('<%dh' % len(samples), *samples)
+
+
+def _frames(mp3: bytes) -> list:
+    """Headers of all the frames of a stream, with their channel mode."""
+    headers = []
+    offset = 0
+    while offset < len(mp3):
+        header = mp3_helpers.parse_frame_header(mp3[offset:offset + 4])
+        headers.append((header, mp3[offset + 3] >> 6))
+        offset += header.length
+    assert offset == len(mp3)
+    return headers
+
+
+def _encode(encoder: audio_helpers.Mp3Encoder, pcm: bytes, chunk: int = 3200) -> bytes:
+    mp3 = b''.join(encoder.encode(pcm[i:i + chunk]) for i in range(0, len(pcm), chunk))
+    return mp3 + encoder.flush()
+
+
+def test_lame_encoder_is_mono_and_compliant():
+    pcm = _tone(2)
+    mp3 = _encode(audio_helpers.LameEncoder(SAMPLE_RATE, SAMPLE_WIDTH), pcm)
+
+    frames = _frames(mp3)
+    assert all(mp3_helpers.is_alexa_compliant(header) for header, _ in frames)
+    assert all(mode == _MONO for _, mode in frames)
+    # 576 samples per MPEG-2 frame, plus the encoder delay and padding
+    assert len(pcm) // SAMPLE_WIDTH <= len(frames) * 576 <= len(pcm) // SAMPLE_WIDTH + 4 * 576
+
+    validator = mp3_helpers.Mp3StreamValidator()
+    for i in range(0, len(mp3), 7):
+        validator.feed(mp3[i:i + 7])
+    validator.close()
+    assert validator.frames == len(frames)
+    assert validator.is_alexa_compliant()
+
+
+def test_strip_info_frame():
+    mp3 = _encode(audio_helpers.LameEncoder(SAMPLE_RATE, SAMPLE_WIDTH), _tone(1))
+    stripped = mp3_helpers.strip_info_frame(mp3)
+    assert len(_frames(stripped)) in (len(_frames(mp3)), len(_frames(mp3)) - 1)
+    assert mp3_helpers.strip_info_frame(stripped) == stripped
+
+
+def test_segmented_encoding(monkeypatch):
+    monkeypatch.setattr(audio_helpers, 'get_encoding_workers', lambda: 4)
+    monkeypatch.setattr(data, 'MP3_SEGMENT_MIN_SECONDS', 1)
+    pcm = _tone(4.5, silences=((1.4, 1.6), (2.6, 2.8), (3.7, 3.9)))
+
+    encoder = audio_helpers.SegmentedEncoder(audio_helpers.LameEncoder, SAMPLE_RATE, SAMPLE_WIDTH)
+    assert len(encoder._split(pcm)) == 4
+    mp3 = _encode(encoder, pcm)
+
+    frames = _frames(mp3)
+    assert all(mp3_helpers.is_alexa_compliant(header) and mode == _MONO for header, mode in frames)
+    whole = _frames(_encode(audio_helpers.LameEncoder(SAMPLE_RATE, SAMPLE_WIDTH), pcm))
+    # Every segment adds at most its encoder delay and padding
+    assert len(whole) <= len(frames) <= len(whole) + 3 * 4
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+
+import cache_helpers
+
+
+def _cache(evicted: list, **kwargs) -> cache_helpers.LRUCache:
+    return cache_helpers.LRUCache(on_evict=lambda key, value: evicted.append((key, value)), **kwargs)
+
+
+def test_capacity_and_expiry():
+    evicted = []
+    cache = _cache(evicted, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert evicted == [('b', 2)]
+    cache.set('d', 4, ttl=-1)
+    assert 'd' not in cache
+    cache.expire()
+    assert evicted == [('b', 2), ('a', 1), ('d', 4)]
+    assert cache.stats()['size'] == 1
+
+
+def test_setdefault_keeps_the_first_value():
+    evicted = []
+    cache = _cache(evicted, maxsize=2)
+    assert cache.setdefault('a', 1) == 1
+    assert cache.setdefault('a', 2) == 1
+    assert cache.get('a') == 1
+    assert evicted == []
+
+
+def test_setdefault_replaces_expired_values():
+    evicted = []
+    cache = _cache(evicted, maxsize=2)
+    cache.set('a', 1, ttl=-1)
+    assert cache.setdefault('a', 2) == 2
+    assert evicted == [('a', 1)]
+
+
+def test_concurrent_setdefault():
+    evicted = []
+    cache = _cache(evicted, maxsize=2)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def create(value: int) -> None:
+        barrier.wait()
+        results.append(cache.setdefault('key', value))
+
+    threads = [threading.Thread(target=create, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every caller holds the cached value, so the other ones can all be released
+    assert len(set(results)) == 1
+    assert results[0] == cache.peek('key')
+    assert evicted == []
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import harness
+from conftest import make_event
+
+import context_helpers
+import conversation_helpers
+import skill_helpers
+
+
+def test_context_is_built_once():
+    handler_input = harness.make_handler_input(make_event(user='A'))
+    context = context_helpers.get_context(handler_input)
+    assert context_helpers.get_context(handler_input) is context
+    assert context.user_id == 'amzn1.ask.account.A'
+    assert context.device_id == context_helpers.hash_user_id('amzn1.ask.account.A')
+    assert context.session_id == 'amzn1.echo-api.session.A'
+
+
+def test_session_state():
+    state = conversation_helpers.encode_state(b'state')
+    handler_input = harness.make_handler_input(make_event(session_attributes={'conversation_state': state}))
+    context = context_helpers.get_context(handler_input)
+    assert context.session_attributes is handler_input.attributes_manager.session_attributes
+    assert context.conversation_state == state
+
+    conversation_helpers.set_conversation_state(handler_input, b'next')
+    assert conversation_helpers.decode_state(context.conversation_state) == b'next'
+    skill_helpers.set_session_attribute(handler_input, 'other', 1)
+    assert context.session_attributes['other'] == 1
+
+
+def test_no_session():
+    event = make_event()
+    del event['session']
+    context = context_helpers.get_context(harness.make_handler_input(event))
+    assert context.session_id is None
+    assert context.session_attributes is None
+    assert context.conversation_state is None
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+
+import pytest
+from ask_sdk_core.attributes_manager import AttributesManager
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_model import RequestEnvelope
+
+from conftest import make_event
+
+import app
+import conversation_helpers
+import data
+import persistence_helpers
+
+STATE = os.urandom(64) * 4
+
+
+def test_encode_roundtrip():
+    for state in (b'', b'x', STATE, bytes(range(256))):
+        assert conversation_helpers.decode_state(conversation_helpers.encode_state(state)) == state
+
+
+def test_encode_compresses_when_smaller():
+    assert conversation_helpers.encode_state(b'a' * 1000).startswith('1z.')
+    assert conversation_helpers.encode_state(os.urandom(32)).startswith('1.')
+
+
+def test_decode_legacy_and_invalid():
+    assert conversation_helpers.decode_state([1, 2, 3]) == b'\x01\x02\x03'
+    assert conversation_helpers.decode_state(None) is None
+    assert conversation_helpers.decode_state('1z.not zlib') is None
+    assert conversation_helpers.decode_state('2.AAAA') is None
+
+
+class _Container(object):
+    """The persistent attributes cache of one container."""
+
+    def __init__(self) -> None:
+        self.adapter = persistence_helpers.CachingPersistenceAdapter(app._create_persistence_adapter)
+
+    def handler_input(self, session_attributes: dict) -> HandlerInput:
+        event = make_event('search', session_attributes=session_attributes)
+        envelope = DefaultSerializer().deserialize(payload=json.dumps(event), obj_type=RequestEnvelope)
+        return HandlerInput(request_envelope=envelope,
+                            attributes_manager=AttributesManager(request_envelope=envelope,
+                                                                 persistence_adapter=self.adapter))
+
+
+@pytest.fixture
+def server_side(monkeypatch, backends):
+    monkeypatch.setenv('CONVERSATION_STATE_SERVER_SIDE', 'true')
+    monkeypatch.setattr(data, 'CONVERSATION_STATE_INLINE_LIMIT', 0)
+
+
+def _turn(container: _Container, session_attributes: dict, state: bytes) -> tuple:
+    handler_input = container.handler_input(session_attributes)
+    previous = conversation_helpers.get_conversation_state(handler_input)
+    conversation_helpers.set_conversation_state(handler_input, state)
+    return previous, handler_input.attributes_manager.session_attributes
+
+
+def test_server_side_across_containers(server_side):
+    first, second = _Container(), _Container()
+    # Both containers have the user's attributes cached
+    first.handler_input({}).attributes_manager.persistent_attributes
+    second.handler_input({}).attributes_manager.persistent_attributes
+
+    _, attributes = _turn(first, {}, b'turn 1' * 500)
+    assert attributes['conversation_state'] == '1s'
+    previous, attributes = _turn(second, attributes, b'turn 2' * 500)
+    assert previous == b'turn 1' * 500
+    previous, attributes = _turn(first, attributes, b'turn 3' * 500)
+    assert previous == b'turn 2' * 500
+
+
+def test_server_side_discarded(server_side):
+    container = _Container()
+    _, attributes = _turn(container, {}, STATE)
+    conversation_helpers.discard_conversation_state(container.handler_input(attributes))
+    assert conversation_helpers.get_conversation_state(container.handler_input(attributes)) is None
+
+
+def test_server_side_expired(server_side, monkeypatch):
+    container = _Container()
+    monkeypatch.setattr(data, 'CONVERSATION_STATE_SERVER_SIDE_TTL', -1)
+    _, attributes = _turn(container, {}, STATE)
+    assert conversation_helpers.get_conversation_state(container.handler_input(attributes)) is None
+
+
+def test_inline_below_limit(monkeypatch, backends):
+    monkeypatch.setenv('CONVERSATION_STATE_SERVER_SIDE', 'true')
+    calls = backends.dynamodb.calls
+    previous, attributes = _turn(_Container(), {}, b'short')
+    assert previous is None
+    assert attributes['conversation_state'] != '1s'
+    assert backends.dynamodb.calls == calls
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+
+import aiohttp
+import pytest
+
+import harness
+from conftest import make_event
+
+import app
+import data
+import device_helpers
+
+
+def _failing(error: Exception):
+    async def register_device_async(*args, **kwargs) -> None:
+        raise error
+
+    return register_device_async
+
+
+def _speech(response) -> str:
+    return response.output_speech.ssml
+
+
+@pytest.mark.parametrize('error', [asyncio.TimeoutError(), aiohttp.ClientConnectionError('refused')])
+def test_unreachable_device_api_is_a_registration_error(monkeypatch, error):
+    monkeypatch.setattr(device_helpers, 'register_device_async', _failing(error))
+    registration = device_helpers.start_registration('project', None, 'model', 'unreachable')
+
+    with pytest.raises(device_helpers.RegistrationError, match='UNREACHABLE'):
+        registration.result(5)
+    assert not device_helpers._verified.get('unreachable')
+    assert 'unreachable' not in device_helpers._pending
+
+
+def test_preflight_reports_a_timed_out_registration(monkeypatch, backends):
+    monkeypatch.setattr(device_helpers, 'register_device_async', _failing(asyncio.TimeoutError()))
+    handler_input = harness.make_handler_input(make_event(user='TIMEOUT'))
+
+    def handler(handler_input):
+        return handler_input.response_builder.speak('answer').response
+
+    # Not taken for a registration still running, which would keep the answer
+    response = app.preflight_check(handler)(handler_input)
+    assert data.ERROR_REGISTRATION[:40] in _speech(response)
+
+
+def test_preflight_does_not_catch_the_handler_timeouts(monkeypatch, backends):
+    def handler(handler_input):
+        raise TimeoutError('from the handler')
+
+    with pytest.raises(TimeoutError, match='from the handler'):
+        app.preflight_check(handler)(harness.make_handler_input(make_event(user='HANDLER')))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+
+import grpc
+import pytest
+
+import data
+import endpoint_helpers
+
+UNAVAILABLE = grpc.StatusCode.UNAVAILABLE
+
+
+@pytest.fixture
+def endpoints(monkeypatch):
+    """Two endpoints, chosen without exploration, whose probes succeed once `reachable` is set."""
+    monkeypatch.setattr(data, 'ENDPOINT_EXPLORE_RATE', 0)
+    monkeypatch.setattr(data, 'ENDPOINT_PROBE_INTERVAL', 0)
+    monkeypatch.setattr(endpoint_helpers, '_endpoints', None)
+    reachable = asyncio.Event()
+
+    async def probe(host: str, timeout: float) -> bool:
+        return reachable.is_set()
+
+    monkeypatch.setattr(endpoint_helpers.channel_helpers, 'probe', probe)
+    endpoint_helpers.configure(['a:443', 'b:443'])
+    return endpoint_helpers.get_endpoints(), reachable
+
+
+def test_ewma():
+    assert endpoint_helpers._ewma(None, 1.0) == 1.0
+    assert endpoint_helpers._ewma(1.0, 2.0) == pytest.approx(1.0 + data.ENDPOINT_EWMA_ALPHA)
+
+
+def test_configured_from_environment(monkeypatch):
+    monkeypatch.setattr(endpoint_helpers, '_endpoints', None)
+    monkeypatch.setenv('ASSISTANT_API_ENDPOINTS', ' a:443, ,b:443 ')
+    assert [endpoint.host for endpoint in endpoint_helpers.get_endpoints()] == ['a:443', 'b:443']
+
+
+def test_unmeasured_first_then_lowest_score(endpoints):
+    (a, b), _ = endpoints
+    assert endpoint_helpers.choose() is a
+    a.record_success(0.1)
+    assert endpoint_helpers.choose() is b
+    b.record_success(0.3)
+    assert endpoint_helpers.choose() is a
+
+    # Errors weigh on the score of the faster endpoint
+    a.record_error(grpc.StatusCode.INTERNAL)
+    assert a.failures == 0
+    assert endpoint_helpers.choose() is b
+
+
+def test_abandoned_calls_only_slow_an_endpoint_down(endpoints):
+    (a, _), _ = endpoints
+    a.record_success(0.5)
+    a.record_abandoned(0.2)
+    assert a.ttfb == 0.5
+    a.record_abandoned(1.5)
+    assert a.ttfb == pytest.approx(0.5 + data.ENDPOINT_EWMA_ALPHA)
+
+
+def test_request_errors_are_not_counted(endpoints):
+    (a, _), _ = endpoints
+    a.record_error(grpc.StatusCode.INVALID_ARGUMENT)
+    assert a.error_rate == 0.0
+
+
+def test_breaker(endpoints):
+    (a, b), reachable = endpoints
+
+    async def run() -> None:
+        a.record_success(0.1)
+        b.record_success(0.3)
+        for _ in range(data.ENDPOINT_BREAKER_FAILURES - 1):
+            a.record_error(UNAVAILABLE)
+        assert a.state == endpoint_helpers._CLOSED
+        a.record_error(UNAVAILABLE)
+        assert a.state == endpoint_helpers._OPEN
+        assert endpoint_helpers.choose() is b
+
+        # Open until a probe connects, then a single call is let through
+        await asyncio.sleep(0.01)
+        assert a.state == endpoint_helpers._OPEN
+        reachable.set()
+        while a.state == endpoint_helpers._OPEN:
+            await asyncio.sleep(0)
+        assert endpoint_helpers.choose() is a
+        assert endpoint_helpers.choose() is b
+
+        # A failed trial opens the circuit again
+        a.record_error(UNAVAILABLE)
+        assert a.state == endpoint_helpers._OPEN
+        while a.state == endpoint_helpers._OPEN:
+            await asyncio.sleep(0)
+        assert endpoint_helpers.choose() is a
+
+        # A successful one closes it, forgetting the errors of the outage
+        a.record_success(0.1)
+        assert a.state == endpoint_helpers._CLOSED
+        assert a.error_rate == 0.0
+        assert endpoint_helpers.choose() is a
+
+    asyncio.run(run())
+
+
+def test_all_open(endpoints):
+    (a, b), _ = endpoints
+
+    async def run() -> None:
+        for endpoint in (a, b):
+            for _ in range(data.ENDPOINT_BREAKER_FAILURES):
+                endpoint.record_error(UNAVAILABLE)
+        # The one whose circuit opened first
+        a.opened_at = b.opened_at + 1
+        assert endpoint_helpers.choose() is b
+
+    asyncio.run(run())
+
+
+def test_single_endpoint_never_opens(monkeypatch):
+    monkeypatch.setattr(endpoint_helpers, '_endpoints', None)
+    endpoint_helpers.configure(['a:443'])
+    a, = endpoint_helpers.get_endpoints()
+    for _ in range(data.ENDPOINT_BREAKER_FAILURES * 2):
+        a.record_error(UNAVAILABLE)
+    assert a.state == endpoint_helpers._CLOSED
+    assert endpoint_helpers.choose() is a
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+
+import pytest
+
+import context_helpers
+import hash_helpers
+
+# Test vectors of the RIPEMD-160 specification
+VECTORS = [
+    (b'', '9c1185a5c5e9fc54612808977ee8f548b2258d31'),
+    (b'a', '0bdc9d2d256b3ee9daae347be6f4dc835a467ffe'),
+    (b'abc', '8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'),
+    (b'message digest', '5d0689ef49d2fae572b881b123a85ffa21595f36'),
+    (b'abcdefghijklmnopqrstuvwxyz', 'f71c27109c692c1b56bbdceb5b9d2865b3708dbc'),
+    (b'abcdbcdecdefdefgefghfghighijhijkijkljklmklmnlmnomnopnopq', '12a053384a9c0c88e405a06c27dcf49ada62eb2b'),
+    (b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789', 'b0e20b6e3116640286ed3a87a5713079b21f5189'),
+    (b'1234567890' * 8, '9b752e45573d4b39f4dbd3323cab82bf63326bfb'),
+]
+
+
+def _has_openssl_ripemd160() -> bool:
+    try:
+        hashlib.new('ripemd160')
+        return True
+    except ValueError:
+        return False
+
+
+@pytest.mark.parametrize('message, digest', VECTORS)
+def test_python_implementation(message, digest):
+    assert hash_helpers._ripemd160_python(message).hex() == digest
+
+
+@pytest.mark.skipif(not _has_openssl_ripemd160(), reason='RIPEMD-160 is not available from OpenSSL')
+@pytest.mark.parametrize('length', [0, 1, 55, 56, 57, 63, 64, 65, 119, 120, 128, 1000])
+def test_python_implementation_matches_openssl(length):
+    message = bytes(i % 251 for i in range(length))
+    assert hash_helpers._ripemd160_python(message) == hash_helpers._ripemd160_openssl(message)
+
+
+@pytest.mark.parametrize('implementation', ['_ripemd160_python', '_ripemd160_openssl'])
+def test_device_id_is_stable(monkeypatch, implementation):
+    if implementation == '_ripemd160_openssl' and not _has_openssl_ripemd160():
+        pytest.skip('RIPEMD-160 is not available from OpenSSL')
+    monkeypatch.setattr(hash_helpers, 'ripemd160', getattr(hash_helpers, implementation))
+    assert context_helpers.hash_user_id('amzn1.ask.account.USER') == '171ec17e1ee4912995fbb86ea499bd20a149a627'
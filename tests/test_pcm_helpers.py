@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+
+import data
+import pcm_helpers
+
+np = pytest.importorskip('numpy')
+
+SAMPLE_RATE = data.DEFAULT_AUDIO_SAMPLE_RATE
+TARGET_PEAK = 32767 * 10 ** (data.AUDIO_TARGET_PEAK / 20)
+
+
+def _tone(seconds: float, peak: float) -> 'numpy.ndarray':
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return np.rint(peak * np.sin(2 * np.pi * 440 * t)).astype('<i2')
+
+
+def _silence(seconds: float) -> 'numpy.ndarray':
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype='<i2')
+
+
+def _process(samples: 'numpy.ndarray', chunk: int = 1234) -> 'numpy.ndarray':
+    processor = pcm_helpers.new_pcm_processor()
+    pcm = samples.tobytes()
+    out = b''.join(processor.process(pcm[i:i + chunk]) for i in range(0, len(pcm), chunk)) + processor.flush()
+    return np.frombuffer(out, dtype='<i2')
+
+
+def _peak(samples: 'numpy.ndarray') -> int:
+    return int(np.abs(samples.astype(np.int32)).max())
+
+
+@pytest.mark.parametrize('peak', [32767, 30000, int(TARGET_PEAK) + 1])
+def test_loud_audio_is_not_attenuated(peak):
+    samples = _tone(1, peak)
+    assert np.array_equal(_process(samples), samples)
+
+
+def test_quiet_audio_is_amplified_to_the_target():
+    out = _process(_tone(1, 8000))
+    assert TARGET_PEAK - 2 <= _peak(out) <= TARGET_PEAK + 1
+
+
+def test_gain_is_capped():
+    out = _process(_tone(1, 1000))
+    assert _peak(out) == pytest.approx(1000 * data.AUDIO_MAX_GAIN, abs=2)
+
+
+def test_later_peaks_lower_the_gain():
+    out = _process(np.concatenate((_tone(1, 8000), _tone(1, 16000), _tone(1, 30000))))
+    assert _peak(out[:SAMPLE_RATE]) == pytest.approx(TARGET_PEAK, abs=2)
+    assert _peak(out[SAMPLE_RATE:2 * SAMPLE_RATE]) == pytest.approx(TARGET_PEAK, abs=2)
+    # But not below 1, when they are already above the target
+    assert _peak(out[2 * SAMPLE_RATE:]) == 30000
+
+
+def test_silence_is_trimmed():
+    padding = SAMPLE_RATE * data.AUDIO_SILENCE_PADDING_MS // 1000
+    max_pause = SAMPLE_RATE * data.AUDIO_MAX_PAUSE_MS // 1000
+    samples = np.concatenate((_silence(2), _tone(1, 30000), _silence(3), _tone(1, 30000), _silence(2)))
+
+    out = _process(samples)
+    # A tone starts and ends on quiet samples
+    assert len(out) == pytest.approx(padding + SAMPLE_RATE + 3 * SAMPLE_RATE + SAMPLE_RATE + padding, abs=2)
+    # Pauses are kept whole, beyond `max_pause` as digital silence
+    assert not out[padding + SAMPLE_RATE + max_pause:padding + 4 * SAMPLE_RATE].any()
+
+
+def test_all_silent():
+    assert len(_process(_silence(1))) == 0
+
+
+def test_find_cuts_in_pauses():
+    samples = np.concatenate((_tone(4, 20000), _silence(0.2), _tone(4, 20000), _silence(0.2), _tone(3, 20000)))
+    pauses = [(4 * SAMPLE_RATE, int(4.2 * SAMPLE_RATE)), (int(8.2 * SAMPLE_RATE), int(8.4 * SAMPLE_RATE))]
+
+    cuts = pcm_helpers.find_cuts(samples.tobytes(), 3, SAMPLE_RATE)
+    assert len(cuts) == 2
+    assert all(start <= cut < end for cut, (start, end) in zip(cuts, pauses))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import cProfile
+import json
+import threading
+
+import pytest
+
+import async_helpers
+import profiling_helpers
+
+
+@pytest.fixture
+def sampled(monkeypatch):
+    """Profile every invocation, collecting the summaries instead of logging them."""
+    summaries = []
+    monkeypatch.setattr(profiling_helpers, '_SAMPLE_RATE', 1.0)
+    monkeypatch.setattr(profiling_helpers._Session, 'write', lambda self, summary: summaries.append(summary))
+    return summaries
+
+
+def _work() -> int:
+    return sum(i * i for i in range(20000))
+
+
+def _invocation() -> int:
+    async def assist() -> int:
+        with profiling_helpers.phase('assist'):
+            blob = bytearray(1 << 20)
+            return await async_helpers.run_blocking(_work) + len(blob)
+
+    return async_helpers.run(assist())
+
+
+def test_not_sampled(monkeypatch):
+    monkeypatch.setattr(profiling_helpers, '_SAMPLE_RATE', 0.0)
+    with profiling_helpers.session('test'):
+        assert profiling_helpers._current.get() is None
+        assert profiling_helpers.wrap(_work) is _work
+
+
+@pytest.mark.parametrize('process_wide', [False, True])
+def test_summary(monkeypatch, sampled, process_wide):
+    monkeypatch.setattr(profiling_helpers, '_PROCESS_WIDE', process_wide)
+    with profiling_helpers.session('test'):
+        _invocation()
+
+    summary, = sampled
+    json.dumps(summary)
+    assert summary['profile'].endswith('-test')
+    assert summary['phase_peak_kib']['assist'] >= 1024
+    assert any('test_profiling_helpers' in function['site'] for function in summary['functions'])
+
+
+def test_one_session_at_a_time(sampled):
+    with profiling_helpers.session('outer'):
+        with profiling_helpers.session('inner'):
+            pass
+    assert [summary['profile'].split('-', 1)[1] for summary in sampled] == ['outer']
+
+
+class _ActiveElsewhere(cProfile.Profile):
+    """A profiler that cannot be enabled, as on Python 3.12 and later when another one is already active."""
+
+    def enable(self, *args, **kwargs) -> None:
+        raise ValueError('Another profiling tool is already active')
+
+
+@pytest.mark.parametrize('process_wide', [False, True])
+def test_profiler_unavailable(monkeypatch, sampled, process_wide):
+    monkeypatch.setattr(profiling_helpers, '_PROCESS_WIDE', process_wide)
+    monkeypatch.setattr(profiling_helpers.cProfile, 'Profile', _ActiveElsewhere)
+
+    # The invocation runs to completion, and its memory is still sampled
+    with profiling_helpers.session('test'):
+        assert _invocation() == _work() + (1 << 20)
+
+    summary, = sampled
+    assert summary['functions'] == []
+    assert summary['phase_peak_kib']['assist'] >= 1024
+
+
+def test_process_wide_profiler_is_single(monkeypatch, sampled):
+    """From Python 3.12 no other profiler may be enabled while the invocation's one is."""
+    monkeypatch.setattr(profiling_helpers, '_PROCESS_WIDE', True)
+    enabled = []
+    lock = threading.Lock()
+
+    class Counting(cProfile.Profile):
+        def enable(self, *args, **kwargs) -> None:
+            with lock:
+                if enabled:
+                    raise ValueError('Another profiling tool is already active')
+                enabled.append(self)
+            super().enable(*args, **kwargs)
+
+        def disable(self) -> None:
+            super().disable()
+            with lock:
+                if self in enabled:
+                    enabled.remove(self)
+
+    monkeypatch.setattr(profiling_helpers.cProfile, 'Profile', Counting)
+    with profiling_helpers.session('test'):
+        _invocation()
+
+    summary, = sampled
+    assert any('test_profiling_helpers' in function['site'] for function in summary['functions'])
+
+
+def test_peak_cannot_be_reset(monkeypatch, sampled):
+    """Before Python 3.9 tracemalloc has no `reset_peak`: phases report the peak since the invocation started."""
+    monkeypatch.delattr(profiling_helpers.tracemalloc, 'reset_peak')
+    with profiling_helpers.session('test'):
+        _invocation()
+
+    summary, = sampled
+    assert summary['phase_peak_kib']['assist'] >= 1024
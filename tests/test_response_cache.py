@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+
+import harness
+from conftest import make_event
+
+import assistant
+import data
+import response_cache
+import response_mode_helpers
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setenv('RESPONSE_CACHE_ENABLED', 'true')
+    monkeypatch.setattr(assistant, '_response_cache', response_cache.ResponseCache())
+
+
+def _key(user: str = 'USER', query: str = 'Hello', mode: str = response_mode_helpers.AUDIO, **kwargs) -> str:
+    handler_input = harness.make_handler_input(make_event(user=user, **kwargs))
+    return response_cache.get_key(handler_input, query, mode)
+
+
+def test_normalize_query():
+    assert response_cache.normalize_query("  What's the  WEATHER? ") == 'whats the weather'
+
+
+def test_get_ttl(cache):
+    assert response_cache.get_ttl(harness.make_handler_input(make_event('launch')), 'Hello') is not None
+    assert response_cache.get_ttl(harness.make_handler_input(make_event('search')), 'Hello') is None
+
+
+def test_get_ttl_disabled(monkeypatch):
+    monkeypatch.delenv('RESPONSE_CACHE_ENABLED', raising=False)
+    assert response_cache.get_ttl(harness.make_handler_input(make_event('launch')), 'Hello') is None
+
+
+def test_key_is_shared_across_users():
+    assert _key(user='A') == _key(user='B')
+    assert _key(query='Hello!') == _key(query='hello')
+
+
+def test_key_depends_on_request():
+    assert _key() != _key(query='Goodbye')
+    assert _key() != _key(mode=response_mode_helpers.TEXT)
+    assert _key() != _key(session_attributes={'conversation_state': '1.AAAA'})
+
+
+def test_cached_response_keeps_no_user_state():
+    assert 'conversation_state' not in response_cache.CachedResponse.__slots__
+
+
+def test_conversation_state_does_not_cross_users(backends, cache):
+    first = harness.make_handler_input(make_event(user='A'))
+    assistant.assist(first, 'Hello')
+    assert first.attributes_manager.session_attributes.get('conversation_state')
+    calls = backends.assistant.calls
+
+    second = harness.make_handler_input(make_event(user='B'))
+    response = assistant.assist(second, 'Hello')
+    # Answered from the cache, without touching the other user's conversation
+    assert backends.assistant.calls == calls
+    assert '<audio' in response.output_speech.ssml
+    assert 'conversation_state' not in second.attributes_manager.session_attributes
+
+
+def test_object_deleted_by_another_container(backends, cache):
+    assistant.assist(harness.make_handler_input(make_event(user='A')), 'Hello')
+    key, = [key for _, key in backends.s3.objects if key.startswith(data.RESPONSE_CACHE_PREFIX)]
+    calls = backends.assistant.calls
+
+    # Another container's index evicted the same key, and deleted the shared object
+    backends.s3.objects.clear()
+    response = assistant.assist(harness.make_handler_input(make_event(user='B')), 'Hello')
+    assert backends.assistant.calls == calls + 1
+    assert '<audio' in response.output_speech.ssml
+    assert any(stored == key for _, stored in backends.s3.objects)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import http.client
+import socket
+import threading
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def blocked_server(monkeypatch):
+    """A server of one thread and one queue slot, whose requests wait until `release` is set."""
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def dispatch(self, headers: dict, body: str) -> dict:
+        started.release()
+        release.wait(10)
+        return {}
+
+    monkeypatch.setattr(server.PooledHTTPServer, 'dispatch', dispatch)
+    httpd = server.PooledHTTPServer(('127.0.0.1', 0), threads=1, verify=False, queued=1)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.01})
+    thread.start()
+    yield httpd, started, release
+    release.set()
+    httpd.shutdown()
+    thread.join()
+    httpd.server_close()
+
+
+def _post(httpd: server.PooledHTTPServer) -> http.client.HTTPConnection:
+    connection = http.client.HTTPConnection(*httpd.server_address, timeout=10)
+    connection.request('POST', '/', body=b'{}', headers={'Content-Type': 'application/json', 'Connection': 'close'})
+    return connection
+
+
+def _wait_for_accept(httpd: server.PooledHTTPServer, slots: int) -> None:
+    deadline = time.monotonic() + 5
+    while httpd._slots._value != slots:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_overload_is_rejected(blocked_server):
+    httpd, started, release = blocked_server
+    running = _post(httpd)
+    assert started.acquire(timeout=5)
+    queued = _post(httpd)
+    _wait_for_accept(httpd, 0)
+
+    # Answered as soon as accepted, without reading the request
+    with socket.create_connection(httpd.server_address, timeout=10) as rejected:
+        response = http.client.HTTPResponse(rejected)
+        response.begin()
+        assert response.status == 503
+        assert response.getheader('Retry-After') == '1'
+
+    release.set()
+    assert running.getresponse().status == 200
+    assert queued.getresponse().status == 200
+
+    # Slots are given back once requests are done
+    _wait_for_accept(httpd, 2)
+    assert _post(httpd).getresponse().status == 200
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Francesco Circhetta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import gettext
+import importlib.util
+import os
+
+import pytest
+
+import context_helpers
+import data
+
+_spec = importlib.util.spec_from_file_location('compile_locales', os.path.join('locales', 'compile.py'))
+compile_locales = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(compile_locales)
+
+
+@pytest.mark.parametrize('po', compile_locales.catalogs(), ids=os.path.basename)
+def test_compiled_catalogs_are_current(po):
+    with open(po[:-len('.po')] + '.mo', 'rb') as fp:
+        assert fp.read() == compile_locales.to_mo(compile_locales.parse_po(po))
+
+
+def test_catalogs_are_loaded():
+    assert len(compile_locales.catalogs()) == 3
+    translations = context_helpers.get_translations('it-IT')
+    assert isinstance(translations, gettext.GNUTranslations)
+    assert translations.gettext(data.ERROR_GENERIC) == 'Qualcosa è andato storto, riprova più tardi!!'
+
+
+def test_unknown_locale_falls_back():
+    assert context_helpers.get_translations('en-US').gettext(data.ERROR_GENERIC) == data.ERROR_GENERIC